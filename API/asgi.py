@@ -0,0 +1,244 @@
+"""
+This file is the ASGI entry point of our API, for an asyncio server:
+    uvicorn API.asgi:app
+The routes a check-in rush leans on (card swipes, user and badge
+lookups, progress, attendance) are served here with async DB calls
+(db/async_data.py), so one process keeps many requests in flight while
+Mongo answers. Every other route goes to the Flask app in endpoints.py,
+run in a thread pool, so this serves the same API as the sync path.
+"""
+import asyncio
+import functools
+import contextlib
+from http import HTTPStatus
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+
+import db.data as db
+import db.db_connect as dbc
+import db.async_connect as adbc
+import db.async_data as adata
+import db.instrument as instrument
+import db.progress as progress
+import API.metrics as metrics
+import API.endpoints as ep
+
+# threads serving the Flask routes:
+WSGI_THREADS = 10
+# what flask_cors answers, so both paths do the same:
+CORS_METHODS = "DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"
+
+
+def flask_rule(path):
+    """
+    A route's path as the Flask app labels it, for stats and metrics.
+    """
+    return path.replace("{", "<").replace("}", ">")
+
+
+def with_cors(request, response):
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    if request.method == "OPTIONS":
+        response.headers["Access-Control-Allow-Methods"] = CORS_METHODS
+        requested = request.headers.get("Access-Control-Request-Headers")
+        if requested:
+            response.headers["Access-Control-Allow-Headers"] = requested
+    return response
+
+
+def endpoint(handler):
+    """
+    Serve a route with `await handler(request, **path_params)`, which
+    returns what to send or raises HTTPException. Like the Flask app,
+    we answer CORS preflights, send errors as {"message": ...}, report
+    the DB work in Server-Timing and count the request in our metrics.
+    """
+    @functools.wraps(handler)
+    async def serve(request):
+        if request.method == "OPTIONS":
+            return with_cors(request, Response())
+        instrument.start_request()
+        metrics.request_started()
+        try:
+            try:
+                response = await handler(request, **request.path_params)
+            except HTTPException as err:
+                response = JSONResponse({"message": err.detail},
+                                        err.status_code)
+            if not isinstance(response, Response):
+                response = JSONResponse(response)
+            rule = flask_rule(request.scope["route"].path)
+            stats = instrument.end_request(f"{request.method} {rule}")
+            response.headers["Server-Timing"] = instrument.server_timing(
+                stats)
+            instrument.log_if_slow(f"{request.method} {request.url.path}",
+                                   stats)
+            metrics.observe(request.method, rule, response.status_code,
+                            stats)
+            return with_cors(request, response)
+        finally:
+            metrics.request_finished()
+    return serve
+
+
+def conditional(request, data, etag):
+    """
+    Tag a GET response with its ETag, and answer 304 Not Modified
+    when the client already has this version.
+    """
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+    tags = [tag.strip().removeprefix("W/").strip('"') for tag in
+            request.headers.get("If-None-Match", "").split(",")]
+    if etag in tags or "*" in tags:
+        return Response(status_code=HTTPStatus.NOT_MODIFIED, headers=headers)
+    return JSONResponse(data, headers=headers)
+
+
+def not_found(message):
+    return HTTPException(HTTPStatus.NOT_FOUND, message)
+
+
+async def json_names(request):
+    """
+    Read a JSON array of names, as `endpoints.bulk_items()` does.
+    """
+    try:
+        items = await request.json()
+    except ValueError:
+        items = None
+    if not isinstance(items, list) or len(items) > ep.MAX_BULK:
+        raise HTTPException(HTTPStatus.BAD_REQUEST, "Send a JSON array of "
+                            f"up to {ep.MAX_BULK} items.")
+    if not all(isinstance(item, str) for item in items):
+        raise HTTPException(HTTPStatus.BAD_REQUEST,
+                            "Each item must be a name.")
+    return items
+
+
+@endpoint
+async def health(request):
+    return {"status": "ok"}
+
+
+@endpoint
+async def ready(request):
+    try:
+        await adata.ping()
+    except Exception:
+        raise HTTPException(HTTPStatus.SERVICE_UNAVAILABLE,
+                            "Database not reachable.")
+    return ep.ready_status()
+
+
+@endpoint
+async def get_user(request, username):
+    user = await adata.get_user_by_id(username)
+    if user is None:
+        raise not_found("User does not exist.")
+    return conditional(request, user, db.content_etag(user))
+
+
+@endpoint
+async def get_user_by_barcode(request, barcode):
+    user = await adata.get_user_by_barcode(barcode)
+    if user is None:
+        raise not_found("No user with this barcode.")
+    return conditional(request, user, db.content_etag(user))
+
+
+@endpoint
+async def get_user_progress(request, netid):
+    badges = await adata.get_progress(netid)
+    if not badges and not await adata.netid_exists(netid):
+        raise not_found("User does not exist.")
+    return conditional(request, badges, db.content_etag(badges))
+
+
+@endpoint
+async def get_user_badge_progress(request, netid, badgename):
+    if not await adata.netid_exists(netid):
+        raise not_found("User does not exist.")
+    badge = await adata.get_badge_progress(netid, badgename)
+    if badge is None:
+        raise not_found("Badge does not exist or requires nothing.")
+    return conditional(request, badge, db.content_etag(badge))
+
+
+@endpoint
+async def get_badge(request, badgename):
+    badge = await adata.get_badge_by_id(badgename)
+    if badge is None:
+        raise not_found("Badge does not exist.")
+    return conditional(request, badge, db.content_etag(badge))
+
+
+@endpoint
+async def get_badge_details(request, badgename):
+    badge = await adata.get_badge_details(badgename)
+    if badge is None:
+        raise not_found("Badge does not exist.")
+    return conditional(request, badge, db.content_etag(badge))
+
+
+def attend(kind):
+    @endpoint
+    async def post(request, netid, **params):
+        name = params[f"{kind}name"]
+        ret = await adata.record_attendance(netid, kind, name)
+        if ret == db.NOT_FOUND:
+            raise not_found(f"User or {kind} does not exist.")
+        return f"{netid} attended {name}."
+    return post
+
+
+def check_in(kind):
+    @endpoint
+    async def post(request, **params):
+        name = params[f"{kind}name"]
+        netids = await json_names(request)
+        ret, statuses = await adata.check_in(kind, name, netids)
+        if ret == db.NOT_FOUND:
+            raise not_found(f"The {kind} does not exist.")
+        return ep.bulk_report(netids, statuses)
+    return post
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # the sync client starts our index builds, off the startup path
+    # (see db_connect.build_indexes_later()):
+    await asyncio.to_thread(dbc.get_client)
+    yield
+    await adbc.close_client()
+
+
+GET = ["GET", "HEAD", "OPTIONS"]
+POST = ["POST", "OPTIONS"]
+
+routes = [
+    Route("/health", health, methods=GET),
+    Route("/ready", ready, methods=GET),
+    Route("/users/list/{username}", get_user, methods=GET),
+    Route("/users/barcode/{barcode}", get_user_by_barcode, methods=GET),
+    Route("/users/progress/{netid}", get_user_progress, methods=GET),
+    Route("/users/progress/{netid}/{badgename}", get_user_badge_progress,
+          methods=GET),
+    Route("/badges/list/{badgename}", get_badge, methods=GET),
+    Route("/badges/details/{badgename}", get_badge_details, methods=GET),
+    Route("/trainings/attend/{trainingname}/{netid}",
+          attend(progress.TRAINING), methods=POST),
+    Route("/workshops/attend/{workshopname}/{netid}",
+          attend(progress.WORKSHOP), methods=POST),
+    Route("/trainings/checkin/{trainingname}", check_in(progress.TRAINING),
+          methods=POST),
+    Route("/workshops/checkin/{workshopname}", check_in(progress.WORKSHOP),
+          methods=POST),
+    # everything else:
+    Mount("/", WSGIMiddleware(ep.app, workers=WSGI_THREADS)),
+]
+
+app = Starlette(routes=routes, lifespan=lifespan)
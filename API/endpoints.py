@@ -3,17 +3,58 @@ This is the file containing all of the endpoints for our flask app.
 The endpoint called `endpoints` will return all available endpoints.
 """
 
+import json
 from http import HTTPStatus
-from flask import Flask
+from flask import Flask, Response, has_request_context, request
 from flask_cors import CORS
-from flask_restx import Resource, Api
+from flask_restx import Resource, Api, reqparse, inputs, fields
 import werkzeug.exceptions as wz
 import db.data as db
+import db.watcher as watcher
+import db.instrument as instrument
+import db.progress as progress
+import db.attendance as attendance
+import API.metrics as metrics
 
 app = Flask(__name__)
 CORS(app)
 api = Api(app)
 
+if watcher.WATCH_ON:
+    # keep our catalog caches in step with writes by other workers:
+    watcher.start()
+
+
+@app.before_request
+def start_db_stats():
+    instrument.start_request()
+    metrics.request_started()
+
+
+@app.after_request
+def add_server_timing(response):
+    """
+    Report the DB work of each request in a Server-Timing header,
+    and log requests slower than MAYS_SLOW_REQUEST_MS.
+    A streamed listing reads the db after this runs: its queries
+    are not counted.
+    """
+    rule = request.url_rule.rule if request.url_rule else 'unmatched'
+    stats = instrument.end_request(f'{request.method} {rule}')
+    if stats is not None:
+        response.headers['Server-Timing'] = instrument.server_timing(stats)
+        instrument.log_if_slow(f"{request.method} {request.full_path}",
+                               stats)
+    metrics.observe(request.method, rule, response.status_code, stats)
+    return response
+
+
+@app.teardown_request
+def end_db_stats(exc):
+    # this runs even when the request failed:
+    metrics.request_finished()
+
+
 ns_user = api.namespace('users', description='user related endpoints')
 ns_badge = api.namespace('badges', description='badge related endpoints')
 ns_training = api.namespace('trainings',
@@ -21,6 +62,244 @@ ns_training = api.namespace('trainings',
 ns_workshop = api.namespace('workshops',
                             description='workshop related endpoints')
 
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK = 64 * 1024
+NDJSON = 'ndjson'
+JSON = 'json'
+
+list_parser = reqparse.RequestParser()
+list_parser.add_argument('limit', type=int, location='args',
+                         help=f'Page size, up to {MAX_PAGE_SIZE}.')
+list_parser.add_argument('after', type=str, location='args',
+                         help='Start after this key: the X-Next-Cursor '
+                              'header of the previous page.')
+list_parser.add_argument('fields', type=str, location='args',
+                         help='Comma-separated fields to return.')
+list_parser.add_argument('stream', type=str, location='args',
+                         choices=(NDJSON, JSON),
+                         help='Stream the records as they are read: '
+                              'one JSON record per line (ndjson), '
+                              'or the usual JSON object (json).')
+
+
+def list_args():
+    """
+    Read the paging and projection arguments of a list request.
+    Resources are also called directly, outside of a request:
+    then there are no arguments and the whole list is returned.
+    """
+    if not has_request_context():
+        return {}
+    args = list_parser.parse_args()
+    limit = args['limit']
+    if limit is not None and not 0 < limit <= MAX_PAGE_SIZE:
+        raise (wz.BadRequest(f"limit must be from 1 to {MAX_PAGE_SIZE}."))
+    fields = args['fields'].split(',') if args['fields'] else None
+    return {'limit': limit, 'after': args['after'], 'fields': fields,
+            'stream': args['stream']}
+
+
+def chunked(pieces):
+    """
+    Join small strings into chunks of about STREAM_CHUNK characters,
+    so we don't write one tiny chunk per record.
+    """
+    chunk = []
+    size = 0
+    for piece in pieces:
+        chunk.append(piece)
+        size += len(piece)
+        if size >= STREAM_CHUNK:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield ''.join(chunk)
+
+
+def json_object_pieces(docs, key_nm):
+    """
+    The pieces of the usual `{key: record, ...}` listing.
+    """
+    yield '{'
+    sep = ''
+    for doc in docs:
+        yield f'{sep}{json.dumps(str(doc[key_nm]))}: {json.dumps(doc)}'
+        sep = ', '
+    yield '}\n'
+
+
+def stream_response(collect_nm, stream, args):
+    """
+    Send a listing while reading it from the db: time to first byte
+    and worker memory do not depend on the size of the collection.
+    A full page comes with a cursor to the next one, as in
+    `list_response()`.
+    """
+    headers = {}
+    cursor = db.next_cursor(collect_nm, **args)
+    if cursor is not None:
+        headers['X-Next-Cursor'] = str(cursor)
+    docs = db.stream_docs(collect_nm, **args)
+    if stream == NDJSON:
+        pieces = (json.dumps(doc) + '\n' for doc in docs)
+        mimetype = 'application/x-ndjson'
+    else:
+        pieces = json_object_pieces(docs, db.KEY_FIELDS[collect_nm])
+        mimetype = 'application/json'
+    return Response(chunked(pieces), mimetype=mimetype, headers=headers)
+
+
+MAX_BULK = 1000
+
+bulk_parser = reqparse.RequestParser()
+bulk_parser.add_argument('ordered', type=inputs.boolean, location='args',
+                         default=False,
+                         help='Stop at the first failed item.')
+
+name_list = api.schema_model('Names', {'type': 'array',
+                                       'items': {'type': 'string'}})
+rename_item = api.model('Rename', {
+    'old': fields.String(required=True),
+    'new': fields.String(required=True),
+})
+new_user_item = api.model('NewUser', {
+    'netid': fields.String(required=True),
+    'firstname': fields.String(required=True),
+    'lastname': fields.String(required=True),
+    'barcode': fields.String,
+})
+new_badge_item = api.model('NewBadge', {
+    'badgename': fields.String(required=True),
+    'desc': fields.String,
+})
+
+
+def bulk_items(required=None):
+    """
+    Read the JSON array of a bulk request. Items are names or,
+    if `required` fields are given, objects that must have them
+    (as strings: they are keys and names).
+    """
+    items = request.get_json(silent=True)
+    if not isinstance(items, list) or len(items) > MAX_BULK:
+        raise (wz.BadRequest(f"Send a JSON array of up to {MAX_BULK} items."))
+    for item in items:
+        if required is None and not isinstance(item, str):
+            raise (wz.BadRequest("Each item must be a name."))
+        if required is not None and not (
+                isinstance(item, dict)
+                and all(isinstance(item.get(fld), str) for fld in required)):
+            raise (wz.BadRequest(f"Each item needs {', '.join(required)}, "
+                                 "as strings."))
+    return items
+
+
+def bulk_report(keys, statuses):
+    """
+    The status of each item of a bulk request, in request order.
+    """
+    return [{"key": key, "status": db.STATUS_NAMES[status]}
+            for key, status in zip(keys, statuses)]
+
+
+def bulk_add_names(collect_nm):
+    """
+    Add many catalog entries given by name.
+    """
+    names = bulk_items()
+    key_nm = db.KEY_FIELDS[collect_nm]
+    statuses = db.bulk_add(collect_nm, [{key_nm: name} for name in names],
+                           bulk_parser.parse_args()['ordered'])
+    return bulk_report(names, statuses)
+
+
+def bulk_rename(collect_nm):
+    """
+    Rename many records given as {"old": ..., "new": ...} items.
+    """
+    renames = [(item['old'], item['new'])
+               for item in bulk_items(['old', 'new'])]
+    statuses = db.bulk_rename(collect_nm, renames,
+                              bulk_parser.parse_args()['ordered'])
+    return bulk_report([old for old, new in renames], statuses)
+
+
+def bulk_delete(collect_nm):
+    """
+    Delete many records given by key.
+    """
+    keys = bulk_items()
+    statuses = db.bulk_delete(collect_nm, keys,
+                              bulk_parser.parse_args()['ordered'])
+    return bulk_report(keys, statuses)
+
+
+def renamed(old, new, touched):
+    """
+    The answer to a rename: how many records it changed, references
+    included.
+    """
+    return f"{old} updated to {new}; {sum(touched.values())} records changed."
+
+
+def attend(kind, name, netid):
+    """
+    Record that one user attended a training or workshop.
+    """
+    ret = attendance.record_attendance(netid, kind, name)
+    if ret == db.NOT_FOUND:
+        raise (wz.NotFound(f"User or {kind} does not exist."))
+    return f"{netid} attended {name}."
+
+
+def check_in(kind, name):
+    """
+    Record everyone at a training or workshop session, from a JSON
+    array of netids.
+    """
+    netids = bulk_items()
+    ret, statuses = attendance.check_in(kind, name, netids)
+    if ret == db.NOT_FOUND:
+        raise (wz.NotFound(f"The {kind} does not exist."))
+    return bulk_report(netids, statuses)
+
+
+def attendees(kind, name):
+    """
+    Who attended a training or workshop, and when.
+    """
+    docs = attendance.get_attendees(kind, name)
+    if not docs and not attendance.SESSION_EXISTS[kind](name):
+        raise (wz.NotFound(f"The {kind} does not exist."))
+    return docs
+
+
+def conditional(data, etag, headers={}):
+    """
+    Tag a GET response with its ETag, and answer 304 Not Modified
+    (with no body) when the client already has this version.
+    Outside of a request we just return the data.
+    """
+    if not has_request_context():
+        return data
+    headers = {**headers, 'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+    if request.if_none_match.contains(etag) or request.if_none_match.star_tag:
+        return None, HTTPStatus.NOT_MODIFIED, headers
+    return data, HTTPStatus.OK, headers
+
+
+def list_response(docs, args, etag=None):
+    """
+    Return a listing; a full page comes with a cursor to the next one.
+    """
+    headers = {}
+    if args.get('limit') and len(docs) == args['limit']:
+        headers['X-Next-Cursor'] = str(next(reversed(docs)))
+    if etag is None:
+        etag = db.content_etag(docs)
+    return conditional(docs, etag, headers)
+
 
 @api.route('/endpoints')
 class Endpoints(Resource):
@@ -38,6 +317,77 @@ class Endpoints(Resource):
         return {"Available endpoints": endpoints}
 
 
+@api.route('/health')
+class Health(Resource):
+    """
+    A liveness check: the app is up. This does not touch the database.
+    """
+
+    @api.response(HTTPStatus.OK, 'Success')
+    def get(self):
+        """
+        Returns the status of the app.
+        """
+        return {"status": "ok"}
+
+
+@api.route('/stats')
+class Stats(Resource):
+    """
+    Performance counters of the worker process that answers.
+    """
+
+    @api.response(HTTPStatus.OK, 'Success')
+    def get(self):
+        """
+        Returns DB operation and per-route timings, pool and cache stats.
+        """
+        return {"db_ops": instrument.op_stats(),
+                "routes": instrument.route_stats(),
+                "pool": db.pool_stats(),
+                "caches": db.cache_stats()}
+
+
+@api.route('/metrics')
+class Metrics(Resource):
+    """
+    Prometheus metrics of the app: all workers added up.
+    """
+
+    @api.response(HTTPStatus.OK, 'Success')
+    def get(self):
+        """
+        Returns request, DB, pool and cache metrics as Prometheus text.
+        """
+        return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@api.route('/ready')
+class Ready(Resource):
+    """
+    A readiness check: the app can reach the database.
+    Indexes this worker could not build are listed too.
+    """
+
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.SERVICE_UNAVAILABLE, 'Database unavailable')
+    def get(self):
+        """
+        Returns the status of the database connection.
+        """
+        if not db.db_ready():
+            raise (wz.ServiceUnavailable("Database not reachable."))
+        return ready_status()
+
+
+def ready_status():
+    status = {"status": "ready"}
+    failed = db.failed_indexes()
+    if failed:
+        status["failed_indexes"] = failed
+    return status
+
+
 @api.route('/login/<username>/<password>')
 class Login(Resource):
     """
@@ -88,17 +438,24 @@ class ListUsers(Resource):
     This endpoint return a list of all the users.
     """
 
+    @api.expect(list_parser)
     @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.NOT_MODIFIED, 'Not Modified')
     @api.response(HTTPStatus.NOT_FOUND, 'Not Found')
+    @api.response(HTTPStatus.BAD_REQUEST, 'Bad paging arguments')
     def get(self):
         """
-        Returns list of all users.
+        Returns list of all users, or one page of them.
         """
-        users = db.get_users()
+        args = list_args()
+        stream = args.pop('stream', None)
+        if stream:
+            return stream_response(db.USERS, stream, args)
+        users = db.get_users(**args)
         if users is None:
             raise (wz.NotFound("List of users db not found."))
         else:
-            return users
+            return list_response(users, args)
 
 
 # user_parser = reqparse.RequestParser()
@@ -129,7 +486,7 @@ class CreateUser(Resource):
         if ret == db.NOT_FOUND:
             raise (wz.NotFound("List of users db not found."))
         elif ret == db.DUPLICATE:
-            raise (wz.NotAcceptable("User name already exists."))
+            raise (wz.NotAcceptable("User name or barcode already exists."))
         else:
             return f"{netid} added."
 
@@ -141,6 +498,7 @@ class GetUsersByID(Resource):
     """
 
     @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.NOT_MODIFIED, 'Not Modified')
     @api.response(HTTPStatus.NOT_FOUND, 'Not Found')
     def get(self, username):
         """
@@ -150,7 +508,106 @@ class GetUsersByID(Resource):
         if users is None:
             raise (wz.NotFound("User does not exist."))
         else:
-            return users
+            return conditional(users, db.content_etag(users))
+
+
+@ns_user.route('/barcode/<barcode>')
+class GetUserByBarcode(Resource):
+    """
+    This endpoint identifies a user from a card swipe.
+    """
+
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.NOT_MODIFIED, 'Not Modified')
+    @api.response(HTTPStatus.NOT_FOUND, 'Not Found')
+    def get(self, barcode):
+        """
+        Returns the netid and name of the user with this barcode.
+        """
+        user = db.get_user_by_barcode(barcode)
+        if user is None:
+            raise (wz.NotFound("No user with this barcode."))
+        else:
+            return conditional(user, db.content_etag(user))
+
+
+@ns_user.route('/progress/<netid>')
+class GetUserProgress(Resource):
+    """
+    This endpoint returns a user's badge dashboard.
+    """
+
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.NOT_MODIFIED, 'Not Modified')
+    @api.response(HTTPStatus.NOT_FOUND, 'Not Found')
+    def get(self, netid):
+        """
+        Returns the user's progress towards each badge they have started:
+        the trainings and workshops left, and whether it is earned.
+        """
+        badges = progress.get_progress(netid)
+        if not badges and not db.netid_exists(netid):
+            raise (wz.NotFound("User does not exist."))
+        return conditional(badges, db.content_etag(badges))
+
+
+@ns_user.route('/progress/<netid>/<badgename>')
+class GetUserBadgeProgress(Resource):
+    """
+    This endpoint returns how far a user is from earning a badge.
+    """
+
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.NOT_MODIFIED, 'Not Modified')
+    @api.response(HTTPStatus.NOT_FOUND, 'Not Found')
+    def get(self, netid, badgename):
+        """
+        Returns how many more trainings and workshops the user needs
+        for this badge, and which.
+        """
+        if not db.netid_exists(netid):
+            raise (wz.NotFound("User does not exist."))
+        badge = attendance.get_badge_progress(netid, badgename)
+        if badge is None:
+            raise (wz.NotFound("Badge does not exist or requires nothing."))
+        return conditional(badge, db.content_etag(badge))
+
+
+@ns_user.route('/completed/<netid>')
+class GetUserCompleted(Resource):
+    """
+    This endpoint returns what a user has completed.
+    """
+
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.NOT_FOUND, 'Not Found')
+    def get(self, netid):
+        """
+        Returns the trainings and workshops the user has attended.
+        """
+        completed = attendance.get_completed(netid)
+        if not any(completed.values()) and not db.netid_exists(netid):
+            raise (wz.NotFound("User does not exist."))
+        return completed
+
+
+@ns_user.route('/attendance/<netid>')
+class GetUserAttendance(Resource):
+    """
+    This endpoint returns a user's attendance history.
+    """
+
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.NOT_FOUND, 'Not Found')
+    def get(self, netid):
+        """
+        Returns each training and workshop the user attended, and when,
+        latest first.
+        """
+        events = attendance.get_attendance(netid)
+        if not events and not db.netid_exists(netid):
+            raise (wz.NotFound("User does not exist."))
+        return events
 
 
 @ns_user.route('/update/<oldnetid>/<newnetid>')
@@ -166,13 +623,13 @@ class UpdateUser(Resource):
         """
         This method updates old user name to new user name.
         """
-        ret = db.update_user(oldnetid, newnetid)
+        ret, touched = db.rename(db.USERS, oldnetid, newnetid)
         if ret == db.NOT_FOUND:
             raise (wz.NotFound("User not found."))
         elif ret == db.DUPLICATE:
             raise (wz.NotAcceptable("User name already exists."))
         else:
-            return f"{oldnetid} updated to {newnetid}."
+            return renamed(oldnetid, newnetid, touched)
 
 
 @ns_user.route('/delete/<username>')
@@ -195,6 +652,48 @@ class DeleteUser(Resource):
             return f"{username} deleted."
 
 
+@ns_user.route('/bulk')
+class BulkUsers(Resource):
+    """
+    This endpoint adds, renames or deletes many users in one request.
+    Each takes a JSON array and answers with the status of each item:
+    OK, DUPLICATE, NOT_FOUND, or SKIPPED (after a failure, if ordered).
+    """
+
+    @api.expect([new_user_item], bulk_parser)
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.BAD_REQUEST, 'Bad item list')
+    def post(self):
+        """
+        This method adds many users.
+        """
+        users = bulk_items(['netid', 'firstname', 'lastname'])
+        docs = [db.new_user_doc(user['netid'], user['firstname'],
+                                user['lastname'], user.get('barcode'))
+                for user in users]
+        statuses = db.bulk_add(db.USERS, docs,
+                               bulk_parser.parse_args()['ordered'])
+        return bulk_report([user['netid'] for user in users], statuses)
+
+    @api.expect([rename_item], bulk_parser)
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.BAD_REQUEST, 'Bad item list')
+    def put(self):
+        """
+        This method renames many users.
+        """
+        return bulk_rename(db.USERS)
+
+    @api.expect(name_list, bulk_parser)
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.BAD_REQUEST, 'Bad item list')
+    def delete(self):
+        """
+        This method deletes many users.
+        """
+        return bulk_delete(db.USERS)
+
+
 # badge_parser = reqparse.RequestParser()
 # badge_parser.add_argument('description')
 # badge_parser.add_argument('trainingname', action='split')
@@ -218,23 +717,10 @@ class CreateBadges(Resource):
     def post(self, badgename, traininglist, workshoplist, desc):
         """
         This method adds a new badge to the list of all badges.
-        It has the option to add trainings, workshops and description.
+        traininglist and workshoplist are comma-separated names of the
+        trainings and workshops the badge requires ("-" for none).
         """
-        # args = badge_parser.parse_args()
-        # desc = args["description"]
-        # traininglist = args["trainingname"]
-        # workshoplist = args["workshopname"]
-        ret = db.add_badge(badgename, desc)
-
-        if workshoplist:
-            for wkshp in workshoplist:
-                if not (db.workshop_exists(wkshp)):
-                    db.add_workshop(wkshp)
-        if traininglist:
-            for train in traininglist:
-                if not (db.training_exists(train)):
-                    db.add_training(train)
-
+        ret = db.create_badge(badgename, desc, traininglist, workshoplist)
         if ret == db.NOT_FOUND:
             raise (wz.NotFound("List of badges db not found."))
         elif ret == db.DUPLICATE:
@@ -249,17 +735,24 @@ class ListBadges(Resource):
     This endpoint return a list of all the badges.
     """
 
+    @api.expect(list_parser)
     @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.NOT_MODIFIED, 'Not Modified')
     @api.response(HTTPStatus.NOT_FOUND, 'Not Found')
+    @api.response(HTTPStatus.BAD_REQUEST, 'Bad paging arguments')
     def get(self):
         """
-        Returns list of all badges.
+        Returns list of all badges, or one page of them.
         """
-        badges = db.get_badges()
+        args = list_args()
+        stream = args.pop('stream', None)
+        if stream:
+            return stream_response(db.BADGES, stream, args)
+        badges, etag = db.get_catalog(db.BADGES, **args)
         if badges is None:
             raise (wz.NotFound("List of badges db not found."))
         else:
-            return badges
+            return list_response(badges, args, etag)
 
 
 @ns_badge.route('/list/<badgename>')
@@ -269,6 +762,7 @@ class GetBadgesByID(Resource):
     """
 
     @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.NOT_MODIFIED, 'Not Modified')
     @api.response(HTTPStatus.NOT_FOUND, 'Not Found')
     def get(self, badgename):
         """
@@ -278,7 +772,28 @@ class GetBadgesByID(Resource):
         if badges is None:
             raise (wz.NotFound("Badge does not exist."))
         else:
-            return badges
+            return conditional(badges, db.content_etag(badges))
+
+
+@ns_badge.route('/details/<badgename>')
+class GetBadgeDetails(Resource):
+    """
+    This endpoint returns a badge with the trainings and workshops
+    it requires.
+    """
+
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.NOT_MODIFIED, 'Not Modified')
+    @api.response(HTTPStatus.NOT_FOUND, 'Not Found')
+    def get(self, badgename):
+        """
+        Returns a badge with the full records of the trainings and
+        workshops it requires, in one read.
+        """
+        badge = db.get_badge_details(badgename)
+        if badge is None:
+            raise (wz.NotFound("Badge does not exist."))
+        return conditional(badge, db.content_etag(badge))
 
 
 # badge_parser = reqparse.RequestParser()
@@ -306,14 +821,14 @@ class UpdateBadges(Resource):
         """
         # args = badge_parser.parse_args()
         # new_badgename = args['new_badgename']
-        ret = db.update_badge(old_badgename, new_badgename)
+        ret, touched = db.rename(db.BADGES, old_badgename, new_badgename)
         if ret == db.NOT_FOUND:
             raise (wz.NotFound("Badge not found."))
         elif ret == db.DUPLICATE:
             raise (wz.NotAcceptable("Badge name already exists."))
         elif len(desc) != 0:
             db.update_badge_desc(new_badgename, desc)
-        return f"{old_badgename} updated to {new_badgename}."
+        return renamed(old_badgename, new_badgename, touched)
 
 
 @ns_badge.route('/delete/<badgename>')
@@ -336,6 +851,48 @@ class DeleteBadge(Resource):
             return f"{badgename} deleted."
 
 
+@ns_badge.route('/bulk')
+class BulkBadges(Resource):
+    """
+    This endpoint adds, renames or deletes many badges in one request.
+    Each takes a JSON array and answers with the status of each item:
+    OK, DUPLICATE, NOT_FOUND, or SKIPPED (after a failure, if ordered).
+    """
+
+    @api.expect([new_badge_item], bulk_parser)
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.BAD_REQUEST, 'Bad item list')
+    def post(self):
+        """
+        This method adds many badges.
+        """
+        badges = bulk_items(['badgename'])
+        docs = [{db.BADGES_NM: badge['badgename'],
+                 db.DESC: badge.get('desc', '')}
+                for badge in badges]
+        statuses = db.bulk_add(db.BADGES, docs,
+                               bulk_parser.parse_args()['ordered'])
+        return bulk_report([badge['badgename'] for badge in badges], statuses)
+
+    @api.expect([rename_item], bulk_parser)
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.BAD_REQUEST, 'Bad item list')
+    def put(self):
+        """
+        This method renames many badges.
+        """
+        return bulk_rename(db.BADGES)
+
+    @api.expect(name_list, bulk_parser)
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.BAD_REQUEST, 'Bad item list')
+    def delete(self):
+        """
+        This method deletes many badges.
+        """
+        return bulk_delete(db.BADGES)
+
+
 @ns_training.route('/create/<trainingname>')
 class CreateTrainings(Resource):
     """
@@ -363,17 +920,24 @@ class ListTrainings(Resource):
     This endpoint return a list of all the trainings.
     """
 
+    @api.expect(list_parser)
     @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.NOT_MODIFIED, 'Not Modified')
     @api.response(HTTPStatus.NOT_FOUND, 'Not Found')
+    @api.response(HTTPStatus.BAD_REQUEST, 'Bad paging arguments')
     def get(self):
         """
-        Returns list of all trainings.
+        Returns list of all trainings, or one page of them.
         """
-        trainings = db.get_trainings()
+        args = list_args()
+        stream = args.pop('stream', None)
+        if stream:
+            return stream_response(db.TRAININGS, stream, args)
+        trainings, etag = db.get_catalog(db.TRAININGS, **args)
         if trainings is None:
             raise (wz.NotFound("List of trainings db not found."))
         else:
-            return trainings
+            return list_response(trainings, args, etag)
 
 
 @ns_training.route('/update/<oldtrainingname>/<newtrainingname>')
@@ -389,13 +953,14 @@ class UpdateTrainings(Resource):
         """
         This method updates old training name to new training name.
         """
-        ret = db.update_training(oldtrainingname, newtrainingname)
+        ret, touched = db.rename(db.TRAININGS, oldtrainingname,
+                                 newtrainingname)
         if ret == db.NOT_FOUND:
             raise (wz.NotFound("Training not found."))
         elif ret == db.DUPLICATE:
             raise (wz.NotAcceptable("Training name already exists."))
         else:
-            return f"{oldtrainingname} updated to {newtrainingname}."
+            return renamed(oldtrainingname, newtrainingname, touched)
 
 
 @ns_training.route('/delete/<trainingname>')
@@ -418,6 +983,91 @@ class DeleteTraining(Resource):
             return f"{trainingname} deleted."
 
 
+@ns_training.route('/bulk')
+class BulkTrainings(Resource):
+    """
+    This endpoint adds, renames or deletes many trainings in one request.
+    Each takes a JSON array and answers with the status of each item:
+    OK, DUPLICATE, NOT_FOUND, or SKIPPED (after a failure, if ordered).
+    """
+
+    @api.expect(name_list, bulk_parser)
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.BAD_REQUEST, 'Bad item list')
+    def post(self):
+        """
+        This method adds many trainings.
+        """
+        return bulk_add_names(db.TRAININGS)
+
+    @api.expect([rename_item], bulk_parser)
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.BAD_REQUEST, 'Bad item list')
+    def put(self):
+        """
+        This method renames many trainings.
+        """
+        return bulk_rename(db.TRAININGS)
+
+    @api.expect(name_list, bulk_parser)
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.BAD_REQUEST, 'Bad item list')
+    def delete(self):
+        """
+        This method deletes many trainings.
+        """
+        return bulk_delete(db.TRAININGS)
+
+
+@ns_training.route('/attend/<trainingname>/<netid>')
+class AttendTraining(Resource):
+    """
+    This endpoint records that a user attended a training.
+    """
+
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.NOT_FOUND, 'Not Found')
+    def post(self, trainingname, netid):
+        """
+        This method records one user's attendance.
+        """
+        return attend(progress.TRAINING, trainingname, netid)
+
+
+@ns_training.route('/checkin/<trainingname>')
+class CheckInTraining(Resource):
+    """
+    This endpoint records everyone at a training session in one request.
+    It takes a JSON array of netids and answers with the status of each:
+    OK, or NOT_FOUND for an unknown user.
+    """
+
+    @api.expect(name_list)
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.BAD_REQUEST, 'Bad netid list')
+    @api.response(HTTPStatus.NOT_FOUND, 'Not Found')
+    def post(self, trainingname):
+        """
+        This method records the attendance of many users.
+        """
+        return check_in(progress.TRAINING, trainingname)
+
+
+@ns_training.route('/attendees/<trainingname>')
+class TrainingAttendees(Resource):
+    """
+    This endpoint returns who attended a training.
+    """
+
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.NOT_FOUND, 'Not Found')
+    def get(self, trainingname):
+        """
+        Returns the netid and time of each attendance, earliest first.
+        """
+        return attendees(progress.TRAINING, trainingname)
+
+
 @ns_workshop.route('/create/<workshopname>')
 class CreateWorkshops(Resource):
     """
@@ -446,17 +1096,24 @@ class ListWorkshops(Resource):
     This endpoint return a list of all the workshops.
     """
 
+    @api.expect(list_parser)
     @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.NOT_MODIFIED, 'Not Modified')
     @api.response(HTTPStatus.NOT_FOUND, 'Not Found')
+    @api.response(HTTPStatus.BAD_REQUEST, 'Bad paging arguments')
     def get(self):
         """
-        Returns list of all workshops.
+        Returns list of all workshops, or one page of them.
         """
-        workshops = db.get_workshops()
+        args = list_args()
+        stream = args.pop('stream', None)
+        if stream:
+            return stream_response(db.WORKSHOPS, stream, args)
+        workshops, etag = db.get_catalog(db.WORKSHOPS, **args)
         if workshops is None:
             raise (wz.NotFound("List of workshops db not found."))
         else:
-            return workshops
+            return list_response(workshops, args, etag)
 
 
 @ns_workshop.route('/update/<oldwsname>/<newwsname>')
@@ -472,13 +1129,13 @@ class UpdateWorkshops(Resource):
         """
         This method updates old workshop name to new workshop name.
         """
-        ret = db.update_workshop(oldwsname, newwsname)
+        ret, touched = db.rename(db.WORKSHOPS, oldwsname, newwsname)
         if ret == db.NOT_FOUND:
             raise (wz.NotFound("Workshop not found."))
         elif ret == db.DUPLICATE:
             raise (wz.NotAcceptable("Workshop name already exists."))
         else:
-            return f"{oldwsname} updated to {newwsname}."
+            return renamed(oldwsname, newwsname, touched)
 
 
 @ns_workshop.route('/delete/<workshopname>')
@@ -499,3 +1156,88 @@ class DeleteWorkshop(Resource):
             raise (wz.NotFound("Workshop does not exist."))
         else:
             return f"{workshopname} deleted."
+
+
+@ns_workshop.route('/bulk')
+class BulkWorkshops(Resource):
+    """
+    This endpoint adds, renames or deletes many workshops in one request.
+    Each takes a JSON array and answers with the status of each item:
+    OK, DUPLICATE, NOT_FOUND, or SKIPPED (after a failure, if ordered).
+    """
+
+    @api.expect(name_list, bulk_parser)
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.BAD_REQUEST, 'Bad item list')
+    def post(self):
+        """
+        This method adds many workshops.
+        """
+        return bulk_add_names(db.WORKSHOPS)
+
+    @api.expect([rename_item], bulk_parser)
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.BAD_REQUEST, 'Bad item list')
+    def put(self):
+        """
+        This method renames many workshops.
+        """
+        return bulk_rename(db.WORKSHOPS)
+
+    @api.expect(name_list, bulk_parser)
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.BAD_REQUEST, 'Bad item list')
+    def delete(self):
+        """
+        This method deletes many workshops.
+        """
+        return bulk_delete(db.WORKSHOPS)
+
+
+@ns_workshop.route('/attend/<workshopname>/<netid>')
+class AttendWorkshop(Resource):
+    """
+    This endpoint records that a user attended a workshop.
+    """
+
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.NOT_FOUND, 'Not Found')
+    def post(self, workshopname, netid):
+        """
+        This method records one user's attendance.
+        """
+        return attend(progress.WORKSHOP, workshopname, netid)
+
+
+@ns_workshop.route('/checkin/<workshopname>')
+class CheckInWorkshop(Resource):
+    """
+    This endpoint records everyone at a workshop session in one request.
+    It takes a JSON array of netids and answers with the status of each:
+    OK, or NOT_FOUND for an unknown user.
+    """
+
+    @api.expect(name_list)
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.BAD_REQUEST, 'Bad netid list')
+    @api.response(HTTPStatus.NOT_FOUND, 'Not Found')
+    def post(self, workshopname):
+        """
+        This method records the attendance of many users.
+        """
+        return check_in(progress.WORKSHOP, workshopname)
+
+
+@ns_workshop.route('/attendees/<workshopname>')
+class WorkshopAttendees(Resource):
+    """
+    This endpoint returns who attended a workshop.
+    """
+
+    @api.response(HTTPStatus.OK, 'Success')
+    @api.response(HTTPStatus.NOT_FOUND, 'Not Found')
+    def get(self, workshopname):
+        """
+        Returns the netid and time of each attendance, earliest first.
+        """
+        return attendees(progress.WORKSHOP, workshopname)
@@ -0,0 +1,149 @@
+"""
+This file holds the Prometheus metrics served at `/metrics`:
+request counts and latencies per namespace and route, requests in
+flight, DB work per route, Mongo pool use and catalog cache hits.
+Under gunicorn each worker is a separate process: with
+PROMETHEUS_MULTIPROC_DIR set (gunicorn.conf.py sets it), every worker
+writes its metrics to memory-mapped files there and a scrape adds up
+the files of all workers, whichever worker answers it.
+"""
+import os
+import threading
+from prometheus_client import (Counter, Gauge, Histogram, CollectorRegistry,
+                               REGISTRY, generate_latest, multiprocess,
+                               CONTENT_TYPE_LATEST)
+
+import db.data as db
+
+MULTIPROC_DIR = "PROMETHEUS_MULTIPROC_DIR"
+NAMESPACES = {"users", "badges", "trainings", "workshops"}
+OTHER_NS = "root"
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+REQUESTS = Counter("mays_http_requests_total", "HTTP requests answered.",
+                   ["namespace", "route", "method", "status"])
+LATENCY = Histogram("mays_http_request_duration_seconds",
+                    "Time to answer HTTP requests.",
+                    ["namespace", "route", "method"],
+                    buckets=LATENCY_BUCKETS)
+IN_FLIGHT = Gauge("mays_http_requests_in_flight",
+                  "HTTP requests being answered.",
+                  multiprocess_mode="livesum")
+DB_QUERIES = Counter("mays_db_queries_total",
+                     "DB operations made by HTTP requests.",
+                     ["namespace", "route"])
+DB_SECONDS = Counter("mays_db_seconds_total",
+                     "Time HTTP requests spent in DB operations.",
+                     ["namespace", "route"])
+POOL_CONNECTIONS = Gauge("mays_mongo_pool_connections",
+                         "Mongo connections, open or checked out.",
+                         ["state"], multiprocess_mode="livesum")
+POOL_MAX_SIZE = Gauge("mays_mongo_pool_max_size",
+                      "Mongo connections allowed, summed over workers.",
+                      multiprocess_mode="livesum")
+POOL_CHECKOUT_FAILURES = Counter("mays_mongo_pool_checkout_failures_total",
+                                 "Failed Mongo connection checkouts.")
+CACHE_REQUESTS = Counter("mays_cache_requests_total",
+                         "Catalog cache lookups, by result.",
+                         ["cache", "result"])
+CACHE_INVALIDATIONS = Counter("mays_cache_invalidations_total",
+                              "Catalog cache invalidations.", ["cache"])
+
+sync_lock = threading.Lock()
+# the cumulative stats as of our last sync, to turn into counter increments:
+synced = {}
+if hasattr(os, "register_at_fork"):
+    # a forked worker starts its own metrics files from zero:
+    os.register_at_fork(after_in_child=synced.clear)
+
+
+def namespace_of(rule):
+    first = rule.strip("/").split("/")[0]
+    return first if first in NAMESPACES else OTHER_NS
+
+
+def request_started():
+    IN_FLIGHT.inc()
+
+
+def request_finished():
+    IN_FLIGHT.dec()
+
+
+def observe(method, rule, status, stats):
+    """
+    Count one answered request. `stats` are its db.instrument stats.
+    """
+    namespace = namespace_of(rule)
+    REQUESTS.labels(namespace, rule, method, str(status)).inc()
+    if stats is not None:
+        LATENCY.labels(namespace, rule, method).observe(
+            stats.total_ms / 1000)
+        if stats.queries:
+            DB_QUERIES.labels(namespace, rule).inc(stats.queries)
+            DB_SECONDS.labels(namespace, rule).inc(stats.db_ms / 1000)
+    sync_stats()
+
+
+def add_delta(counter, labels, value):
+    """
+    Add to counter how much the cumulative `value` grew since last time.
+    """
+    key = (counter, labels)
+    delta = value - synced.get(key, 0)
+    if delta:
+        synced[key] = value
+        if delta > 0:
+            (counter.labels(*labels) if labels else counter).inc(delta)
+
+
+def set_gauge(gauge, labels, value):
+    """
+    Set a gauge, unless it already holds value.
+    """
+    key = (gauge, labels)
+    if synced.get(key) != value:
+        synced[key] = value
+        (gauge.labels(*labels) if labels else gauge).set(value)
+
+
+def sync_stats():
+    """
+    Copy the pool and cache stats of this process into our metrics.
+    This runs after every request, so an idle worker's metrics are
+    still up to date when another worker answers a scrape. Only what
+    changed is written.
+    """
+    with sync_lock:
+        pool = db.pool_stats()
+        set_gauge(POOL_CONNECTIONS, ("open",), pool["open"])
+        set_gauge(POOL_CONNECTIONS, ("checked_out",), pool["checked_out"])
+        set_gauge(POOL_MAX_SIZE, (),
+                  pool["max_pool_size"] if pool["connected"] else 0)
+        add_delta(POOL_CHECKOUT_FAILURES, (), pool["checkout_failed"])
+        for name, stats in db.cache_stats().items():
+            add_delta(CACHE_REQUESTS, (name, "hit"), stats["hits"])
+            add_delta(CACHE_REQUESTS, (name, "miss"), stats["misses"])
+            add_delta(CACHE_INVALIDATIONS, (name,), stats["invalidations"])
+
+
+def render():
+    """
+    The metrics, in the Prometheus text format: of all workers in
+    multiprocess mode, else of this process.
+    """
+    sync_stats()
+    if os.environ.get(MULTIPROC_DIR):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def mark_process_dead(pid):
+    """
+    Drop the live gauges of a worker that exited (gunicorn calls this).
+    """
+    if os.environ.get(MULTIPROC_DIR):
+        multiprocess.mark_process_dead(pid)
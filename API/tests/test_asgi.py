@@ -0,0 +1,158 @@
+"""
+This file holds the tests for asgi.py.
+"""
+
+from unittest import TestCase
+from starlette.testclient import TestClient
+
+import API.asgi as asgi
+import API.endpoints as ep
+import db.data as db
+import db.db_connect as dbc
+import db.async_connect as adbc
+import db.progress as progress
+import db.attendance as attendance
+import random
+
+HUGE_NUM = 10000000000000
+
+
+def new_entity_name(entity_type):
+    """
+    Randomly create entity name for test
+    """
+    int_name = random.randint(0, HUGE_NUM)
+    return f"new{entity_type}" + str(int_name)
+
+
+class AsgiTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.client = TestClient(asgi.app).__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.client.__exit__(None, None, None)
+
+    def setUp(self):
+        self.netid = new_entity_name('user')
+        self.barcode = str(random.randint(0, HUGE_NUM))
+        db.add_user(self.netid, "first", "last", self.barcode)
+        self.training = new_entity_name('training')
+        db.add_training(self.training)
+        self.badge = new_entity_name('badge')
+        db.add_badge(self.badge, "desc", [self.training])
+
+    def tearDown(self):
+        db.del_user(self.netid)
+        db.del_training(self.training)
+        db.del_badge(self.badge)
+
+    def test_same_answers_as_flask(self):
+        for path in (f'/users/list/{self.netid}',
+                     f'/users/barcode/{self.barcode}',
+                     f'/users/progress/{self.netid}/{self.badge}',
+                     f'/users/progress/{new_entity_name("user")}/'
+                     f'{self.badge}',
+                     f'/badges/details/{self.badge}',
+                     f'/users/list/{new_entity_name("user")}'):
+            response = self.client.get(path)
+            expected = ep.app.test_client().get(path)
+            self.assertEqual(response.status_code, expected.status_code)
+            self.assertEqual(response.json(), expected.get_json())
+            self.assertEqual(response.headers.get('ETag'),
+                             expected.headers.get('ETag'))
+
+    def test_progress_from_attendance(self):
+        """
+        With no progress record, both apps work progress out from the
+        user's attendance.
+        """
+        attendance.record_attendance(self.netid, progress.TRAINING,
+                                     self.training)
+        dbc.del_many(db.PROGRESS, {db.NETID: self.netid})
+        path = f'/users/progress/{self.netid}/{self.badge}'
+        response = self.client.get(path)
+        self.assertTrue(response.json()[progress.EARNED])
+        self.assertEqual(response.json()[progress.REMAINING],
+                         ep.app.test_client().get(path).get_json()[
+                             progress.REMAINING])
+
+    def test_not_modified(self):
+        path = f'/users/barcode/{self.barcode}'
+        etag = self.client.get(path).headers['ETag']
+        response = self.client.get(path, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_server_timing(self):
+        response = self.client.get(f'/users/list/{self.netid}')
+        self.assertIn('desc="1 queries"', response.headers['Server-Timing'])
+        self.assertEqual(response.headers['Access-Control-Allow-Origin'],
+                         '*')
+
+    def test_attend(self):
+        response = self.client.post(
+            f'/trainings/attend/{self.training}/{self.netid}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(attendance.get_completed(self.netid)[
+            progress.TRAINING], [self.training])
+        badge = attendance.get_badge_progress(self.netid, self.badge)
+        self.assertTrue(badge[progress.EARNED])
+        response = self.client.post(
+            f'/trainings/attend/{self.training}/{new_entity_name("user")}')
+        self.assertEqual(response.status_code, 404)
+
+    def test_check_in(self):
+        stranger = new_entity_name('user')
+        response = self.client.post(f'/trainings/checkin/{self.training}',
+                                    json=[self.netid, stranger])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['status'] for item in response.json()],
+                         ['OK', 'NOT_FOUND'])
+        response = self.client.post(f'/trainings/checkin/{self.training}',
+                                    json={'netid': self.netid})
+        self.assertEqual(response.status_code, 400)
+
+    def test_check_in_race(self):
+        """
+        When someone makes a user's progress record as we do, the
+        clash does not cost the other users their completion.
+        """
+        other = new_entity_name('user')
+        db.add_user(other, "first", "last")
+        self.addCleanup(db.del_user, other)
+        self.addCleanup(dbc.del_many, db.PROGRESS,
+                        {db.NETID: {"$in": [self.netid, other]}})
+        bulk_write = adbc.bulk_write
+
+        async def racing(collect_nm, ops, ordered=False):
+            if collect_nm != db.PROGRESS:
+                return await bulk_write(collect_nm, ops, ordered)
+            # another writer makes the first record just before us:
+            adbc.bulk_write = bulk_write
+            dbc.bulk_write(collect_nm, ops[:1])
+            failures = {0: dbc.DUPLICATE_KEY}
+            if ordered:
+                failures.update({index: None
+                                 for index in range(1, len(ops))})
+                return None, failures
+            await bulk_write(collect_nm, ops[1:], ordered)
+            return None, failures
+
+        adbc.bulk_write = racing
+        self.addCleanup(setattr, adbc, "bulk_write", bulk_write)
+        response = self.client.post(f'/trainings/checkin/{self.training}',
+                                    json=[self.netid, other])
+        self.assertEqual(response.status_code, 200)
+        for netid in (self.netid, other):
+            badge = attendance.get_badge_progress(netid, self.badge)
+            self.assertTrue(badge[progress.EARNED], netid)
+
+    def test_other_routes(self):
+        """
+        Routes we do not serve ourselves go to the Flask app.
+        """
+        response = self.client.get('/badges/list')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(self.badge, response.json())
+        self.assertEqual(self.client.get('/health').json(), {'status': 'ok'})
@@ -8,6 +8,9 @@ from flask_restx import Resource, Api
 
 import API.endpoints as ep
 import db.data as db
+import db.db_connect as dbc
+import db.progress as progress
+import json
 import random
 
 HUGE_NUM = 10000000000000
@@ -60,8 +63,51 @@ class EndpointTestCase(TestCase):
         # badge = db.add_badge(badge_nm, "")
         response = ep.app.test_client().post(f'/badges/create/{badge_nm}/{traininglist}/{workshoplist}/{desc}')
         self.assertEqual(response.status_code, 200)
+        self.assertTrue(db.training_exists(traininglist))
+        self.assertTrue(db.workshop_exists(workshoplist))
         # pass
 
+    def test_badge_details(self):
+        """
+        A badge's details come with its requirements, in one DB call.
+        """
+        badge_nm = new_entity_name('badge')
+        trainings = [new_entity_name('training') for i in range(3)]
+        db.create_badge(badge_nm, "desc", trainings, "-")
+        response = ep.app.test_client().get(f'/badges/details/{badge_nm}')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('desc="1 queries"', response.headers['Server-Timing'])
+        details = response.get_json()
+        self.assertEqual([rec[db.TRAININGS_NM]
+                          for rec in details[db.TRAININGS]], trainings)
+        self.assertEqual(details[db.WORKSHOPS], [])
+        response = ep.app.test_client().get(
+            f'/badges/details/{new_entity_name("badge")}')
+        self.assertEqual(response.status_code, 404)
+        db.bulk_delete(db.TRAININGS, trainings)
+        db.del_badge(badge_nm)
+
+    def test_create_badge_many_requirements(self):
+        """
+        Creating a badge takes the same DB calls however many
+        trainings and workshops it requires.
+        """
+        badge_nm = new_entity_name('badge')
+        trainings = [new_entity_name('training') for i in range(20)]
+        workshops = [new_entity_name('workshop') for i in range(20)]
+        response = ep.app.test_client().post(
+            f'/badges/create/{badge_nm}/{",".join(trainings)}'
+            f'/{",".join(workshops)}/desc')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('desc="8 queries"', response.headers['Server-Timing'])
+        badge = db.get_badge_by_id(badge_nm)
+        self.assertEqual(badge[db.BADGE_TRAININGS], trainings)
+        self.assertEqual(badge[db.BADGE_WORKSHOPS], workshops)
+        self.assertEqual(db.bulk_delete(db.TRAININGS, trainings),
+                         [db.OK] * 20)
+        db.bulk_delete(db.WORKSHOPS, workshops)
+        db.del_badge(badge_nm)
+
     def test_list_user1(self):
         """
         Post-condition 1: return is a dictionary.
@@ -179,7 +225,8 @@ class EndpointTestCase(TestCase):
     def test_delete_user(self):
         user_fields = {'firstname': ['firstname_test']}
         temp_netid = new_entity_name('abc')
-        netid = db.add_user(temp_netid, "Mahika", "Jain", "9999999999")
+        netid = db.add_user(temp_netid, "Mahika", "Jain",
+                            new_entity_name('barcode'))
         response = ep.app.test_client().delete(f'/users/delete/{temp_netid}', json=user_fields)
         self.assertEqual(response.status_code, 200)
     
@@ -215,7 +262,8 @@ class EndpointTestCase(TestCase):
         user_fields = {'firstname': ['firstname_test']}
         old_netid = new_entity_name('abc')
         new_netid = new_entity_name('abc')
-        netid = db.add_user(old_netid, "Mahika", "Jain", "99999999")
+        netid = db.add_user(old_netid, "Mahika", "Jain",
+                            new_entity_name('barcode'))
         response = ep.app.test_client().put(f'/users/update/{old_netid}/{new_netid}')
         self.assertEqual(response.status_code, 200)
 
@@ -263,6 +311,312 @@ class EndpointTestCase(TestCase):
         """
         # user_fields = {'firstname': ['firstname_test']}
         netid = new_entity_name('abc')
-        badge = db.add_user(netid, "Mahika", "Jain", "9999999999")
+        badge = db.add_user(netid, "Mahika", "Jain",
+                            new_entity_name('barcode'))
+        response = ep.app.test_client().get(f'/users/list/{netid}')
+        self.assertEqual(response.status_code, 200)
+
+    def test_health(self):
+        """
+        The liveness check never needs the database.
+        """
+        response = ep.app.test_client().get('/health')
+        self.assertEqual(response.status_code, 200)
+
+    def test_ready(self):
+        response = ep.app.test_client().get('/ready')
+        self.assertEqual(response.status_code, 200)
+
+    def test_ready_failed_indexes(self):
+        """
+        An index we could not build shows in the readiness check.
+        """
+        dbc.index_failures["users.barcode"] = "E11000 duplicate key"
+        try:
+            response = ep.app.test_client().get('/ready')
+        finally:
+            dbc.index_failures.pop("users.barcode")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["failed_indexes"],
+                         ["users.barcode"])
+
+    def test_server_timing(self):
+        """
+        Each response reports its DB work in a Server-Timing header.
+        """
+        netid = new_entity_name('abc')
+        db.add_user(netid, "Mahika", "Jain")
         response = ep.app.test_client().get(f'/users/list/{netid}')
-        self.assertEqual(response.status_code, 200)
\ No newline at end of file
+        timing = response.headers['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="1 queries"', timing)
+        self.assertIn('desc="fetch_one"', timing)
+        db.del_user(netid)
+
+    def test_stats(self):
+        ep.app.test_client().get('/badges/list')
+        response = ep.app.test_client().get('/stats')
+        self.assertEqual(response.status_code, 200)
+        stats = response.get_json()
+        self.assertIn('GET /badges/list', stats['routes'])
+        self.assertIn('pool', stats)
+        self.assertIn('caches', stats)
+
+    def test_metrics(self):
+        ep.app.test_client().get('/badges/list')
+        response = ep.app.test_client().get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        text = response.get_data(as_text=True)
+        self.assertIn('mays_http_requests_total{method="GET",'
+                      'namespace="badges",route="/badges/list"', text)
+        self.assertIn('mays_http_request_duration_seconds_bucket', text)
+        self.assertIn('mays_cache_requests_total', text)
+
+    def test_user_progress(self):
+        netid = new_entity_name('abc')
+        badge = new_entity_name('badge')
+        training = new_entity_name('training')
+        db.add_user(netid, "Mahika", "Jain")
+        db.add_badge(badge, "desc", [training])
+        client = ep.app.test_client()
+        response = client.get(f'/users/progress/{netid}/{badge}')
+        self.assertEqual(response.get_json()['remaining'], 1)
+        progress.record_completion(netid, progress.TRAINING, training)
+        response = client.get(f'/users/progress/{netid}')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.get_json()[badge]['earned'])
+        response = client.get(f'/users/progress/{new_entity_name("abc")}')
+        self.assertEqual(response.status_code, 404)
+        response = client.get(
+            f'/users/progress/{new_entity_name("abc")}/{badge}')
+        self.assertEqual(response.status_code, 404)
+        db.del_user(netid)
+        db.del_badge(badge)
+
+    def test_attendance(self):
+        netids = [new_entity_name('abc'), new_entity_name('abc')]
+        for netid in netids:
+            db.add_user(netid, "Mahika", "Jain")
+        workshop = new_entity_name('workshop')
+        db.add_workshop(workshop)
+        client = ep.app.test_client()
+        response = client.post(f'/workshops/attend/{workshop}/{netids[0]}')
+        self.assertEqual(response.status_code, 200)
+        response = client.post(f'/workshops/checkin/{workshop}',
+                               json=[netids[1], new_entity_name('abc')])
+        self.assertEqual([item['status'] for item in response.get_json()],
+                         ['OK', 'NOT_FOUND'])
+        response = client.get(f'/workshops/attendees/{workshop}')
+        self.assertEqual([att['netid'] for att in response.get_json()],
+                         netids)
+        response = client.get(f'/users/completed/{netids[0]}')
+        self.assertEqual(response.get_json()['workshop'], [workshop])
+        response = client.get(f'/users/attendance/{netids[1]}')
+        self.assertEqual(len(response.get_json()), 1)
+        response = client.post(f'/trainings/attend/{workshop}/{netids[0]}')
+        self.assertEqual(response.status_code, 404)
+        for netid in netids:
+            db.del_user(netid)
+        db.del_workshop(workshop)
+
+    def test_get_user_by_barcode(self):
+        netid = new_entity_name('abc')
+        barcode = str(random.randint(0, HUGE_NUM))
+        db.add_user(netid, "Mahika", "Jain", barcode)
+        response = ep.app.test_client().get(f'/users/barcode/{barcode}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()[db.NETID], netid)
+        db.del_user(netid)
+
+    def test_get_user_by_barcode_missing(self):
+        response = ep.app.test_client().get('/users/barcode/nosuchcard')
+        self.assertEqual(response.status_code, 404)
+
+    def test_list_trainings_paged(self):
+        """
+        A page holds at most `limit` records; the next page starts after
+        the cursor of a full page.
+        """
+        for _ in range(3):
+            db.add_training(new_entity_name("training"))
+        client = ep.app.test_client()
+        response = client.get('/trainings/list?limit=2')
+        self.assertEqual(response.status_code, 200)
+        page = response.get_json()
+        self.assertEqual(len(page), 2)
+        cursor = response.headers['X-Next-Cursor']
+        self.assertEqual(cursor, sorted(page)[-1])
+        response = client.get(f'/trainings/list?limit=2&after={cursor}')
+        for key in response.get_json():
+            self.assertGreater(key, cursor)
+
+    def test_list_users_fields(self):
+        db.add_user(new_entity_name('abc'), "Mahika", "Jain")
+        response = ep.app.test_client().get(
+            '/users/list?limit=5&fields=firstName')
+        self.assertEqual(response.status_code, 200)
+        for val in response.get_json().values():
+            self.assertLessEqual(set(val), {db.NETID, db.FIRST_NM})
+
+    def test_list_bad_limit(self):
+        response = ep.app.test_client().get('/badges/list?limit=0')
+        self.assertEqual(response.status_code, 400)
+
+    def test_list_trainings_stream_json(self):
+        """
+        The streamed listing is the same JSON object as the usual one.
+        """
+        db.add_training(new_entity_name("training"))
+        client = ep.app.test_client()
+        usual = client.get('/trainings/list').get_json()
+        response = client.get('/trainings/list?stream=json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), usual)
+
+    def test_list_stream_next_cursor(self):
+        """
+        A full streamed page has the same cursor as the usual one, and
+        skips records without a key as the usual one does.
+        """
+        for i in range(3):
+            db.add_training(new_entity_name("training"))
+        dbc.insert_doc(db.TRAININGS, {"nokey": True})
+        client = ep.app.test_client()
+        usual = client.get('/trainings/list?limit=2')
+        streamed = client.get('/trainings/list?limit=2&stream=json')
+        self.assertEqual(streamed.get_json(), usual.get_json())
+        self.assertEqual(streamed.headers['X-Next-Cursor'],
+                         usual.headers['X-Next-Cursor'])
+        after = streamed.headers['X-Next-Cursor']
+        self.assertEqual(
+            client.get(f'/trainings/list?after={after}&stream=json')
+            .get_json(),
+            client.get(f'/trainings/list?after={after}').get_json())
+        self.assertEqual(client.get('/trainings/list?stream=json')
+                         .get_json(),
+                         client.get('/trainings/list').get_json())
+        dbc.del_many(db.TRAININGS, {"nokey": True})
+
+    def test_list_users_stream_ndjson(self):
+        netid = new_entity_name('abc')
+        db.add_user(netid, "Mahika", "Jain")
+        response = ep.app.test_client().get('/users/list?stream=ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        users = [json.loads(line) for line in response.data.splitlines()]
+        self.assertIn(netid, [user[db.NETID] for user in users])
+        db.del_user(netid)
+
+    def test_list_badges_not_modified(self):
+        """
+        A poll with the ETag of the current listing gets a bodiless 304.
+        """
+        client = ep.app.test_client()
+        response = client.get('/badges/list')
+        etag = response.headers['ETag']
+        response = client.get('/badges/list',
+                              headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+    def test_list_badges_modified(self):
+        client = ep.app.test_client()
+        etag = client.get('/badges/list').headers['ETag']
+        db.add_badge(new_entity_name('badge'), "desc")
+        response = client.get('/badges/list',
+                              headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_get_user_not_modified(self):
+        netid = new_entity_name('abc')
+        db.add_user(netid, "Mahika", "Jain")
+        client = ep.app.test_client()
+        etag = client.get(f'/users/list/{netid}').headers['ETag']
+        response = client.get(f'/users/list/{netid}',
+                              headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        db.del_user(netid)
+
+    def test_bulk_create_users(self):
+        """
+        Each user gets its own status; a repeated netid is a duplicate.
+        """
+        netid = new_entity_name('abc')
+        users = [{'netid': netid, 'firstname': 'Mahika', 'lastname': 'Jain'},
+                 {'netid': netid, 'firstname': 'Aliah', 'lastname': 'J'}]
+        response = ep.app.test_client().post('/users/bulk', json=users)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['status'] for item in response.get_json()],
+                         ['OK', 'DUPLICATE'])
+        db.del_user(netid)
+
+    def test_bulk_create_users_ordered(self):
+        netid = new_entity_name('abc')
+        other = new_entity_name('abc')
+        users = [{'netid': netid, 'firstname': 'A', 'lastname': 'B'},
+                 {'netid': netid, 'firstname': 'A', 'lastname': 'B'},
+                 {'netid': other, 'firstname': 'A', 'lastname': 'B'}]
+        response = ep.app.test_client().post('/users/bulk?ordered=true',
+                                             json=users)
+        self.assertEqual([item['status'] for item in response.get_json()],
+                         ['OK', 'DUPLICATE', 'SKIPPED'])
+        db.del_user(netid)
+
+    def test_bulk_rename_trainings(self):
+        old = new_entity_name('training')
+        new = new_entity_name('training')
+        db.add_training(old)
+        renames = [{'old': old, 'new': new},
+                   {'old': new_entity_name('training'), 'new': old}]
+        response = ep.app.test_client().put('/trainings/bulk', json=renames)
+        self.assertEqual([item['status'] for item in response.get_json()],
+                         ['OK', 'NOT_FOUND'])
+        self.assertIn(new, db.get_trainings())
+
+    def test_bulk_delete_workshops(self):
+        workshop = new_entity_name('workshop')
+        client = ep.app.test_client()
+        client.post('/workshops/bulk', json=[workshop])
+        response = client.delete('/workshops/bulk',
+                                 json=[workshop, new_entity_name('workshop')])
+        self.assertEqual([item['status'] for item in response.get_json()],
+                         ['OK', 'NOT_FOUND'])
+        self.assertNotIn(workshop, db.get_workshops())
+
+    def test_bulk_rename_ordered_stops(self):
+        """
+        With ordered, a pair that fails its check stops the rest.
+        """
+        old = new_entity_name('training')
+        new = new_entity_name('training')
+        db.add_training(old)
+        renames = [{'old': new_entity_name('training'), 'new': 'x'},
+                   {'old': old, 'new': new}]
+        response = ep.app.test_client().put('/trainings/bulk?ordered=true',
+                                            json=renames)
+        self.assertEqual([item['status'] for item in response.get_json()],
+                         ['NOT_FOUND', 'SKIPPED'])
+        self.assertIn(old, db.get_trainings())
+        db.del_training(old)
+
+    def test_bulk_delete_ordered_stops(self):
+        workshop = new_entity_name('workshop')
+        client = ep.app.test_client()
+        client.post('/workshops/bulk', json=[workshop])
+        response = client.delete('/workshops/bulk?ordered=true',
+                                 json=[new_entity_name('workshop'), workshop])
+        self.assertEqual([item['status'] for item in response.get_json()],
+                         ['NOT_FOUND', 'SKIPPED'])
+        self.assertIn(workshop, db.get_workshops())
+        db.del_workshop(workshop)
+
+    def test_bulk_rename_not_strings(self):
+        response = ep.app.test_client().put(
+            '/trainings/bulk', json=[{'old': {'$gt': ''}, 'new': 'x'}])
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_bad_items(self):
+        response = ep.app.test_client().post('/badges/bulk',
+                                             json=[{'desc': 'no name'}])
+        self.assertEqual(response.status_code, 400)
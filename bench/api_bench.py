@@ -0,0 +1,447 @@
+"""
+This program benchmarks the API and data layers.
+It seeds a dedicated database with users, badges, trainings and
+workshops, then drives every endpoint (login, create, list, lookup,
+update, delete) through the Flask test client, or through a real
+gunicorn server with --gunicorn. For each route it reports throughput,
+p50/p95/p99 latency, and DB calls per request (from the app's
+Server-Timing header).
+Results can be saved as a JSON baseline and later runs compared to it.
+Usage examples:
+    MAYS_DB_BACKEND=memory python3 -m bench.api_bench
+    python3 -m bench.api_bench --users 10000 --save bench/baseline.json
+    python3 -m bench.api_bench --compare bench/baseline.json
+    python3 -m bench.api_bench --gunicorn --workers 4 --concurrency 8
+    python3 -m bench.api_bench --gunicorn --worker-class gthread --threads 4
+It never touches the app's own database: everything goes to
+bench_maysDB, which is emptied and reseeded on every run.
+"""
+import os
+import re
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import threading
+import subprocess
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+HOME = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("MAYS_HOME", HOME)
+
+import db.db_connect as dbc  # noqa: E402
+import db.data as data  # noqa: E402
+import db.cache as cache  # noqa: E402
+
+BENCH_DB = "bench_maysDB"
+dbc.db_nm = BENCH_DB
+
+DEF_USERS = 1000
+DEF_CATALOG = 100
+DEF_REQUESTS = 200
+DEF_WARMUP = 20
+DEF_TOLERANCE = 0.2
+# p95 changes smaller than this are noise, whatever the ratio:
+MIN_CHANGE_MS = 0.1
+PAGE_SIZE = 100
+PASSWORD = "bench-pw"
+BARCODE_BASE = 500000000
+NEW_BARCODE_BASE = 600000000
+# the env var a gunicorn-hosted app reads its seed sizes from:
+SEED_ENV = "MAYS_BENCH_SEED"
+STARTUP_SECS = 30
+# the DB call count in our Server-Timing header:
+DB_TIMING = re.compile(r'db;dur=[\d.]+;desc="(\d+) queries"')
+
+
+def user_nm(i):
+    return f"bench{i:06d}"
+
+
+def badge_nm(i):
+    return f"badge{i:05d}"
+
+
+def training_nm(i):
+    return f"training{i:05d}"
+
+
+def workshop_nm(i):
+    return f"workshop{i:05d}"
+
+
+def seed_docs(users, badges, trainings, workshops):
+    """
+    The records to seed, by collection.
+    """
+    return {
+        data.USERS: [{data.NETID: user_nm(i), data.USERS_NM: user_nm(i),
+                      "password": PASSWORD, data.FIRST_NM: "First",
+                      data.LAST_NM: "Last",
+                      data.BARCODE: str(BARCODE_BASE + i)}
+                     for i in range(users)],
+        data.BADGES: [data.new_badge_doc(
+                          badge_nm(i), f"Badge number {i}",
+                          [training_nm(i % trainings),
+                           training_nm((i + 1) % trainings)],
+                          [workshop_nm(i % workshops)])
+                      for i in range(badges)],
+        data.TRAININGS: [{data.TRAININGS_NM: training_nm(i)}
+                         for i in range(trainings)],
+        data.WORKSHOPS: [{data.WORKSHOPS_NM: workshop_nm(i)}
+                         for i in range(workshops)],
+    }
+
+
+def seed(sizes, chunk=1000):
+    """
+    Empty the benchmark collections and fill them afresh.
+    """
+    for collect_nm, docs in seed_docs(*sizes).items():
+        collection = dbc.get_client()[dbc.db_nm][collect_nm]
+        collection.delete_many({})
+        for start in range(0, len(docs), chunk):
+            collection.insert_many(docs[start:start + chunk])
+    cache.invalidate_all()
+
+
+def routes(sizes):
+    """
+    The requests to time: (route name, method, path of the i-th call).
+    Seeded records are reused round robin. The create, update and
+    delete routes work on records of their own, and must run in that
+    order: the i-th update renames what the i-th create made.
+    """
+    users, badges, trainings, workshops = sizes
+    reads = [
+        ("POST /login", "POST",
+         lambda i: f"/login/{user_nm(i % users)}/{PASSWORD}"),
+        ("GET /users/list", "GET", lambda i: "/users/list"),
+        ("GET /users/list?limit", "GET",
+         lambda i: f"/users/list?limit={PAGE_SIZE}"),
+        ("GET /users/list/<netid>", "GET",
+         lambda i: f"/users/list/{user_nm(i % users)}"),
+        ("GET /users/barcode/<barcode>", "GET",
+         lambda i: f"/users/barcode/{BARCODE_BASE + i % users}"),
+        ("GET /badges/list", "GET", lambda i: "/badges/list"),
+        ("GET /badges/list/<badgename>", "GET",
+         lambda i: f"/badges/list/{badge_nm(i % badges)}"),
+        ("GET /badges/details/<badgename>", "GET",
+         lambda i: f"/badges/details/{badge_nm(i % badges)}"),
+        ("GET /trainings/list", "GET", lambda i: "/trainings/list"),
+        ("GET /workshops/list", "GET", lambda i: "/workshops/list"),
+    ]
+    writes = [
+        ("POST /users/create", "POST",
+         lambda i: f"/users/create/new-user{i}/First/Last/"
+                   f"{NEW_BARCODE_BASE + i}"),
+        ("PUT /users/update", "PUT",
+         lambda i: f"/users/update/new-user{i}/renamed-user{i}"),
+        ("DELETE /users/delete", "DELETE",
+         lambda i: f"/users/delete/renamed-user{i}"),
+        ("POST /badges/create", "POST",
+         lambda i: f"/badges/create/new-badge{i}/"
+                   f"{training_nm(i % trainings)}/"
+                   f"{workshop_nm(i % workshops)}/A new badge"),
+        ("PUT /badges/update", "PUT",
+         lambda i: f"/badges/update/new-badge{i}/renamed-badge{i}/"
+                   f"Renamed"),
+        ("DELETE /badges/delete", "DELETE",
+         lambda i: f"/badges/delete/renamed-badge{i}"),
+        ("POST /trainings/create", "POST",
+         lambda i: f"/trainings/create/new-training{i}"),
+        ("PUT /trainings/update", "PUT",
+         lambda i: f"/trainings/update/new-training{i}/renamed-training{i}"),
+        ("DELETE /trainings/delete", "DELETE",
+         lambda i: f"/trainings/delete/renamed-training{i}"),
+        ("POST /workshops/create", "POST",
+         lambda i: f"/workshops/create/new-workshop{i}"),
+        ("PUT /workshops/update", "PUT",
+         lambda i: f"/workshops/update/new-workshop{i}/renamed-workshop{i}"),
+        ("DELETE /workshops/delete", "DELETE",
+         lambda i: f"/workshops/delete/renamed-workshop{i}"),
+    ]
+    return reads + writes
+
+
+def db_calls(headers):
+    """
+    The DB calls a request made, from its Server-Timing header.
+    """
+    found = DB_TIMING.search(headers.get("Server-Timing") or "")
+    return int(found.group(1)) if found else None
+
+
+def client_sender():
+    """
+    Send requests through the Flask test client, in this process.
+    Returns (status, DB calls).
+    """
+    from API.endpoints import app
+    client = app.test_client()
+
+    def send(method, path):
+        resp = client.open(path, method=method)
+        resp.get_data()
+        return resp.status_code, db_calls(resp.headers)
+
+    return send
+
+
+def http_sender(port):
+    """
+    Send requests over keep-alive HTTP connections, one per thread.
+    """
+    local = threading.local()
+
+    def send(method, path):
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = local.conn = http.client.HTTPConnection("127.0.0.1", port,
+                                                           timeout=30)
+        try:
+            conn.request(method, path.replace(" ", "%20"))
+            resp = conn.getresponse()
+            resp.read()
+            return resp.status, db_calls(resp.headers)
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            local.conn = None
+            return 0, None
+
+    return send
+
+
+def percentile(ordered, pct):
+    """
+    Nearest-rank percentile of a sorted list.
+    """
+    if not ordered:
+        return None
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def measure(send, method, path_of, count, warmup, concurrency=1):
+    """
+    Time `count` calls of one route, after `warmup` untimed ones
+    (numbered after the timed ones, so they use different records).
+    """
+    for i in range(count, count + warmup):
+        send(method, path_of(i))
+    latencies = [None] * count
+    outcomes = [None] * count
+
+    def timed(i):
+        start = time.perf_counter()
+        outcomes[i] = send(method, path_of(i))
+        latencies[i] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(timed, range(count)))
+    else:
+        for i in range(count):
+            timed(i)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    db_calls = [calls for status, calls in outcomes if calls is not None]
+    return {
+        "count": count,
+        "errors": sum(1 for status, calls in outcomes
+                      if not 200 <= status < 400),
+        "rps": round(count / elapsed, 1) if elapsed > 0 else None,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "db_calls": (round(sum(db_calls) / len(db_calls), 2)
+                     if db_calls else None),
+    }
+
+
+def run(send, sizes, count, warmup, concurrency=1, only=None):
+    results = {}
+    for name, method, path_of in routes(sizes):
+        if only and not any(part in name for part in only):
+            continue
+        results[name] = measure(send, method, path_of, count, warmup,
+                                concurrency)
+    return results
+
+
+def seeded_app():
+    """
+    The app gunicorn serves with --gunicorn: seeded once, before the
+    workers fork, when gunicorn preloads it; otherwise by each worker
+    (start_gunicorn() seeds a shared database itself).
+    """
+    if os.environ.get(SEED_ENV):
+        seed([int(size) for size in os.environ[SEED_ENV].split(",")])
+    from API.endpoints import app
+    return app
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(sizes, workers=None, threads=None, worker_class=None):
+    """
+    Start gunicorn on a free port and wait for it to answer.
+    Settings left as None come from gunicorn.conf.py.
+    """
+    port = free_port()
+    env = dict(os.environ, MAYS_HOME=HOME,
+               PYTHONPATH=os.pathsep.join(
+                   filter(None, [HOME, os.environ.get("PYTHONPATH")])))
+    cmd = [sys.executable, "-m", "gunicorn",
+           "--bind", f"127.0.0.1:{port}", "--log-level", "warning"]
+    if workers is not None:
+        cmd += ["--workers", str(workers)]
+    if threads is not None:
+        cmd += ["--threads", str(threads)]
+    if worker_class is not None:
+        cmd += ["--worker-class", worker_class]
+        env["MAYS_WORKER_CLASS"] = worker_class
+    # gevent loads the app in each worker, after patching:
+    if worker_class != "gevent":
+        cmd.append("--preload")
+        env[SEED_ENV] = ",".join(str(size) for size in sizes)
+    elif dbc.BACKEND == dbc.MEMORY:
+        env[SEED_ENV] = ",".join(str(size) for size in sizes)
+    else:
+        seed(sizes)
+        env.pop(SEED_ENV, None)
+    proc = subprocess.Popen(cmd + ["bench.api_bench:seeded_app()"],
+                            cwd=HOME, env=env)
+    send = http_sender(port)
+    deadline = time.monotonic() + STARTUP_SECS
+    while send("GET", "/health")[0] != 200:
+        if proc.poll() is not None or time.monotonic() > deadline:
+            proc.kill()
+            raise RuntimeError("gunicorn did not start.")
+        time.sleep(0.2)
+    return proc, port
+
+
+def report(results):
+    print(f"{'route':34} {'n':>5} {'err':>4} {'req/s':>9} {'p50 ms':>8} "
+          f"{'p95 ms':>8} {'p99 ms':>8} {'db/req':>6}")
+    for name, res in results.items():
+        db_calls = "-" if res["db_calls"] is None else res["db_calls"]
+        print(f"{name:34} {res['count']:5} {res['errors']:4} "
+              f"{res['rps']:9} {res['p50_ms']:8.3f} {res['p95_ms']:8.3f} "
+              f"{res['p99_ms']:8.3f} {db_calls:>6}")
+
+
+def compare(results, baseline, tolerance=DEF_TOLERANCE):
+    """
+    Print how each route moved against a baseline, and return the
+    routes that regressed: p95 up by more than `tolerance` (a fraction),
+    or more DB calls per request.
+    """
+    regressed = []
+    print(f"\n{'route':34} {'base p95':>9} {'p95':>9} {'change':>8} "
+          f"{'base db':>7} {'db':>6}")
+    for name, res in results.items():
+        old = baseline["routes"].get(name)
+        if old is None:
+            continue
+        change = res["p95_ms"] / old["p95_ms"] - 1 if old["p95_ms"] else 0
+        slower = change > tolerance \
+            and res["p95_ms"] - old["p95_ms"] > MIN_CHANGE_MS
+        more_calls = None not in (res["db_calls"], old["db_calls"]) \
+            and res["db_calls"] > old["db_calls"]
+        flag = ""
+        if slower or more_calls:
+            regressed.append(name)
+            flag = "  REGRESSED"
+        print(f"{name:34} {old['p95_ms']:9.3f} {res['p95_ms']:9.3f} "
+              f"{change:+8.0%} {str(old['db_calls']):>7} "
+              f"{str(res['db_calls']):>6}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the MAYS API endpoints.")
+    parser.add_argument("--users", type=int, default=DEF_USERS)
+    parser.add_argument("--badges", type=int, default=DEF_CATALOG)
+    parser.add_argument("--trainings", type=int, default=DEF_CATALOG)
+    parser.add_argument("--workshops", type=int, default=DEF_CATALOG)
+    parser.add_argument("--requests", type=int, default=DEF_REQUESTS,
+                        help="timed requests per route")
+    parser.add_argument("--warmup", type=int, default=DEF_WARMUP,
+                        help="untimed requests per route")
+    parser.add_argument("--routes", help="comma-separated parts of the "
+                                         "route names to run")
+    parser.add_argument("--gunicorn", action="store_true",
+                        help="serve the app with gunicorn and use HTTP")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--worker-class", default="sync",
+                        help="sync, gthread or gevent, with --gunicorn")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="client threads, with --gunicorn")
+    parser.add_argument("--save", help="write the results to this file")
+    parser.add_argument("--compare", help="a baseline file to compare to")
+    parser.add_argument("--tolerance", type=float, default=DEF_TOLERANCE,
+                        help="allowed p95 slowdown, as a fraction")
+    args = parser.parse_args()
+    sizes = [args.users, args.badges, args.trainings, args.workshops]
+    if min(sizes) < 1 or args.requests < 1:
+        parser.error("Seed sizes and --requests must be at least 1.")
+    if args.gunicorn and dbc.BACKEND == dbc.MEMORY and args.workers > 1:
+        print("Warning: with the memory backend each worker has its own "
+              "data, so writes through one worker are not seen by others.")
+    only = args.routes.split(",") if args.routes else None
+
+    if args.gunicorn:
+        proc, port = start_gunicorn(sizes, args.workers, args.threads,
+                                    args.worker_class)
+        try:
+            results = run(http_sender(port), sizes, args.requests,
+                          args.warmup, args.concurrency, only)
+        finally:
+            proc.terminate()
+            proc.wait()
+    else:
+        seed(sizes)
+        results = run(client_sender(), sizes, args.requests, args.warmup,
+                      only=only)
+
+    report(results)
+    settings = {key: val for key, val in vars(args).items()
+                if key not in ("save", "compare", "tolerance")}
+    meta = {"settings": settings, "backend": dbc.BACKEND,
+            "python": platform.python_version(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump({"meta": meta, "routes": results}, file, indent=2)
+        print(f"\nSaved the results to {args.save}.")
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        # running fewer routes than the baseline did is fine; baselines
+        # from before --worker-class ran sync workers:
+        old_settings = {"worker_class": "sync",
+                        **baseline["meta"]["settings"],
+                        "routes": args.routes}
+        if old_settings != settings \
+                or baseline["meta"]["backend"] != dbc.BACKEND:
+            print("\nWarning: the baseline was run with other settings.")
+        regressed = compare(results, baseline, args.tolerance)
+        if regressed:
+            print(f"\n{len(regressed)} route(s) regressed.")
+            exit(1)
+
+
+if __name__ == "__main__":
+    main()
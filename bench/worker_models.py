@@ -0,0 +1,147 @@
+"""
+This program compares gunicorn's worker models (sync, gthread, gevent)
+serving our API, so we can pick one for a dyno size.
+For each model it starts gunicorn with gunicorn.conf.py, drives the
+routes of api_bench.py over HTTP from --concurrency client threads,
+and reports overall throughput and latency, side by side.
+It runs on the in-memory backend unless MAYS_DB_BACKEND says otherwise,
+and times the read routes by default: with the in-memory backend each
+worker has its own data, so a write through one worker is not seen by
+the next request if another worker serves it.
+Usage examples:
+    python3 -m bench.worker_models
+    python3 -m bench.worker_models --workers 2 --threads 8 --concurrency 32
+    python3 -m bench.worker_models --models sync,gthread --save models.json
+Workers, threads and gevent connections default to what
+gunicorn.conf.py picks for this machine.
+"""
+import os
+import json
+import time
+import argparse
+import platform
+import importlib.util
+
+os.environ.setdefault("MAYS_DB_BACKEND", "memory")
+
+import bench.api_bench as api_bench  # noqa: E402
+import db.db_connect as dbc  # noqa: E402
+
+MODELS = ["sync", "gthread", "gevent"]
+DEF_CONCURRENCY = 16
+DEF_ROUTES = "GET "
+
+
+def available(model):
+    """
+    Can we run this worker model here? gevent is an optional package.
+    """
+    return model != "gevent" or importlib.util.find_spec("gevent")
+
+
+def summary(results):
+    """
+    One line for a model: throughput over all its requests, the mean
+    of the routes' p50 and the worst route's p95 and p99.
+    """
+    count = sum(res["count"] for res in results.values())
+    secs = sum(res["count"] / res["rps"] for res in results.values()
+               if res["rps"])
+    return {
+        "count": count,
+        "errors": sum(res["errors"] for res in results.values()),
+        "rps": round(count / secs, 1) if secs else None,
+        "p50_ms": round(sum(res["p50_ms"] for res in results.values())
+                        / len(results), 3),
+        "p95_ms": max(res["p95_ms"] for res in results.values()),
+        "p99_ms": max(res["p99_ms"] for res in results.values()),
+    }
+
+
+def report(summaries):
+    print(f"\n{'model':8} {'n':>6} {'err':>4} {'req/s':>9} "
+          f"{'mean p50':>9} {'worst p95':>10} {'worst p99':>10}")
+    for model, res in summaries.items():
+        print(f"{model:8} {res['count']:6} {res['errors']:4} "
+              f"{res['rps']:9} {res['p50_ms']:9.3f} {res['p95_ms']:10.3f} "
+              f"{res['p99_ms']:10.3f}")
+
+
+def run_model(model, sizes, args, only):
+    # more than one thread turns a sync worker into a gthread one:
+    threads = args.threads if model == "gthread" else None
+    proc, port = api_bench.start_gunicorn(sizes, args.workers, threads,
+                                          model)
+    try:
+        return api_bench.run(api_bench.http_sender(port), sizes,
+                             args.requests, args.warmup, args.concurrency,
+                             only)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare gunicorn worker models serving the MAYS API.")
+    parser.add_argument("--models", default=",".join(MODELS),
+                        help="comma-separated worker models to run")
+    parser.add_argument("--users", type=int, default=api_bench.DEF_USERS)
+    parser.add_argument("--badges", type=int, default=api_bench.DEF_CATALOG)
+    parser.add_argument("--trainings", type=int,
+                        default=api_bench.DEF_CATALOG)
+    parser.add_argument("--workshops", type=int,
+                        default=api_bench.DEF_CATALOG)
+    parser.add_argument("--requests", type=int,
+                        default=api_bench.DEF_REQUESTS,
+                        help="timed requests per route")
+    parser.add_argument("--warmup", type=int, default=api_bench.DEF_WARMUP,
+                        help="untimed requests per route")
+    parser.add_argument("--routes", default=DEF_ROUTES,
+                        help="comma-separated parts of the route names "
+                             "to run")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--threads", type=int,
+                        help="threads per gthread worker")
+    parser.add_argument("--concurrency", type=int, default=DEF_CONCURRENCY,
+                        help="client threads")
+    parser.add_argument("--routes-report", action="store_true",
+                        help="also print each model's routes")
+    parser.add_argument("--save", help="write the results to this file")
+    args = parser.parse_args()
+    sizes = [args.users, args.badges, args.trainings, args.workshops]
+    if min(sizes) < 1 or args.requests < 1:
+        parser.error("Seed sizes and --requests must be at least 1.")
+    models = args.models.split(",")
+    unknown = [model for model in models if model not in MODELS]
+    if unknown:
+        parser.error(f"Unknown worker models: {', '.join(unknown)}.")
+    only = args.routes.split(",") if args.routes else None
+
+    results = {}
+    for model in models:
+        if not available(model):
+            print(f"Skipping {model}: it is not installed.")
+            continue
+        print(f"Running {model} workers...")
+        results[model] = run_model(model, sizes, args, only)
+        if args.routes_report:
+            api_bench.report(results[model])
+    summaries = {model: summary(res) for model, res in results.items()}
+    report(summaries)
+
+    if args.save:
+        settings = {key: val for key, val in vars(args).items()
+                    if key not in ("save", "routes_report")}
+        meta = {"settings": settings, "backend": dbc.BACKEND,
+                "cpus": os.cpu_count(),
+                "python": platform.python_version(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        with open(args.save, "w") as file:
+            json.dump({"meta": meta, "models": summaries,
+                       "routes": results}, file, indent=2)
+        print(f"\nSaved the results to {args.save}.")
+
+
+if __name__ == "__main__":
+    main()
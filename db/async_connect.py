@@ -0,0 +1,163 @@
+"""
+This file is the asyncio counterpart of db_connect.py, for the ASGI app
+(API/asgi.py). It reaches the same database with the same pool settings
+through PyMongo's async client, so a request waiting on Mongo gives its
+worker back to other requests instead of blocking a thread.
+Indexes are still built by the sync client (`db_connect.get_client()`),
+which the app opens on startup.
+Results come back as db_connect's helpers return them.
+"""
+import os
+import asyncio
+
+from pymongo.errors import BulkWriteError
+
+import db.db_connect as dbc
+import db.instrument as instrument
+
+client = None
+# an async client belongs to the event loop it was made in:
+client_loop = None
+client_pid = None
+
+
+def new_client():
+    """
+    Build a new async client: on the in-memory backend, one over the
+    same data as the sync client.
+    """
+    if dbc.BACKEND == dbc.MEMORY:
+        import db.memory_db as memory_db
+        return memory_db.AsyncMemoryClient(dbc.get_client())
+    if dbc.BACKEND != dbc.MONGO:
+        raise ValueError(f"Unknown MAYS_DB_BACKEND: {dbc.BACKEND}")
+    from pymongo import AsyncMongoClient
+    args, kwargs = dbc.mongo_args()
+    return AsyncMongoClient(*args, **kwargs)
+
+
+def get_client():
+    """
+    The async client of this process and event loop, made on first use.
+    A client of another event loop is closed first, in that loop, where
+    its pool and monitor tasks run. If that loop has closed, they can
+    no longer be closed: that raises RuntimeError, as the loop should
+    have called `close_client()` before it ended.
+    """
+    global client, client_loop, client_pid
+    loop = asyncio.get_running_loop()
+    if (client is not None and client_pid == os.getpid()
+            and client_loop is not loop):
+        if client_loop.is_closed():
+            raise RuntimeError("The event loop of the async Mongo client "
+                               "closed without close_client().")
+        asyncio.run_coroutine_threadsafe(client.close(), client_loop)
+        client = None
+    if client is None or client_pid != os.getpid():
+        client = new_client()
+        client_loop = loop
+        client_pid = os.getpid()
+    return client
+
+
+async def close_client():
+    """
+    Close the async client of this process, if any. One whose event loop
+    has closed is only dropped: there is nothing left to close it in.
+    """
+    global client, client_loop, client_pid
+    if (client is not None and client_pid == os.getpid()
+            and not client_loop.is_closed()):
+        if client_loop is asyncio.get_running_loop():
+            await client.close()
+        else:
+            asyncio.run_coroutine_threadsafe(client.close(), client_loop)
+    client = None
+    client_loop = None
+    client_pid = None
+
+
+def collection(collect_nm):
+    return get_client()[dbc.db_nm][collect_nm]
+
+
+@instrument.timed
+async def ping():
+    return await get_client()[dbc.db_nm].command("ping")
+
+
+@instrument.timed
+async def fetch_one(collect_nm, filters={}, projection=None):
+    """
+    Fetch one record that meets filters.
+    """
+    return await collection(collect_nm).find_one(filters, projection)
+
+
+@instrument.timed
+async def fetch_all(collect_nm, key_nm, filters={}, projection=None):
+    """
+    Fetch all records that meet filters, as a dict keyed on `key_nm`.
+    """
+    all_docs = {}
+    async for doc in collection(collect_nm).find(filters, projection):
+        if key_nm in doc:
+            all_docs[doc[key_nm]] = dbc.to_json(doc)
+    return all_docs
+
+
+@instrument.timed
+async def fetch_docs(collect_nm, filters={}, projection=None, sort=None,
+                     limit=None):
+    """
+    Records that meet filters, as stored.
+    """
+    cursor = collection(collect_nm).find(filters, projection)
+    if sort:
+        cursor = cursor.sort(sort)
+    if limit:
+        cursor = cursor.limit(limit)
+    return await cursor.to_list(None)
+
+
+@instrument.timed
+async def fetch_keys(collect_nm, key_nm, keys):
+    """
+    Return the set of the given keys that some record has.
+    """
+    cursor = collection(collect_nm).find({key_nm: {"$in": list(keys)}},
+                                         {key_nm: 1, "_id": 0})
+    return {doc[key_nm] async for doc in cursor}
+
+
+@instrument.timed
+async def aggregate(collect_nm, pipeline):
+    """
+    Run an aggregation pipeline; returns the resulting docs as JSON.
+    """
+    cursor = await collection(collect_nm).aggregate(pipeline)
+    return [dbc.to_json(doc) async for doc in cursor]
+
+
+@instrument.timed
+async def insert_doc(collect_nm, doc):
+    return await collection(collect_nm).insert_one(doc)
+
+
+@instrument.timed
+async def update_many(collect_nm, filters={}, updates={}):
+    return await collection(collect_nm).update_many(filters, updates)
+
+
+@instrument.timed
+async def bulk_write(collect_nm, ops, ordered=False):
+    """
+    Run a list of write operations in one round trip, reporting
+    unique index clashes as `db_connect.bulk_write()` does.
+    """
+    try:
+        result = await collection(collect_nm).bulk_write(ops,
+                                                         ordered=ordered)
+        return result, {}
+    except BulkWriteError as err:
+        return None, dbc.bulk_failures(err, len(ops), ordered)
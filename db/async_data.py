@@ -0,0 +1,132 @@
+"""
+This file holds async versions of the data functions that the ASGI app
+(API/asgi.py) serves itself: the lookups a kiosk makes during a
+check-in rush, badge progress, and recording attendance.
+Each gives the same result as its namesake in data.py, progress.py or
+attendance.py, with the same DB calls, and shares their caches. What
+to write comes from the plan functions of those modules (such as
+`attendance.check_in_plan()`), so only the awaits are here.
+"""
+import db.async_connect as adbc
+import db.data as data
+import db.cache as cache
+import db.progress as progress
+import db.attendance as attendance
+
+# the catalog holding each kind of session, and its key:
+SESSIONS = {progress.TRAINING: (data.TRAININGS, data.TRAININGS_NM),
+            progress.WORKSHOP: (data.WORKSHOPS, data.WORKSHOPS_NM)}
+
+
+async def ping():
+    await adbc.ping()
+
+
+async def get_user_by_id(netid):
+    rec = await adbc.fetch_one(data.USERS, filters={data.NETID: netid})
+    return data.parse_json(rec)
+
+
+async def get_user_by_barcode(barcode):
+    return await adbc.fetch_one(data.USERS,
+                                filters=data.barcode_filter(barcode),
+                                projection=data.KIOSK_FIELDS)
+
+
+async def netid_exists(netid):
+    rec = await adbc.fetch_one(data.USERS, filters={data.NETID: netid},
+                               projection={"_id": 1})
+    return rec is not None
+
+
+async def session_exists(kind, name):
+    collect_nm, key_nm = SESSIONS[kind]
+    rec = await adbc.fetch_one(collect_nm, filters={key_nm: name},
+                               projection={"_id": 1})
+    return rec is not None
+
+
+async def get_badge_by_id(badgename):
+    rec = await adbc.fetch_one(data.BADGES,
+                               filters={data.BADGES_NM: badgename})
+    return data.parse_json(rec)
+
+
+async def get_badge_details(badgename):
+    return data.badge_details(await adbc.aggregate(
+        data.BADGES, data.badge_details_pipeline(badgename)))
+
+
+async def requirements():
+    async def load():
+        return progress.requirements_of(await adbc.fetch_all(
+            data.BADGES, data.BADGES_NM,
+            projection=progress.REQUIREMENT_FIELDS))
+
+    return await cache.get_cache(data.BADGES).get_async(
+        progress.REQUIREMENTS_KEY, load)
+
+
+async def get_progress(netid):
+    return await adbc.fetch_all(data.PROGRESS, data.BADGES_NM,
+                                filters={data.NETID: netid},
+                                projection=progress.RECORD_FIELDS)
+
+
+async def get_completed(netid):
+    return attendance.completed_of(await adbc.fetch_docs(
+        data.ATTENDANCE, {data.NETID: netid},
+        projection=attendance.COMPLETED_FIELDS,
+        sort=attendance.COMPLETED_SORT))
+
+
+async def get_badge_progress(netid, badgename):
+    rec = await adbc.fetch_one(data.PROGRESS,
+                               filters=progress.record_filter(netid,
+                                                              badgename),
+                               projection=progress.RECORD_FIELDS)
+    if rec is not None:
+        return data.parse_json(rec)
+    needs, counts_for = await requirements()
+    if badgename not in needs:
+        return None
+    return progress.badge_progress(needs, badgename,
+                                   attendance.completed_pairs(
+                                       await get_completed(netid)))
+
+
+async def record_completions(netids, kind, name):
+    badges, writes = progress.completion_plan(await requirements(), netids,
+                                              kind, name)
+    for ops in writes:
+        result, failures = await adbc.bulk_write(data.PROGRESS, ops)
+    if writes and result.modified_count:
+        await queue_notifications(progress.users_filter(netids))
+    return badges
+
+
+async def queue_notifications(filters={}):
+    recs = await adbc.fetch_docs(data.PROGRESS,
+                                 progress.unnotified_filter(filters),
+                                 projection=progress.NOTIFY_FIELDS)
+    netids, ops = progress.notification_plan(recs)
+    if ops:
+        await adbc.bulk_write(data.JOBS, ops)
+    return netids
+
+
+async def record_attendance(netid, kind, name, when=None):
+    ret, statuses = await check_in(kind, name, [netid], when)
+    return statuses[0] if ret == data.OK else ret
+
+
+async def check_in(kind, name, netids, when=None):
+    if not await session_exists(kind, name):
+        return data.NOT_FOUND, []
+    existing = await adbc.fetch_keys(data.USERS, data.NETID, netids)
+    present, ops, statuses = attendance.check_in_plan(kind, name, netids,
+                                                      existing, when)
+    if ops:
+        await adbc.bulk_write(data.ATTENDANCE, ops)
+        await record_completions(present, kind, name)
+    return data.OK, statuses
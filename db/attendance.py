@@ -0,0 +1,181 @@
+"""
+This file records attendance at trainings and workshops.
+Attendance is an append-only log: one event per user per session
+attended, never updated. Compound indexes on (netid, time) and
+(session, time) answer "what has this user done" and "who came to this"
+without scanning the log.
+Each event also counts towards the user's badge progress.
+"""
+import datetime
+
+import db.db_connect as dbc
+import db.data as data
+import db.progress as progress
+
+# fields of an attendance event:
+KIND = "kind"
+SESSION = "session"
+TIME = "time"
+
+KINDS = [progress.TRAINING, progress.WORKSHOP]
+# what `get_completed()` reads of a user's events, and in what order:
+COMPLETED_FIELDS = {"_id": 0, KIND: 1, SESSION: 1}
+COMPLETED_SORT = [(TIME, 1)]
+SESSION_EXISTS = {progress.TRAINING: data.training_exists,
+                  progress.WORKSHOP: data.workshop_exists}
+
+dbc.add_index(data.ATTENDANCE, [(data.NETID, 1), (TIME, 1)])
+dbc.add_index(data.ATTENDANCE, [(SESSION, 1), (TIME, 1)])
+
+data.add_reference(data.USERS, data.ATTENDANCE, data.NETID)
+data.add_reference(data.TRAININGS, data.ATTENDANCE, SESSION,
+                   {KIND: progress.TRAINING})
+data.add_reference(data.WORKSHOPS, data.ATTENDANCE, SESSION,
+                   {KIND: progress.WORKSHOP})
+
+
+def new_event(netid, kind, name, when):
+    return {data.NETID: netid, KIND: kind, SESSION: name, TIME: when}
+
+
+def record_attendance(netid, kind, name, when=None):
+    """
+    Record that a user attended a training or workshop.
+    Returns NOT_FOUND if there is no such user or session.
+    """
+    ret, statuses = check_in(kind, name, [netid], when)
+    return statuses[0] if ret == data.OK else ret
+
+
+def check_in(kind, name, netids, when=None):
+    """
+    Record everyone who attended one session at once: one query finds
+    which users exist and one bulk write logs them, however many.
+    Returns NOT_FOUND and no statuses if there is no such session,
+    else OK and a status (OK or NOT_FOUND) per netid.
+    """
+    if not SESSION_EXISTS[kind](name):
+        return data.NOT_FOUND, []
+    existing = dbc.fetch_keys(data.USERS, data.NETID, netids)
+    present, ops, statuses = check_in_plan(kind, name, netids, existing,
+                                           when)
+    if ops:
+        dbc.bulk_write(data.ATTENDANCE, ops)
+        progress.record_completions(present, kind, name)
+    return data.OK, statuses
+
+
+def check_in_plan(kind, name, netids, existing, when=None):
+    """
+    What `check_in()` writes, given the netids that exist: the users
+    present (each once), the events that log them, and a status per
+    netid.
+    """
+    present = list(dict.fromkeys(netid for netid in netids
+                                 if netid in existing))
+    when = when or datetime.datetime.utcnow()
+    ops = [dbc.InsertOne(new_event(netid, kind, name, when))
+           for netid in present]
+    return present, ops, [data.OK if netid in existing else data.NOT_FOUND
+                          for netid in netids]
+
+
+def get_attendees(kind, name, limit=None):
+    """
+    Who attended a training or workshop: the netid and time of each
+    attendance, earliest first.
+    """
+    return dbc.all_docs(data.ATTENDANCE, {SESSION: name, KIND: kind},
+                        projection={"_id": 0, data.NETID: 1, TIME: 1},
+                        sort=[(TIME, 1)], limit=limit)
+
+
+def get_attendance(netid, limit=None):
+    """
+    A user's attendance events, latest first.
+    """
+    return dbc.all_docs(data.ATTENDANCE, {data.NETID: netid},
+                        projection={"_id": 0, data.NETID: 0},
+                        sort=[(TIME, -1)], limit=limit)
+
+
+def get_badge_progress(netid, badgename):
+    """
+    A user's progress towards one badge: how many more trainings and
+    workshops they need, and which. A badge not started yet has no
+    record, so its progress is worked out from its requirements and
+    what the user attended (perhaps before the badge existed).
+    Returns None if the badge requires nothing (or does not exist).
+    """
+    rec = dbc.fetch_one(data.PROGRESS,
+                        filters=progress.record_filter(netid, badgename),
+                        projection=progress.RECORD_FIELDS)
+    if rec is not None:
+        return dbc.to_json(rec)
+    needs, counts_for = progress.requirements()
+    if badgename not in needs:
+        return None
+    return progress.badge_progress(needs, badgename,
+                                   completed_pairs(get_completed(netid)))
+
+
+def get_completed(netid):
+    """
+    What a user has completed: the names of the trainings and of the
+    workshops they attended, each once, in the order first attended.
+    """
+    return completed_of(dbc.all_docs(data.ATTENDANCE, {data.NETID: netid},
+                                     projection=COMPLETED_FIELDS,
+                                     sort=COMPLETED_SORT))
+
+
+def completed_of(events):
+    """
+    What `get_completed()` returns, given the user's events, earliest
+    first.
+    """
+    completed = {kind: {} for kind in KINDS}
+    for event in events:
+        completed[event[KIND]][event[SESSION]] = True
+    return {kind: list(names) for kind, names in completed.items()}
+
+
+def completed_pairs(completed):
+    """
+    What `get_completed()` returns, as a set of (kind, name) pairs.
+    """
+    return {(kind, name) for kind in completed for name in completed[kind]}
+
+
+def rebuild_progress(netid):
+    """
+    Recompute a user's badge progress from their whole attendance log.
+    """
+    progress.rebuild(netid, completed_pairs(get_completed(netid)))
+
+
+def rebuild_badges(badgenames):
+    """
+    Recompute every user's progress towards the given badges from the
+    attendance log: after the badges are added, so what users attended
+    before counts towards them. One query finds the events that count.
+    """
+    needs, counts_for = progress.requirements()
+    sessions = {}
+    for badge in badgenames:
+        for kind, names in zip(KINDS, needs.get(badge, ())):
+            sessions.setdefault(kind, set()).update(names)
+    completed = {}
+    if sessions:
+        events = dbc.fetch_docs(
+            data.ATTENDANCE,
+            {"$or": [{KIND: kind, SESSION: {"$in": list(names)}}
+                     for kind, names in sessions.items()]},
+            projection={"_id": 0, data.NETID: 1, KIND: 1, SESSION: 1})
+        for event in events:
+            completed.setdefault(event[data.NETID], set()).add(
+                (event[KIND], event[SESSION]))
+    progress.rebuild_badges(badgenames, completed)
+
+
+data.on_new_badges(rebuild_badges)
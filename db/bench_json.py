@@ -0,0 +1,79 @@
+"""
+Benchmark converting BSON documents to JSON-safe objects:
+the old string round trip (`json.loads(bson.json_util.dumps(doc))`)
+against the single-pass `db_connect.to_json()`.
+By default it times synthetic user records; pass a collection name to
+time the documents of a real collection instead.
+Usage: python3 bench_json.py [num_docs] [collection_name]
+"""
+import sys
+import json
+import time
+import datetime
+from bson import ObjectId
+import bson.json_util as bsutil
+
+import db_connect as dbc
+
+DEF_NUM_DOCS = 50000
+REPEATS = 3
+
+
+def synthetic_docs(num_docs):
+    """
+    Make user-like documents, with the BSON types our records carry.
+    """
+    now = datetime.datetime.utcnow()
+    return [{"_id": ObjectId(),
+             "netid": f"ab{i}",
+             "firstName": "First",
+             "lastName": "Last",
+             "barcode": str(100000000 + i),
+             "created": now,
+             "trainings": ["t1", "t2", "t3"],
+             "attended": [{"session": "w1", "time": now}]}
+            for i in range(num_docs)]
+
+
+def round_trip(docs):
+    return [json.loads(bsutil.dumps(doc)) for doc in docs]
+
+
+def single_pass(docs):
+    return [dbc.to_json(doc) for doc in docs]
+
+
+def best_time(convert, docs):
+    """
+    The best of a few runs, in seconds.
+    """
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        convert(docs)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    num_docs = int(sys.argv[1]) if len(sys.argv) > 1 else DEF_NUM_DOCS
+    if len(sys.argv) > 2:
+        collect = dbc.get_client()[dbc.db_nm][sys.argv[2]]
+        docs = list(collect.find().limit(num_docs))
+    else:
+        docs = synthetic_docs(num_docs)
+    if round_trip(docs) != single_pass(docs):
+        print("Conversions disagree!")
+        exit(1)
+    old = best_time(round_trip, docs)
+    new = best_time(single_pass, docs)
+    print(f"{len(docs)} docs")
+    print(f"json_util round trip: {old:.3f}s ({len(docs) / old:.0f} docs/s)")
+    print(f"to_json single pass:  {new:.3f}s ({len(docs) / new:.0f} docs/s)")
+    print(f"speedup: {old / new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""
+This program builds the indexes our data layer registers, once, out of
+band:
+    python3 -m db.build_indexes
+The Procfile runs it in the release phase of each deploy, so the web
+and worker processes (run with MAYS_INDEX_BUILD=off) never spend their
+startup or first request on index builds.
+The migrations an index depends on run first.
+It exits non-zero if any index could not be built.
+"""
+import sys
+
+import db.db_connect as dbc
+# importing these registers their indexes:
+import db.data as data
+import db.progress  # noqa: F401
+import db.attendance  # noqa: F401
+import db.jobs  # noqa: F401
+
+
+def main():
+    # we build them below, in the foreground:
+    dbc.INDEX_BUILD = dbc.INDEX_BUILD_OFF
+    cleared = data.clear_placeholder_barcodes()
+    print(f"Cleared the placeholder barcodes of {cleared} users.")
+    failures = dbc.ensure_indexes(dbc.get_client())
+    print(f"Built {len(dbc.indexes) - len(failures)} of "
+          f"{len(dbc.indexes)} indexes.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
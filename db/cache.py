@@ -0,0 +1,146 @@
+"""
+This file contains a small in-process cache for data that rarely
+changes (our badge, training and workshop catalogs).
+Entries expire after a TTL and writers invalidate them explicitly.
+Each cache is named after the collection it holds.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+# seconds an entry lives; 0 turns caching off:
+DEF_TTL = float(os.environ.get("MAYS_CACHE_TTL", 60))
+# entries a cache holds at most:
+DEF_MAX_ENTRIES = int(os.environ.get("MAYS_CACHE_MAX_ENTRIES", 256))
+
+caches = {}
+
+
+class TTLCache:
+    """
+    A read-through cache: `get()` returns the cached value for a key,
+    loading it on a miss. `invalidate()` drops every entry.
+    Keys can come from clients (a page cursor, say), so the cache
+    holds at most `max_entries`: expired entries go first, then the
+    least recently used.
+    """
+
+    def __init__(self, name, ttl=DEF_TTL, max_entries=DEF_MAX_ENTRIES):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # key -> (expiry, value), least recently used first:
+        self.entries = OrderedDict()
+        # bumped by invalidate(), so a load that raced a write is not kept:
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def lookup(self, key, now):
+        """
+        The live entry for key, or None; an expired one is dropped.
+        Call with the lock held.
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return entry
+            del self.entries[key]
+            self.evictions += 1
+        self.misses += 1
+        return None
+
+    def store(self, key, value, now, generation):
+        if self.ttl <= 0:
+            return
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.entries[key] = (now + self.ttl, value)
+            self.entries.move_to_end(key)
+            # a miss is rare, and the cache small: sweep it
+            for old_key in [old_key for old_key, (expiry, val)
+                            in self.entries.items() if expiry <= now]:
+                del self.entries[old_key]
+                self.evictions += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, key, loader):
+        """
+        Return the value for key, calling `loader()` on a miss.
+        The value is shared between callers: do not modify it.
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.lookup(key, now)
+            generation = self.generation
+        if entry is not None:
+            return entry[1]
+        value = loader()
+        self.store(key, value, now, generation)
+        return value
+
+    async def get_async(self, key, loader):
+        """
+        Like `get()`, for a coroutine function `loader`.
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.lookup(key, now)
+            generation = self.generation
+        if entry is not None:
+            return entry[1]
+        value = await loader()
+        self.store(key, value, now, generation)
+        return value
+
+    def invalidate(self):
+        with self.lock:
+            self.entries = OrderedDict()
+            self.generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "invalidations": self.invalidations,
+                    "evictions": self.evictions,
+                    "entries": len(self.entries)}
+
+
+def get_cache(name, ttl=DEF_TTL, max_entries=DEF_MAX_ENTRIES):
+    """
+    Get the cache called name, making it if need be.
+    """
+    if name not in caches:
+        caches[name] = TTLCache(name, ttl, max_entries)
+    return caches[name]
+
+
+def invalidate(name):
+    """
+    Drop everything cached under name, if there is such a cache.
+    """
+    if name in caches:
+        caches[name].invalidate()
+
+
+def invalidate_all():
+    for name in caches:
+        caches[name].invalidate()
+
+
+def stats():
+    """
+    Hit, miss and invalidation counts for every cache.
+    """
+    return {name: caches[name].stats() for name in caches}
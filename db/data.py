@@ -6,9 +6,10 @@ Gradually, we will fill in actual calls to our datastore.
 
 import os
 import json
-from bson import json_util
+import hashlib
 # import utils
 import db.db_connect as dbc
+import db.cache as cache
 
 MAYS_HOME = os.environ["MAYS_HOME"]
 
@@ -17,6 +18,9 @@ USERS = "users"
 TRAININGS = "trainings"
 BADGES = "badges"
 WORKSHOPS = "workshops"
+PROGRESS = "progress"
+ATTENDANCE = "attendance"
+JOBS = "jobs"
 
 # field names in our DB:
 USERS_NM = "userName"
@@ -30,10 +34,150 @@ TRAININGS_NM = "trainingName"
 BADGES_NM = "badgeName"
 DESC = "description"
 WORKSHOPS_NM = "workshopName"
+# what a badge requires: lists of training and workshop names
+BADGE_TRAININGS = "trainingname"
+BADGE_WORKSHOPS = "workshopname"
+
+# the natural key of each collection:
+KEY_FIELDS = {
+    USERS: NETID,
+    BADGES: BADGES_NM,
+    TRAININGS: TRAININGS_NM,
+    WORKSHOPS: WORKSHOPS_NM,
+}
+
+# the fields a card-swipe kiosk needs about a user:
+KIOSK_FIELDS = {"_id": 0, NETID: 1, FIRST_NM: 1, LAST_NM: 1, BARCODE: 1}
 
 OK = 0
 NOT_FOUND = 1
 DUPLICATE = 2
+# in an ordered bulk write, items after a failure are not attempted:
+SKIPPED = 3
+
+# card numbers old records carry in place of a real barcode:
+PLACEHOLDER_BARCODES = [999999, 999999999]
+
+STATUS_NAMES = {OK: "OK", NOT_FOUND: "NOT_FOUND", DUPLICATE: "DUPLICATE",
+                SKIPPED: "SKIPPED"}
+
+# the catalogs change a few times a semester: cache them in-process.
+CATALOGS = [BADGES, TRAININGS, WORKSHOPS]
+for catalog in CATALOGS:
+    cache.get_cache(catalog)
+
+# natural keys are unique; sparse so records without the key don't clash:
+dbc.add_index(USERS, NETID, unique=True, sparse=True)
+# (old records share placeholder barcodes: `clear_placeholder_barcodes()`
+# must run first, or this index cannot be built)
+dbc.add_index(USERS, BARCODE, unique=True, sparse=True)
+dbc.add_index(BADGES, BADGES_NM, unique=True, sparse=True)
+dbc.add_index(TRAININGS, TRAININGS_NM, unique=True, sparse=True)
+dbc.add_index(WORKSHOPS, WORKSHOPS_NM, unique=True, sparse=True)
+# find the badges that require a training or workshop:
+dbc.add_index(BADGES, BADGE_TRAININGS)
+dbc.add_index(BADGES, BADGE_WORKSHOPS)
+
+# called with the name of each collection we write to: see `on_change()`.
+change_hooks = []
+
+# called with the names of badges added: see `on_new_badges()`.
+new_badge_hooks = []
+
+# the records that go when a record of each collection is deleted:
+# {collect_nm: [(dep_collect_nm, field), ...]}
+dependents = {}
+
+# which fields refer to records of each collection by key, so renames can
+# follow: {collect_nm: [(ref_collect_nm, field, filters, is_list), ...]}
+references = {}
+
+
+def on_change(hook):
+    """
+    Have hook(collect_nm) called after each write this process makes
+    to a collection (once its cache here is dropped).
+    """
+    if hook not in change_hooks:
+        change_hooks.append(hook)
+
+
+def changed(collect_nm):
+    """
+    We wrote to collect_nm: drop its cache and tell the hooks.
+    """
+    cache.invalidate(collect_nm)
+    for hook in change_hooks:
+        hook(collect_nm)
+
+
+def on_new_badges(hook):
+    """
+    Have hook(badgenames) called after badges are added, so what users
+    did before then can count towards them.
+    """
+    if hook not in new_badge_hooks:
+        new_badge_hooks.append(hook)
+
+
+def badges_added(badgenames):
+    changed(BADGES)
+    for hook in new_badge_hooks:
+        hook(badgenames)
+
+
+def add_reference(collect_nm, ref_collect_nm, field, filters={},
+                  is_list=False):
+    """
+    Register that `field` of the records of ref_collect_nm (those that
+    meet filters) holds the key of a collect_nm record, or a list of
+    such keys, so that renaming the record renames the references.
+    The field should be indexed.
+    """
+    references.setdefault(collect_nm, []).append(
+        (ref_collect_nm, field, filters, is_list))
+
+
+def add_dependent(collect_nm, dep_collect_nm, field):
+    """
+    Register that the records of dep_collect_nm whose `field` holds the
+    key of a collect_nm record are deleted with it. The field should
+    be indexed.
+    """
+    dependents.setdefault(collect_nm, []).append((dep_collect_nm, field))
+
+
+def del_dependents(collect_nm, keys, session=None):
+    """
+    Delete the records that go with the collect_nm records of keys:
+    one write per dependent collection.
+    """
+    for dep_collect_nm, field in dependents.get(collect_nm, []):
+        dbc.del_many(dep_collect_nm, filters={field: {"$in": list(keys)}},
+                     session=session)
+
+
+def del_record(collect_nm, key):
+    """
+    Delete a record by key, with the records that go with it, in a
+    transaction where the server has them.
+    Returns NOT_FOUND if there is no such record.
+    """
+    key_nm = KEY_FIELDS[collect_nm]
+
+    def delete(session):
+        ret = dbc.del_one(collect_nm, filters={key_nm: key},
+                          session=session)
+        if ret.deleted_count == 0:
+            return NOT_FOUND
+        del_dependents(collect_nm, [key], session)
+        return OK
+
+    return dbc.run_transaction(delete)
+
+
+add_reference(TRAININGS, BADGES, BADGE_TRAININGS, is_list=True)
+add_reference(WORKSHOPS, BADGES, BADGE_WORKSHOPS, is_list=True)
 
 # DEMO_HOME = os.environ["DEMO_HOME"]
 # TEST_MODE = os.environ.get("TEST_MODE", 0)
@@ -66,23 +210,103 @@ DUPLICATE = 2
 #     except FileNotFoundError:
 #         print(f"{perm_version} not found.")
 #         return None
-client = dbc.get_client()
 
 
-if client is None:
-    print("Failed to connect to MongoDB")
-    exit(1)
+def cache_stats():
+    """
+    Hit and miss counts of the catalog caches.
+    """
+    return cache.stats()
+
+
+def pool_stats():
+    """
+    Connection pool stats of this process.
+    """
+    return dbc.pool_stats()
+
+
+def page_key(limit, after, fields):
+    """
+    The cache key of one listing.
+    """
+    return (limit, after, tuple(fields) if fields else None)
+
+
+def content_etag(data):
+    """
+    A version tag for a record or listing: a hash of its contents.
+    It changes whenever the data does, in every worker alike.
+    """
+    text = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def get_catalog(collect_nm, limit=None, after=None, fields=None):
+    """
+    Return a listing of a catalog (badges, trainings or workshops)
+    and its ETag. Both are read through the catalog cache, so the tag
+    costs nothing once the listing is cached.
+    Do not modify the dict returned.
+    """
+    key_nm = KEY_FIELDS[collect_nm]
+    projection = dbc.projection_for(fields, key_nm)
+
+    def load():
+        docs = dbc.fetch_all(collect_nm, key_nm, filters={},
+                             projection=projection, limit=limit, after=after)
+        return docs, content_etag(docs)
+
+    return cache.get_cache(collect_nm).get(page_key(limit, after, fields),
+                                           load)
+
+
+def db_ready():
+    """
+    A readiness check: can we reach the database right now?
+    The connection itself is made lazily, on first use.
+    Returns True or False
+    """
+    return dbc.ping()
 
 
 def parse_json(data):
-    return json.loads(json_util.dumps(data))
+    """
+    Make a record from the db JSON-safe.
+    """
+    return dbc.to_json(data)
 
 
-def get_users():
+def get_users(limit=None, after=None, fields=None):
     """
     A function to return all users.
+    `limit` and `after` page through them in netid order;
+    `fields` limits what is returned for each user.
     """
-    return dbc.fetch_all(USERS, NETID)
+    return dbc.fetch_all(USERS, NETID,
+                         projection=dbc.projection_for(fields, NETID),
+                         limit=limit, after=after)
+
+
+def stream_docs(collect_nm, limit=None, after=None, fields=None):
+    """
+    Yield the records of a collection one at a time.
+    Paging and fields work as in `get_users()`.
+    """
+    key_nm = KEY_FIELDS[collect_nm]
+    return dbc.stream_all(collect_nm, key_nm,
+                          projection=dbc.projection_for(fields, key_nm),
+                          limit=limit, after=after)
+
+
+def next_cursor(collect_nm, limit=None, after=None, **kwargs):
+    """
+    The cursor to the page after this one of a listing, or None if
+    this page is not full (or the listing is not paged).
+    """
+    if not limit:
+        return None
+    return dbc.page_end(collect_nm, KEY_FIELDS[collect_nm], limit, after)
 
 
 def get_user_by_id(username):
@@ -94,6 +318,50 @@ def get_user_by_id(username):
     return parse_json(rec)
 
 
+def get_user_by_barcode(barcode):
+    """
+    Get the kiosk fields of the user with this card barcode.
+    Barcodes arrive as strings but older records store them as ints,
+    so we match either; both are answered by the barcode index.
+    Returns None if there is no such user.
+    """
+    return dbc.fetch_one(USERS, filters=barcode_filter(barcode),
+                         projection=KIOSK_FIELDS)
+
+
+def barcode_filter(barcode):
+    barcodes = [barcode]
+    if isinstance(barcode, str) and barcode.isdigit():
+        barcodes.append(int(barcode))
+    return {BARCODE: {"$in": barcodes}}
+
+
+def is_placeholder(barcode):
+    return str(barcode) in {str(code) for code in PLACEHOLDER_BARCODES}
+
+
+def clear_placeholder_barcodes():
+    """
+    A migration: drop the placeholder (or null) barcodes of old
+    records, which many users share, so the unique barcode index can
+    be built. A user without a barcode has no barcode field.
+    Returns the number of users changed.
+    """
+    codes = PLACEHOLDER_BARCODES + [str(code) for code in
+                                    PLACEHOLDER_BARCODES]
+    ret = dbc.update_many(USERS, {BARCODE: {"$in": codes + [None],
+                                            "$exists": True}},
+                          {"$unset": {BARCODE: ""}})
+    return ret.modified_count
+
+
+def failed_indexes():
+    """
+    The indexes this process could not build, for /ready.
+    """
+    return sorted(dbc.index_failures)
+
+
 def get_password(username):
     """
     A function to return password param of user.
@@ -103,21 +371,25 @@ def get_password(username):
     return data['password']
 
 
-def get_trainings():
+def get_trainings(limit=None, after=None, fields=None):
     """
     A function to return a dictionary of all trainings.
+    Paging and fields work as in `get_users()`.
+    Listings are cached: do not modify the dict returned.
     """
     # return read_collection(TRAININGS_COLLECTION)
-    return dbc.fetch_all(TRAININGS, TRAININGS_NM)
+    return get_catalog(TRAININGS, limit, after, fields)[0]
 
 
-def get_badges():
+def get_badges(limit=None, after=None, fields=None):
     """
     A function to return a dictionary of all badgenames and their description.
+    Paging and fields work as in `get_users()`.
+    Listings are cached: do not modify the dict returned.
     """
     # return read_collection(BADGES_COLLECTION)
     # return dbc.fetch_all(BADGES, BADGES_NM)
-    return dbc.fetch_all(BADGES, BADGES_NM, filters={})
+    return get_catalog(BADGES, limit, after, fields)[0]
 
 
 def get_badge_by_id(badgename):
@@ -129,13 +401,67 @@ def get_badge_by_id(badgename):
     return parse_json(rec)
 
 
-def get_workshops():
+def requirement_lookup(collect_nm, local_nm, as_nm):
+    """
+    An aggregation stage joining a badge to the records of the trainings
+    or workshops it requires.
+    """
+    return {"$lookup": {"from": collect_nm, "localField": local_nm,
+                        "foreignField": KEY_FIELDS[collect_nm],
+                        "as": as_nm}}
+
+
+def get_badge_details(badgename):
+    """
+    A badge with the full records of the trainings and workshops it
+    requires (in the order it lists them), from one aggregation that
+    reads each collection by its key index.
+    Returns None if there is no such badge.
+    """
+    return badge_details(dbc.aggregate(BADGES,
+                                       badge_details_pipeline(badgename)))
+
+
+def badge_details_pipeline(badgename):
+    return [
+        {"$match": {BADGES_NM: badgename}},
+        {"$limit": 1},
+        {"$project": {"_id": 0}},
+        requirement_lookup(TRAININGS, BADGE_TRAININGS, TRAININGS),
+        requirement_lookup(WORKSHOPS, BADGE_WORKSHOPS, WORKSHOPS),
+    ]
+
+
+def badge_details(docs):
+    """
+    The result of `get_badge_details()` from what its aggregation
+    returned.
+    """
+    if not docs:
+        return None
+    badge = docs[0]
+    for collect_nm, names_nm in ((TRAININGS, BADGE_TRAININGS),
+                                 (WORKSHOPS, BADGE_WORKSHOPS)):
+        names = badge.get(names_nm) or []
+        if isinstance(names, str):
+            names = [names]
+        order = {name: index for index, name in enumerate(names)}
+        for rec in badge[collect_nm]:
+            rec.pop("_id", None)
+        badge[collect_nm].sort(
+            key=lambda rec: order.get(rec[KEY_FIELDS[collect_nm]], 0))
+    return badge
+
+
+def get_workshops(limit=None, after=None, fields=None):
     """
     A function to return a dictionary of all workshops.
+    Paging and fields work as in `get_users()`.
+    Listings are cached: do not modify the dict returned.
     """
 
     # return read_collection(WORKSHOPS_COLLECTION)
-    return dbc.fetch_all(WORKSHOPS, WORKSHOPS_NM)
+    return get_catalog(WORKSHOPS, limit, after, fields)[0]
 
 
 def netid_exists(netid):
@@ -174,15 +500,28 @@ def training_exists(trainingname):
     return rec is not None
 
 
-def add_user(netid, firstname, lastname, barcode=999999999):
+def new_user_doc(netid, firstname, lastname, barcode=None):
+    """
+    The record of a new user.
+    Barcodes are unique too; a user without one (or with a placeholder)
+    gets no barcode field.
+    """
+    user = {NETID: netid, FIRST_NM: firstname, LAST_NM: lastname}
+    if barcode is not None and not is_placeholder(barcode):
+        user[BARCODE] = barcode
+    return user
+
+
+def add_user(netid, firstname, lastname, barcode=None):
     """
     Add a new user to the user database.
     """
-    if netid_exists(netid):
+    try:
+        dbc.insert_doc(USERS, new_user_doc(netid, firstname, lastname,
+                                           barcode))
+    except dbc.DuplicateKeyError:
         return DUPLICATE
-    else:
-        dbc.insert_doc(USERS, {NETID: netid, FIRST_NM: firstname,
-                       LAST_NM: lastname, BARCODE: barcode})
+    return OK
 
 
 # def add_user(username, password):
@@ -195,137 +534,279 @@ def add_user(netid, firstname, lastname, barcode=999999999):
 #         dbc.insert_doc(USERS, {USERS_NM: username, PASSWORD: password})
 
 
-def add_user2(netid, firstname, lastname, password, barcode=999999999):
+def add_user2(netid, firstname, lastname, password, barcode=None):
     """
     Add a new user to the user database.
     """
-    if netid_exists(netid):
-        return DUPLICATE
-    else:
+    try:
         # salt = utils.gen_salt()
         # hashed = utils.hash_pw(salt,password)
-        dbc.insert_doc(USERS, {NETID: netid, FIRST_NM: firstname,
-                       LAST_NM: lastname, BARCODE: barcode})
+        dbc.insert_doc(USERS, new_user_doc(netid, firstname, lastname,
+                                           barcode))
         #              PASSWORD: hashed})
         # for now netid is all 0
+    except dbc.DuplicateKeyError:
+        return DUPLICATE
+    return OK
 
 
 def add_workshop(workshopname):
     """
     Add a new workshop to the workshop database.
     """
-    if workshop_exists(workshopname):
-        return DUPLICATE
-    else:
+    try:
         dbc.insert_doc(WORKSHOPS, {WORKSHOPS_NM: workshopname})
+    except dbc.DuplicateKeyError:
+        return DUPLICATE
+    changed(WORKSHOPS)
+    return OK
+
+
+def new_badge_doc(badgename, desc, trainings=None, workshops=None):
+    """
+    The record of a new badge, with the trainings and workshops
+    it requires, if any.
+    """
+    badge = {BADGES_NM: badgename, DESC: desc}
+    if trainings:
+        badge[BADGE_TRAININGS] = list(trainings)
+    if workshops:
+        badge[BADGE_WORKSHOPS] = list(workshops)
+    return badge
 
 
-def add_badge(badgename, desc):
+def add_badge(badgename, desc, trainings=None, workshops=None):
     """
     Add a new badge to the badge database.
     """
-    if badge_exists(badgename):
+    try:
+        dbc.insert_doc(BADGES, new_badge_doc(badgename, desc, trainings,
+                                             workshops))
+    except dbc.DuplicateKeyError:
         return DUPLICATE
-    else:
-        dbc.insert_doc(BADGES, {BADGES_NM: badgename, DESC: desc})
+    badges_added([badgename])
+    return OK
+
+
+def as_name_list(names):
+    """
+    A list of names from a comma-separated string (or a list),
+    without blanks or repeats. "-" stands for no names.
+    """
+    if isinstance(names, str):
+        names = [] if names.strip() == "-" else names.split(",")
+    return list(dict.fromkeys(name.strip() for name in names
+                              if name and name.strip()))
+
+
+def ensure_names(collect_nm, names):
+    """
+    Make sure a catalog (trainings or workshops) has each of names:
+    one `$in` query finds the ones it has, one bulk write adds the rest.
+    Returns the names added.
+    """
+    key_nm = KEY_FIELDS[collect_nm]
+    existing = dbc.fetch_keys(collect_nm, key_nm, names)
+    missing = [name for name in names if name not in existing]
+    if missing:
+        # upserts, in case someone adds one of them at the same time:
+        dbc.bulk_write(collect_nm,
+                       [dbc.UpdateOne({key_nm: name},
+                                      {"$setOnInsert": {key_nm: name}},
+                                      upsert=True)
+                        for name in missing])
+        changed(collect_nm)
+    return missing
+
+
+def create_badge(badgename, desc, trainings=(), workshops=()):
+    """
+    Add a badge requiring the given trainings and workshops, adding
+    those not in their catalogs yet, and count what users attended
+    before towards it. It takes at most eleven DB calls, however many
+    requirements and users there are.
+    """
+    trainings = as_name_list(trainings)
+    workshops = as_name_list(workshops)
+    ret = add_badge(badgename, desc, trainings, workshops)
+    if ret == OK:
+        if trainings:
+            ensure_names(TRAININGS, trainings)
+        if workshops:
+            ensure_names(WORKSHOPS, workshops)
+    return ret
 
 
 def add_training(trainingname):
     """
     Add a new training to the training database.
     """
-    if training_exists(trainingname):
-        return DUPLICATE
-    else:
+    try:
         dbc.insert_doc(TRAININGS, {TRAININGS_NM: trainingname})
+    except dbc.DuplicateKeyError:
+        return DUPLICATE
+    changed(TRAININGS)
+    return OK
 
 
 def del_user(netid):
     """
     Delete username from the db.
     """
-    if not netid_exists(netid):
-        return NOT_FOUND
-    else:
-        dbc.del_one(USERS, filters={NETID: netid})
-        return OK
+    return del_record(USERS, netid)
 
 
 def del_workshop(workshopname):
     """
     Delete workshop from the db.
     """
-    if not workshop_exists(workshopname):
+    ret = dbc.del_one(WORKSHOPS, filters={WORKSHOPS_NM: workshopname})
+    if ret.deleted_count == 0:
         return NOT_FOUND
-    else:
-        dbc.del_one(WORKSHOPS, filters={WORKSHOPS_NM: workshopname})
-        return OK
+    changed(WORKSHOPS)
+    return OK
 
 
 def del_training(trainingname):
     """
     Delete training from the db.
     """
-    if not training_exists(trainingname):
+    ret = dbc.del_one(TRAININGS, filters={TRAININGS_NM: trainingname})
+    if ret.deleted_count == 0:
         return NOT_FOUND
-    else:
-        dbc.del_one(TRAININGS, filters={TRAININGS_NM: trainingname})
-        return OK
+    changed(TRAININGS)
+    return OK
+
+
+def rename(collect_nm, oldname, newname):
+    """
+    Rename a record and every reference to it (see `add_reference()`),
+    in a transaction where the server has them: one write for the
+    record, then one bulk write per collection that refers to it.
+    Where there are none, a clash puts back what was written.
+    The unique index on the key rejects a rename onto an existing name.
+    Returns a status code and how many records were changed in each
+    collection.
+    """
+    key_nm = KEY_FIELDS[collect_nm]
+    if oldname == newname:
+        # nothing to write: report what the two-step check used to.
+        if dbc.fetch_one(collect_nm, filters={key_nm: oldname}) is None:
+            return NOT_FOUND, {}
+        return DUPLICATE, {}
+
+    def renamed(session):
+        ret = dbc.update_one(collect_nm, filters={key_nm: oldname},
+                             updates={"$set": {key_nm: newname}},
+                             session=session)
+        if ret.matched_count == 0:
+            return NOT_FOUND, {}
+        try:
+            touched = cascade(collect_nm, [(oldname, newname)], session)
+        except dbc.DuplicateKeyError:
+            if session is None:
+                # no transaction to abort: put the record back ourselves.
+                dbc.update_one(collect_nm, filters={key_nm: newname},
+                               updates={"$set": {key_nm: oldname}})
+            raise
+        return OK, {collect_nm: 1, **touched}
+
+    try:
+        ret, touched = dbc.run_transaction(renamed)
+    except dbc.DuplicateKeyError:
+        return DUPLICATE, {}
+    for name in touched:
+        changed(name)
+    return ret, touched
+
+
+def cascade(collect_nm, renames, session=None):
+    """
+    Point the references to records of collect_nm at their new keys,
+    given (old, new) pairs: one bulk write per referencing collection,
+    whose updates find their records through the indexed field.
+    Returns how many records changed in each of those collections.
+    Raises DuplicateKeyError if a rename clashes with a unique index.
+    Without a session (no transactions) nothing would undo the writes
+    made before the clash, so it puts those references back itself.
+    """
+    touched = {}
+    if not renames:
+        return touched
+    olds = [old for old, new in renames]
+    done = []
+    for ref_collect_nm, field, filters, is_list in references.get(
+            collect_nm, []):
+        if session is None:
+            # the records we may change, to put back after a clash:
+            ids = [doc["_id"] for doc in dbc.fetch_docs(
+                ref_collect_nm, {**filters, field: {"$in": olds}},
+                projection={"_id": 1})]
+            done.append((ref_collect_nm, field,
+                         {**filters, "_id": {"$in": ids}}, is_list))
+        result, failures = dbc.bulk_write(
+            ref_collect_nm, reference_ops(field, filters, is_list, renames),
+            ordered=True, session=session)
+        if failures:
+            backs = [(new, old) for old, new in renames]
+            for undo_collect_nm, field, filters, is_list in done:
+                dbc.bulk_write(undo_collect_nm,
+                               reference_ops(field, filters, is_list, backs))
+            raise dbc.DuplicateKeyError(f"Renaming {collect_nm} references "
+                                        f"in {ref_collect_nm} clashes.")
+        touched[ref_collect_nm] = (touched.get(ref_collect_nm, 0)
+                                   + result.modified_count)
+    return touched
+
+
+def reference_ops(field, filters, is_list, renames):
+    """
+    The updates that rename the references held in `field` of the
+    records that meet filters, given (old, new) pairs.
+    """
+    ops = []
+    for old, new in renames:
+        if is_list:
+            ops.append(dbc.UpdateMany(
+                {**filters, field: {"$elemMatch": {"$eq": old}}},
+                {"$set": {f"{field}.$[ref]": new}},
+                array_filters=[{"ref": old}]))
+        # a single key (or an old record holding one in a list field):
+        ops.append(dbc.UpdateMany({**filters, field: old},
+                                  {"$set": {field: new}}))
+    return ops
 
 
 def update_user(oldnetid, newnetid):
     """
     Update old user name in db with new user name.
     """
-    if not netid_exists(oldnetid):
-        return NOT_FOUND
-    elif netid_exists(newnetid):
-        return DUPLICATE
-    else:
-        dbc.update_one(USERS, filters={NETID: oldnetid},
-                       updates={"$set": {NETID: newnetid}})
-    return OK
+    return rename(USERS, oldnetid, newnetid)[0]
 
 
 def update_training(oldtrainingname, newtrainingname):
     """
     Update old training name in db with new training name.
     """
-    if not training_exists(oldtrainingname):
-        return NOT_FOUND
-    elif training_exists(newtrainingname):
-        return DUPLICATE
-    else:
-        dbc.update_one(TRAININGS, filters={TRAININGS_NM: oldtrainingname},
-                       updates={"$set": {TRAININGS_NM: newtrainingname}})
-    return OK
+    return rename(TRAININGS, oldtrainingname, newtrainingname)[0]
 
 
 def update_badge(oldbadgename, newbadgename):
     """
     Update old badge name in db with new badge name.
     """
-    if not badge_exists(oldbadgename):
-        return NOT_FOUND
-    elif badge_exists(newbadgename):
-        return DUPLICATE
-    else:
-        dbc.update_one(BADGES, filters={BADGES_NM: oldbadgename},
-                       updates={"$set": {BADGES_NM: newbadgename}})
-    return OK
+    return rename(BADGES, oldbadgename, newbadgename)[0]
 
 
 def update_badge_desc(badgename, newbadgedesc):
     """
     Update old badge description in db with new badge description.
     """
-    if not badge_exists(badgename):
+    ret = dbc.update_one(BADGES, filters={BADGES_NM: badgename},
+                         updates={"$set": {DESC: newbadgedesc}})
+    if ret.matched_count == 0:
         return NOT_FOUND
-    elif badge_exists(badgename):
-        return DUPLICATE
-    else:
-        dbc.update_one(BADGES, filters={BADGES_NM: badgename},
-                       updates={"$set": {DESC: newbadgedesc}})
+    changed(BADGES)
     return OK
 
 
@@ -333,23 +814,190 @@ def update_workshop(oldwsname, newwsname):
     """
     Update old training name in db with new training name.
     """
-    if not workshop_exists(oldwsname):
-        return NOT_FOUND
-    elif workshop_exists(newwsname):
-        return DUPLICATE
-    else:
-        dbc.update_one(WORKSHOPS, filters={WORKSHOPS_NM: oldwsname},
-                       updates={"$set": {WORKSHOPS_NM: newwsname}})
-    return OK
+    return rename(WORKSHOPS, oldwsname, newwsname)[0]
 
 
 def del_badge(badgename):
     """
     Delete badge from the db.
     """
-    if not badge_exists(badgename):
-        return NOT_FOUND
-    else:
-        # b, desc = get_badges()
-        dbc.del_one(BADGES, filters={BADGES_NM: badgename})
-        return OK
+    ret = del_record(BADGES, badgename)
+    if ret == OK:
+        changed(BADGES)
+    return ret
+
+
+def bulk_statuses(statuses, op_items, failures):
+    """
+    Fill in the status of each item we sent in a bulk write.
+    `op_items` maps the index of each op to the index of its item.
+    """
+    for op_index, item_index in enumerate(op_items):
+        if op_index not in failures:
+            statuses[item_index] = OK
+        elif failures[op_index] is None:
+            statuses[item_index] = SKIPPED
+        else:
+            statuses[item_index] = DUPLICATE
+    return statuses
+
+
+def bulk_add(collect_nm, docs, ordered=False):
+    """
+    Add many records in a single round trip.
+    Returns a status code (OK, DUPLICATE or SKIPPED) per record.
+    """
+    if not docs:
+        return []
+    ops = [dbc.InsertOne(doc) for doc in docs]
+    result, failures = dbc.bulk_write(collect_nm, ops, ordered)
+    statuses = bulk_statuses([None] * len(docs), range(len(docs)), failures)
+    if collect_nm == BADGES:
+        added = [doc.get(BADGES_NM) for doc, status in zip(docs, statuses)
+                 if status == OK]
+        if added:
+            badges_added(added)
+    elif OK in statuses:
+        changed(collect_nm)
+    return statuses
+
+
+def bulk_plan(items, ordered, check, key=None):
+    """
+    Pre-check the items of a bulk write: `check(item)` returns the
+    status of an item that must not be written, else None. An item
+    whose key(item) repeats that of an item to write is a DUPLICATE.
+    Returns the statuses so far and the indexes of the items to write.
+    With `ordered`, the first failure stops the rest: they are SKIPPED.
+    """
+    statuses = [None] * len(items)
+    op_items = []
+    planned = set()
+    for index, item in enumerate(items):
+        item_key = item if key is None else key(item)
+        status = DUPLICATE if item_key in planned else check(item)
+        if status is None:
+            op_items.append(index)
+            planned.add(item_key)
+            continue
+        statuses[index] = status
+        if ordered:
+            statuses[index + 1:] = [SKIPPED] * (len(items) - index - 1)
+            break
+    return statuses, op_items
+
+
+def bulk_rename(collect_nm, renames, ordered=False):
+    """
+    Rename many records: `renames` is a list of (old, new) key pairs.
+    One `$in` query finds which old and new keys exist, then a single
+    bulk write renames them, and one more per referencing collection
+    renames the references (see `cascade()`). Where the server has
+    transactions all run in one, as in `rename()`. A pair renaming the
+    same old key as an earlier one is a DUPLICATE. With `ordered`, the
+    first failure stops the rest. Returns a status code per pair.
+    """
+    key_nm = KEY_FIELDS[collect_nm]
+    plan = {}
+
+    def check(pair):
+        old, new = pair
+        if old not in plan["existing"]:
+            return NOT_FOUND
+        if old == new or new in plan["existing"]:
+            return DUPLICATE
+        return None
+
+    def rename_all(session):
+        plan["existing"] = dbc.fetch_keys(
+            collect_nm, key_nm, [key for pair in renames for key in pair],
+            session=session)
+        statuses, op_items = bulk_plan(renames, ordered, check,
+                                       key=lambda pair: pair[0])
+        plan["statuses"], plan["op_items"] = statuses, op_items
+        if not op_items:
+            return statuses, {}
+        ops = [dbc.UpdateOne({key_nm: renames[index][0]},
+                             {"$set": {key_nm: renames[index][1]}})
+               for index in op_items]
+        result, failures = dbc.bulk_write(collect_nm, ops, ordered,
+                                          session=session)
+        bulk_statuses(statuses, op_items, failures)
+        written = [index for index in op_items if statuses[index] == OK]
+        if result is None or result.matched_count < len(written):
+            # a record went (or was renamed) since we looked: only the
+            # renames whose new key now exists matched anything.
+            found = dbc.fetch_keys(collect_nm, key_nm,
+                                   [renames[index][1] for index in written],
+                                   session=session)
+            for index in written:
+                if renames[index][1] not in found:
+                    statuses[index] = NOT_FOUND
+        renamed = [renames[index] for index in op_items
+                   if statuses[index] == OK]
+        try:
+            touched = cascade(collect_nm, renamed, session)
+        except dbc.DuplicateKeyError:
+            if session is None:
+                # no transaction to abort: put the records back ourselves.
+                dbc.bulk_write(collect_nm,
+                               [dbc.UpdateOne({key_nm: new},
+                                              {"$set": {key_nm: old}})
+                                for old, new in renamed])
+            raise
+        return statuses, {collect_nm: len(renamed), **touched}
+
+    try:
+        statuses, touched = dbc.run_transaction(rename_all)
+    except dbc.DuplicateKeyError:
+        # a reference clashed, so none of the renames stand (they
+        # were aborted, or put back):
+        statuses = plan["statuses"]
+        for index in plan["op_items"]:
+            if statuses[index] == OK:
+                statuses[index] = DUPLICATE
+        return statuses
+    for name in touched:
+        changed(name)
+    return statuses
+
+
+def bulk_delete(collect_nm, keys, ordered=False):
+    """
+    Delete many records by key, in one `$in` query and one bulk write,
+    then the records that go with them (see `add_dependent()`).
+    Where the server has transactions all run in one, so a record
+    deleted by someone else meanwhile is reported NOT_FOUND. With
+    `ordered`, the first failure stops the rest. Returns a status code
+    (OK, NOT_FOUND, DUPLICATE for a key given twice, or SKIPPED) per
+    key.
+    """
+    key_nm = KEY_FIELDS[collect_nm]
+
+    def delete(session):
+        existing = dbc.fetch_keys(collect_nm, key_nm, keys, session=session)
+        statuses, op_items = bulk_plan(
+            keys, ordered, lambda key: None if key in existing else NOT_FOUND)
+        if not op_items:
+            return statuses
+        result, failures = dbc.bulk_write(
+            collect_nm, [dbc.DeleteOne({key_nm: keys[index]})
+                         for index in op_items], ordered, session=session)
+        bulk_statuses(statuses, op_items, failures)
+        written = [index for index in op_items if statuses[index] == OK]
+        deleted = 0 if result is None else result.deleted_count
+        if deleted == 0:
+            for index in written:
+                statuses[index] = NOT_FOUND
+        elif deleted < len(written):
+            print(f"Bulk delete on {collect_nm}: "
+                  f"{len(written) - deleted} records went "
+                  "before we could delete them.")
+        del_dependents(collect_nm, [keys[index] for index in op_items
+                                    if statuses[index] == OK], session)
+        return statuses
+
+    statuses = dbc.run_transaction(delete)
+    if OK in statuses:
+        changed(collect_nm)
+    return statuses
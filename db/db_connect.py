@@ -2,9 +2,22 @@
 This file contains some common MongoDB code.
 """
 import os
-import json
+import math
+import datetime
+import threading
+from collections.abc import Mapping
 import pymongo as pm
+from bson import ObjectId
+from pymongo import monitoring
+from pymongo import (InsertOne, UpdateOne, UpdateMany,  # noqa: F401
+                     ReplaceOne, DeleteOne)
+from pymongo.errors import DuplicateKeyError, BulkWriteError  # noqa: F401
 import bson.json_util as bsutil
+try:
+    import db.instrument as instrument
+except ImportError:
+    # run as a script from within db/
+    import instrument
 
 
 # all of these will eventually be put in the env:
@@ -22,72 +35,629 @@ if os.environ.get("TEST_MODE", ''):
 REMOTE = "0"
 LOCAL = "1"
 
+# storage backends: a real Mongo server, or memory_db.py's in-process
+# stand-in (no network needed; for tests, benchmarks and load tests).
+MONGO = "mongo"
+MEMORY = "memory"
+BACKEND = os.environ.get("MAYS_DB_BACKEND", MONGO)
+
+# the write count of each collection that processes poll for changes:
+VERSIONS = "versions"
+VERSION = "version"
+
+# server error code for a write that breaks a unique index:
+DUPLICATE_KEY = 11000
+
+# connection pool settings, one pool per worker process:
+POOL_SETTINGS = {
+    "maxPoolSize": int(os.environ.get("MONGO_MAX_POOL_SIZE", 10)),
+    "minPoolSize": int(os.environ.get("MONGO_MIN_POOL_SIZE", 0)),
+    "maxIdleTimeMS": int(os.environ.get("MONGO_MAX_IDLE_TIME_MS", 60000)),
+    "waitQueueTimeoutMS": int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS",
+                                             2000)),
+    "connectTimeoutMS": int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS",
+                                           5000)),
+    "serverSelectionTimeoutMS": int(
+        os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)),
+}
+
 client = None
+client_pid = None
+client_lock = threading.Lock()
+# (client, whether its server runs transactions), once we have asked:
+txn_support = (None, False)
+
+# indexes the data layer needs; created once per process on connect:
+indexes = []
+# the indexes whose last build failed, with the error:
+index_failures = {}
+
+# when a process builds the indexes (see `build_indexes_later()`):
+INDEX_BUILD_LATER = "background"
+INDEX_BUILD_NOW = "now"
+INDEX_BUILD_OFF = "off"
+INDEX_BUILD = os.environ.get(
+    "MAYS_INDEX_BUILD",
+    INDEX_BUILD_NOW if os.environ.get("TEST_MODE", '')
+    else INDEX_BUILD_LATER)
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """
+    Counts connection pool events for the client of this process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counts = {
+                "created": 0,
+                "closed": 0,
+                "checked_out": 0,
+                "checkout_failed": 0,
+                "cleared": 0,
+            }
+
+    def bump(self, field, amount=1):
+        with self.lock:
+            self.counts[field] += amount
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self.bump("cleared")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.bump("created")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.bump("closed")
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self.bump("checkout_failed")
+
+    def connection_checked_out(self, event):
+        self.bump("checked_out")
+
+    def connection_checked_in(self, event):
+        self.bump("checked_out", -1)
+
+
+pool_listener = PoolStats()
+
+
+def new_client():
+    """
+    Build a new mongo client using our pool settings.
+    Both backends give a client with the pymongo API, so everything
+    below works unchanged on either.
+    """
+    if BACKEND == MEMORY:
+        import db.memory_db as memory_db
+        print("Using the in-memory database.")
+        return memory_db.MemoryClient()
+    if BACKEND != MONGO:
+        raise ValueError(f"Unknown MAYS_DB_BACKEND: {BACKEND}")
+    args, kwargs = mongo_args()
+    return pm.MongoClient(*args, **kwargs)
+
+
+def mongo_args():
+    """
+    The arguments for a Mongo client: where our server is, and our
+    pool settings.
+    """
+    kwargs = {"event_listeners": [pool_listener], **POOL_SETTINGS}
+    if os.environ.get("LOCAL_MONGO", REMOTE) == LOCAL:
+        print("Connecting to Mongo locally.")
+        return [], kwargs
+    print("Connecting to Mongo remotely.")
+    return [f"{cloud_mdb}://{user_nm}:{passwd}@{cloud_svc}"
+            f"/{db_nm}?{db_params}"], kwargs
 
 
 def get_client():
     """
     This provides a uniform way to get the client across all uses.
-    Returns a mongo client object... maybe we shouldn't?
+    There is one client (and so one connection pool) per process:
+    it is created on first use and re-created after a fork, since
+    pymongo clients are not fork-safe.
+    Creating a client does not wait on the server, and neither do our
+    index builds (see `build_indexes_later()`).
     Also set global client variable.
     """
-    global client
-    if os.environ.get("LOCAL_MONGO", REMOTE) == LOCAL:
-        print("Connecting to Mongo locally.")
-        client = pm.MongoClient()
-    else:
-        print("Connecting to Mongo remotely.")
-        client = pm.MongoClient(f"mongodb+srv://aliahjefree:{passwd}\
-@cluster0.bslxs.mongodb.net/{db_nm}?retryWrites=true&w=majority")
+    global client, client_pid
+    if client is not None and client_pid == os.getpid():
+        return client
+    with client_lock:
+        if client is None or client_pid != os.getpid():
+            # never close a client inherited from our parent process:
+            # its sockets are shared with the parent.
+            pool_listener.reset()
+            client = new_client()
+            client_pid = os.getpid()
+            build_indexes_later(client, list(indexes))
     return client
 
 
-def fetch_one(collect_nm, filters={}):
+def add_index(collect_nm, keys, **kwargs):
+    """
+    Register an index to be built when we connect.
+    `keys` is a field name or a list of (field, direction) pairs;
+    `kwargs` are passed on to `create_index()` (e.g. unique=True).
+    """
+    indexes.append((collect_nm, keys, kwargs))
+    if client is not None and client_pid == os.getpid():
+        build_indexes_later(client, [(collect_nm, keys, kwargs)])
+
+
+def build_indexes_later(mongo_client, wanted):
+    """
+    Build indexes as MAYS_INDEX_BUILD says: in a background thread, so
+    no request waits on N round trips (or on N server selection
+    timeouts when the server is down); at once; or not at all, when
+    `python3 -m db.build_indexes` builds them (the release phase of
+    the Procfile). The in-memory backend builds them at once: it
+    never waits on anything.
+    """
+    if INDEX_BUILD == INDEX_BUILD_OFF or not wanted:
+        return
+    if INDEX_BUILD == INDEX_BUILD_NOW or BACKEND == MEMORY:
+        ensure_indexes(mongo_client, wanted)
+    else:
+        threading.Thread(target=ensure_indexes, args=(mongo_client, wanted),
+                         name="index-build", daemon=True).start()
+
+
+def index_name(collect_nm, keys):
+    return f"{collect_nm}.{keys}"
+
+
+def ensure_indexes(mongo_client=None, wanted=None):
+    """
+    Build the registered indexes. Building an index that already exists
+    is a cheap no-op on the server. A failure (say, existing duplicates
+    under a new unique index) is logged and kept in `index_failures`,
+    but does not stop the app.
+    Returns the failures of this run.
+    """
+    if mongo_client is None:
+        mongo_client = get_client()
+    failures = {}
+    for collect_nm, keys, kwargs in (indexes if wanted is None else wanted):
+        name = index_name(collect_nm, keys)
+        try:
+            mongo_client[db_nm][collect_nm].create_index(keys, **kwargs)
+            index_failures.pop(name, None)
+        except pm.errors.PyMongoError as err:
+            print(f"ERROR: could not build index {keys} on {collect_nm}: "
+                  f"{err}")
+            failures[name] = index_failures[name] = str(err)
+    return failures
+
+
+def transactions_supported():
+    """
+    Can our server run multi-document transactions? A replica set or
+    a sharded cluster can; a standalone server or the in-memory
+    backend cannot. Asked once per client.
+    """
+    global txn_support
+    mongo_client = get_client()
+    if txn_support[0] is not mongo_client:
+        hello = mongo_client.admin.command("hello")
+        txn_support = (mongo_client, "setName" in hello
+                       or hello.get("msg") == "isdbgrid")
+    return txn_support[1]
+
+
+def run_transaction(func):
+    """
+    Run func(session) in a transaction, so that its writes (which must
+    pass the session on) all happen or none do. Where there are no
+    transactions, func(None) runs and each write stands alone.
+    Returns what func returns.
+    """
+    if not transactions_supported():
+        return func(None)
+    with get_client().start_session() as session:
+        return session.with_transaction(func)
+
+
+def close_client():
+    """
+    Close the client of this process, if any.
+    The next call to `get_client()` will create a fresh one.
+    """
+    global client, client_pid
+    with client_lock:
+        if client is not None and client_pid == os.getpid():
+            client.close()
+        client = None
+        client_pid = None
+
+
+def forget_client():
+    """
+    Drop the client inherited across a fork without closing it.
+    Locks are re-created too, in case another thread held them
+    when we forked.
+    An in-memory client holds the data itself, so the child keeps
+    its copy instead.
+    """
+    global client, client_pid, client_lock
+    client_lock = threading.Lock()
+    if BACKEND == MEMORY and client is not None:
+        client.after_fork()
+        client_pid = os.getpid()
+        return
+    client = None
+    client_pid = None
+    pool_listener.lock = threading.Lock()
+    pool_listener.reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=forget_client)
+
+
+def pool_stats():
+    """
+    Return connection pool statistics for this process.
+    """
+    with pool_listener.lock:
+        stats = dict(pool_listener.counts)
+    stats["open"] = stats["created"] - stats["closed"]
+    stats["max_pool_size"] = POOL_SETTINGS["maxPoolSize"]
+    stats["min_pool_size"] = POOL_SETTINGS["minPoolSize"]
+    stats["connected"] = client is not None and client_pid == os.getpid()
+    stats["pid"] = os.getpid()
+    return stats
+
+
+# values of these types are already JSON-safe:
+PLAIN_TYPES = frozenset([str, int, bool, type(None)])
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def to_json(doc):
+    """
+    Convert a BSON document (or any value in one) to JSON-safe Python
+    objects in a single pass. The output is what a round trip through
+    `bson.json_util.dumps()` and `json.loads()` gives (relaxed extended
+    JSON: `{"$oid": ...}`, `{"$date": ...}` and so on), without building
+    and re-parsing a string for every document.
+    """
+    kind = type(doc)
+    if kind is dict:
+        return {key: (val if type(val) in PLAIN_TYPES else to_json(val))
+                for key, val in doc.items()}
+    if kind in PLAIN_TYPES:
+        return doc
+    if kind is float and math.isfinite(doc):
+        return doc
+    if kind is list or kind is tuple:
+        return [val if type(val) in PLAIN_TYPES else to_json(val)
+                for val in doc]
+    # fast paths for our two commonest BSON types:
+    if kind is ObjectId:
+        return {"$oid": str(doc)}
+    if kind is datetime.datetime and doc.tzinfo is None and doc >= EPOCH:
+        millis = doc.microsecond // 1000
+        fracsecs = f".{millis:03d}" if millis else ""
+        return {"$date": f"{doc.isoformat(timespec='seconds')}{fracsecs}Z"}
+    if isinstance(doc, Mapping):
+        return to_json(dict(doc))
+    # ObjectId, datetime, Decimal128, NaN and the like:
+    return to_json(bsutil.default(doc))
+
+
+@instrument.timed
+def ping():
+    """
+    Check that the database answers.
+    Returns True or False
+    """
+    try:
+        get_client().admin.command("ping")
+        return True
+    except pm.errors.PyMongoError as err:
+        print(f"Mongo ping failed: {err}")
+        return False
+
+
+def watch(collect_nms, resume_after=None, max_await_ms=1000):
+    """
+    Open a change stream on the given collections of our database.
+    Raises OperationFailure if the server has no change streams
+    (a standalone mongod, say).
+    """
+    pipeline = [{"$match": {"ns.coll": {"$in": list(collect_nms)}}}]
+    return get_client()[db_nm].watch(pipeline, resume_after=resume_after,
+                                     max_await_time_ms=max_await_ms)
+
+
+@instrument.timed
+def bump_version(collect_nm):
+    """
+    Count a write to a collection, for processes that poll for changes
+    (see `collection_versions()`).
+    """
+    get_client()[db_nm][VERSIONS].update_one(
+        {"_id": collect_nm}, {"$inc": {VERSION: 1}}, upsert=True)
+
+
+@instrument.timed
+def collection_versions(collect_nms):
+    """
+    Return the write count of each of the given collections: one small
+    record each, read by `_id`, whatever the size of the collection.
+    """
+    return {doc["_id"]: doc[VERSION] for doc in
+            get_client()[db_nm][VERSIONS].find(
+                {"_id": {"$in": list(collect_nms)}})}
+
+
+@instrument.timed
+def fetch_one(collect_nm, filters={}, projection=None):
     """
     Fetch one record that meets filters.
+    `projection` limits the fields returned.
     """
-    return client[db_nm][collect_nm].find_one(filters)
+    return get_client()[db_nm][collect_nm].find_one(filters, projection)
 
 
-def update_one(collect_nm, filters={}, updates={}):
+@instrument.timed
+def update_one(collect_nm, filters={}, updates={}, session=None):
     """
     Update one record that meets filters.
+    Raises DuplicateKeyError if the update clashes with a unique index.
+    """
+    return get_client()[db_nm][collect_nm].update_one(filters, updates,
+                                                      session=session)
+
+
+@instrument.timed
+def update_many(collect_nm, filters={}, updates={}):
+    """
+    Update every record that meets filters.
     """
-    return client[db_nm][collect_nm].update_one(filters, updates)
+    return get_client()[db_nm][collect_nm].update_many(filters, updates)
 
 
-def del_one(collect_nm, filters={}):
+@instrument.timed
+def del_one(collect_nm, filters={}, session=None):
     """
     Delete one record that meets filters.
     """
-    return client[db_nm][collect_nm].delete_one(filters)
+    return get_client()[db_nm][collect_nm].delete_one(filters,
+                                                      session=session)
 
 
-def fetch_all(collect_nm, key_nm, filters={}):
-    all_docs = {}
-    for doc in client[db_nm][collect_nm].find(filters):
-        # print(all_docs['netid'])
-        # print(doc)
-        if key_nm not in doc:
-            print(f"doc={doc}")
-            return all_docs
-        all_docs[doc[key_nm]] = json.loads(bsutil.dumps(doc))
-    return all_docs
+@instrument.timed
+def del_many(collect_nm, filters={}, session=None):
+    """
+    Delete every record that meets filters.
+    """
+    return get_client()[db_nm][collect_nm].delete_many(filters,
+                                                       session=session)
+
+
+def projection_for(fields, key_nm=None):
+    """
+    Turn a list of field names into a Mongo projection.
+    The key field is always kept (we key results on it) and `_id` is
+    dropped unless asked for. No fields means the whole record.
+    """
+    if not fields:
+        return None
+    projection = {fld: 1 for fld in fields}
+    if key_nm is not None:
+        projection[key_nm] = 1
+    if "_id" not in projection:
+        projection["_id"] = 0
+    return projection
+
+
+def find_page(collect_nm, key_nm, filters={}, projection=None,
+              limit=None, after=None, batch_size=None):
+    """
+    Open a cursor over the records that meet filters.
+    Passing `limit` and/or `after` selects one page: the records
+    sorted by `key_nm`, starting after the key `after`. Paging is keyset
+    based, so each page is an index range scan costing O(page).
+    """
+    paged = limit is not None or after is not None
+    if paged:
+        if after is None:
+            key_filter = {"$exists": True}
+        else:
+            key_filter = {"$gt": after}
+        filters = {**filters, key_nm: key_filter}
+    cursor = get_client()[db_nm][collect_nm].find(filters, projection)
+    if paged:
+        cursor = cursor.sort(key_nm, pm.ASCENDING)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+        batch_size = min(limit, batch_size or limit)
+    if batch_size:
+        cursor = cursor.batch_size(batch_size)
+    return cursor
 
 
-def all_docs(collect_nm, filters={}):
+def keyed_docs(docs, key_nm):
+    """
+    The records that have a `key_nm`, as JSON. Listings are keyed on
+    it, so both kinds (`fetch_all()` and `stream_all()`) skip records
+    without one.
+    """
+    for doc in docs:
+        if key_nm in doc:
+            yield to_json(doc)
+
+
+@instrument.timed
+def fetch_all(collect_nm, key_nm, filters={}, projection=None,
+              limit=None, after=None):
+    """
+    Fetch all records that meet filters, as a dict keyed on `key_nm`.
+    `limit` and `after` fetch one page: see `find_page()`.
+    """
+    return {doc[key_nm]: doc for doc in keyed_docs(
+        find_page(collect_nm, key_nm, filters, projection, limit, after),
+        key_nm)}
+
+
+@instrument.timed
+def stream_all(collect_nm, key_nm, filters={}, projection=None,
+               limit=None, after=None, batch_size=None):
+    """
+    Yield the records that meet filters one at a time, as the cursor
+    delivers them, so memory use does not grow with the collection.
+    Records without `key_nm` are skipped.
+    `limit` and `after` stream one page: see `find_page()`.
+    """
+    yield from keyed_docs(find_page(collect_nm, key_nm, filters, projection,
+                                    limit, after, batch_size), key_nm)
+
+
+@instrument.timed
+def page_end(collect_nm, key_nm, limit, after=None, filters={}):
+    """
+    The key of the last record of a page, if the page is full: the
+    cursor to the next page. Reads one index entry, so a streamed page
+    can send its cursor before its records.
+    """
+    cursor = find_page(collect_nm, key_nm, filters, {key_nm: 1, "_id": 0},
+                       limit=1, after=after).skip(limit - 1)
+    for doc in cursor:
+        return doc[key_nm]
+    return None
+
+
+@instrument.timed
+def all_docs(collect_nm, filters={}, projection=None, sort=None,
+             limit=None):
+    """
+    Fetch the records that meet filters, as a list.
+    `sort` is a list of (field, direction) pairs.
+    """
     docs = []
-    for doc in client[db_nm][collect_nm].find(filters):
+    cursor = get_client()[db_nm][collect_nm].find(filters, projection)
+    if sort:
+        cursor = cursor.sort(sort)
+    if limit:
+        cursor = cursor.limit(limit)
+    for doc in cursor:
         # print(all_docs['netid'])
         # print(doc)
-        docs.append(json.loads(bsutil.dumps(doc)))
+        docs.append(to_json(doc))
     return docs
 
 
+@instrument.timed
+def fetch_docs(collect_nm, filters={}, projection=None, sort=None,
+               limit=None):
+    """
+    Like `all_docs()`, but the records come back as stored (BSON types
+    and all) rather than converted to JSON.
+    """
+    cursor = get_client()[db_nm][collect_nm].find(filters, projection)
+    if sort:
+        cursor = cursor.sort(sort)
+    if limit:
+        cursor = cursor.limit(limit)
+    return list(cursor)
+
+
+@instrument.timed
 def insert_doc(collect_nm, doc, filters={}):
-    client[db_nm][collect_nm].insert_one(doc, filters)
+    """
+    Insert one record.
+    Raises DuplicateKeyError if it clashes with a unique index.
+    """
+    return get_client()[db_nm][collect_nm].insert_one(doc, filters)
+
+
+@instrument.timed
+def aggregate(collect_nm, pipeline):
+    """
+    Run an aggregation pipeline; returns the resulting docs as JSON.
+    """
+    cursor = get_client()[db_nm][collect_nm].aggregate(pipeline)
+    return [to_json(doc) for doc in cursor]
+
+
+@instrument.timed
+def count(collect_nm, filters={}):
+    """
+    How many records match filters.
+    """
+    return get_client()[db_nm][collect_nm].count_documents(filters)
+
+
+@instrument.timed
+def fetch_keys(collect_nm, key_nm, keys, session=None):
+    """
+    Return the set of the given keys that some record has, using one
+    `$in` query that reads only the key field.
+    """
+    cursor = get_client()[db_nm][collect_nm].find(
+        {key_nm: {"$in": list(keys)}}, {key_nm: 1, "_id": 0},
+        session=session)
+    return {doc[key_nm] for doc in cursor}
+
+
+@instrument.timed
+def bulk_write(collect_nm, ops, ordered=False, session=None):
+    """
+    Run a list of write operations (InsertOne, UpdateOne, DeleteOne...)
+    in one round trip.
+    Returns the result and a dict mapping the index of each op that
+    broke a unique index to DUPLICATE_KEY. An ordered bulk stops at its
+    first failure: the ops after it are not run, and map to None.
+    Any other write error is raised.
+    """
+    try:
+        result = get_client()[db_nm][collect_nm].bulk_write(
+            ops, ordered=ordered, session=session)
+        return result, {}
+    except BulkWriteError as err:
+        return None, bulk_failures(err, len(ops), ordered)
+
+
+def bulk_failures(err, n_ops, ordered):
+    """
+    The failures of a bulk write, as `bulk_write()` returns them.
+    Re-raises err if anything but a unique index clash failed.
+    """
+    failures = {error["index"]: error["code"]
+                for error in err.details["writeErrors"]}
+    if set(failures.values()) != {DUPLICATE_KEY}:
+        raise err
+    if ordered and failures:
+        for index in range(max(failures) + 1, n_ops):
+            failures[index] = None
+    return failures
 
 
+@instrument.timed
 def rename(db_nm: str, collect_nm: str, nm_map: dict):
     """    Renames specified fields on all documents in a collection.
     Parameters
@@ -104,6 +674,6 @@ def rename(db_nm: str, collect_nm: str, nm_map: dict):
         "old_nm2": "new_nm2",
         }
     """
-    collect = client[db_nm][collect_nm]
+    collect = get_client()[db_nm][collect_nm]
     return collect.update_many({},
                                {'$rename': nm_map})
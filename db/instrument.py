@@ -0,0 +1,202 @@
+"""
+This file counts and times our database operations.
+Every db_connect helper is wrapped with `timed()`. Operations are added
+up per request (for the thread or asyncio task serving it: see
+`start_request()`) and per operation name for the whole process.
+"""
+import os
+import time
+import functools
+import threading
+import inspect
+import contextvars
+
+# requests slower than this many ms are logged; 0 turns logging off:
+SLOW_REQUEST_MS = float(os.environ.get("MAYS_SLOW_REQUEST_MS", 500))
+
+# the stats of the request being served; each thread and each asyncio
+# task sees its own:
+request_stats = contextvars.ContextVar("request_stats", default=None)
+lock = threading.Lock()
+# operation name -> {"count", "total_ms", "max_ms"}:
+op_totals = {}
+# route -> {"requests", "queries", "db_ms", "total_ms", "max_ms"}:
+route_totals = {}
+
+
+class RequestStats:
+    """
+    The database work of one request.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_ms = 0.0
+        self.slowest_op = None
+        self.slowest_ms = 0.0
+        self.total_ms = None
+
+    def add(self, op_nm, elapsed_ms):
+        self.queries += 1
+        self.db_ms += elapsed_ms
+        if elapsed_ms >= self.slowest_ms:
+            self.slowest_op = op_nm
+            self.slowest_ms = elapsed_ms
+
+    def elapsed_ms(self):
+        """
+        Time since the request started; once it has ended, its duration.
+        """
+        if self.total_ms is not None:
+            return self.total_ms
+        return (time.perf_counter() - self.start) * 1000
+
+
+def start_request():
+    """
+    Start counting the operations of the request this thread (or task)
+    serves.
+    """
+    stats = RequestStats()
+    request_stats.set(stats)
+    return stats
+
+
+def current():
+    """
+    The stats of the request in progress on this thread (or task),
+    if any.
+    """
+    return request_stats.get()
+
+
+def end_request(route=None):
+    """
+    Stop counting for this thread (or task). Returns the request's
+    stats, and adds them to the totals of `route` if one is given.
+    """
+    stats = current()
+    request_stats.set(None)
+    if stats is None:
+        return None
+    stats.total_ms = total_ms = stats.elapsed_ms()
+    if route is not None:
+        with lock:
+            totals = route_totals.setdefault(
+                route, {"requests": 0, "queries": 0, "db_ms": 0.0,
+                        "total_ms": 0.0, "max_ms": 0.0})
+            totals["requests"] += 1
+            totals["queries"] += stats.queries
+            totals["db_ms"] += stats.db_ms
+            totals["total_ms"] += total_ms
+            totals["max_ms"] = max(totals["max_ms"], total_ms)
+    return stats
+
+
+def record(op_nm, elapsed_ms):
+    stats = current()
+    if stats is not None:
+        stats.add(op_nm, elapsed_ms)
+    with lock:
+        totals = op_totals.setdefault(op_nm, {"count": 0, "total_ms": 0.0,
+                                              "max_ms": 0.0})
+        totals["count"] += 1
+        totals["total_ms"] += elapsed_ms
+        totals["max_ms"] = max(totals["max_ms"], elapsed_ms)
+
+
+def timed(func):
+    """
+    Count and time each call of func as one database operation.
+    For a generator, the operation is the time spent producing items,
+    however long the caller takes between them. A coroutine is timed
+    until it returns.
+    """
+    op_nm = func.__name__
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                record(op_nm, (time.perf_counter() - start) * 1000)
+        return async_wrapper
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def gen_wrapper(*args, **kwargs):
+            elapsed = 0.0
+            items = func(*args, **kwargs)
+            try:
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        return
+                    finally:
+                        elapsed += time.perf_counter() - start
+                    yield item
+            finally:
+                items.close()
+                record(op_nm, elapsed * 1000)
+        return gen_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record(op_nm, (time.perf_counter() - start) * 1000)
+    return wrapper
+
+
+def server_timing(stats):
+    """
+    A Server-Timing header value for a request's stats.
+    """
+    timing = [f"app;dur={stats.elapsed_ms():.2f}",
+              f'db;dur={stats.db_ms:.2f};desc="{stats.queries} queries"']
+    if stats.slowest_op is not None:
+        timing.append(f"db-slowest;dur={stats.slowest_ms:.2f};"
+                      f'desc="{stats.slowest_op}"')
+    return ", ".join(timing)
+
+
+def is_slow(stats):
+    return SLOW_REQUEST_MS > 0 and stats.elapsed_ms() >= SLOW_REQUEST_MS
+
+
+def log_if_slow(request_nm, stats):
+    """
+    Log a request slower than SLOW_REQUEST_MS, with its DB work.
+    """
+    if is_slow(stats):
+        print(f"Slow request: {request_nm} took {stats.total_ms:.0f}ms "
+              f"with {stats.queries} queries ({stats.db_ms:.0f}ms in the "
+              f"db; slowest {stats.slowest_op} at "
+              f"{stats.slowest_ms:.0f}ms)")
+
+
+def op_stats():
+    """
+    Count, total and max time of each operation in this process.
+    """
+    with lock:
+        return {op_nm: dict(totals) for op_nm, totals in op_totals.items()}
+
+
+def route_stats():
+    """
+    Requests, queries and time per route in this process.
+    """
+    with lock:
+        return {route: dict(totals) for route, totals in route_totals.items()}
+
+
+def reset():
+    with lock:
+        op_totals.clear()
+        route_totals.clear()
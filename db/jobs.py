@@ -0,0 +1,142 @@
+"""
+This file holds a small job queue kept in a Mongo collection, so
+queued work survives restarts. The app queues jobs; a worker process
+(see notifier.py) claims them in batches and runs them.
+Jobs are coalesced: there is at most one waiting job per (type, key),
+so a burst of events for one key makes one job.
+A claimed job is leased to its worker; if the worker dies, the job
+becomes claimable again when the lease runs out.
+"""
+import uuid
+import datetime
+
+import db.db_connect as dbc
+import db.data as data
+
+# fields of a job:
+TYPE = "type"
+KEY = "key"
+STATUS = "status"
+RUN_AT = "runAt"
+ATTEMPTS = "attempts"
+OWNER = "owner"
+LEASE_UNTIL = "leaseUntil"
+CREATED_AT = "createdAt"
+DONE_AT = "doneAt"
+ERROR = "error"
+
+# job statuses:
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+MAX_ATTEMPTS = 5
+RETRY_SECS = 30
+# finished jobs are kept this long, then Mongo drops them:
+KEEP_DONE_SECS = 7 * 24 * 3600
+
+dbc.add_index(data.JOBS, [(STATUS, 1), (RUN_AT, 1)])
+dbc.add_index(data.JOBS, [(TYPE, 1), (KEY, 1), (STATUS, 1)])
+dbc.add_index(data.JOBS, DONE_AT, expireAfterSeconds=KEEP_DONE_SECS)
+
+
+def now():
+    return datetime.datetime.utcnow()
+
+
+def enqueue(job_type, keys, delay_secs=0):
+    """
+    Queue a job of job_type for each key that has none waiting,
+    to run after delay_secs. One write, however many keys.
+    """
+    ops = enqueue_ops(job_type, keys, delay_secs)
+    if ops:
+        dbc.bulk_write(data.JOBS, ops)
+
+
+def enqueue_ops(job_type, keys, delay_secs=0):
+    """
+    The bulk writes that `enqueue()` makes.
+    """
+    created = now()
+    run_at = created + datetime.timedelta(seconds=delay_secs)
+    return [dbc.UpdateOne({TYPE: job_type, KEY: key, STATUS: PENDING},
+                          {"$setOnInsert": {CREATED_AT: created,
+                                            RUN_AT: run_at,
+                                            ATTEMPTS: 0}},
+                          upsert=True)
+            for key in dict.fromkeys(keys)]
+
+
+def claimable(job_types, when):
+    """
+    The query for jobs a worker may take: due, or abandoned by a worker
+    whose lease ran out.
+    """
+    return {TYPE: {"$in": list(job_types)},
+            "$or": [{STATUS: PENDING, RUN_AT: {"$lte": when}},
+                    {STATUS: RUNNING, LEASE_UNTIL: {"$lte": when}}]}
+
+
+def claim(job_types, limit, lease_secs):
+    """
+    Take up to limit jobs of the given types, oldest due first,
+    in three round trips. Returns the jobs this worker now holds.
+    """
+    when = now()
+    candidates = dbc.fetch_docs(data.JOBS, claimable(job_types, when),
+                                projection={"_id": 1},
+                                sort=[(RUN_AT, 1)], limit=limit)
+    if not candidates:
+        return []
+    owner = uuid.uuid4().hex
+    # another worker may take some of them first: the filter makes
+    # sure each job goes to one worker only.
+    dbc.update_many(data.JOBS,
+                    {"_id": {"$in": [job["_id"] for job in candidates]},
+                     **claimable(job_types, when)},
+                    {"$set": {STATUS: RUNNING, OWNER: owner,
+                              LEASE_UNTIL: when + datetime.timedelta(
+                                  seconds=lease_secs)},
+                     "$inc": {ATTEMPTS: 1}})
+    return dbc.fetch_docs(data.JOBS, {OWNER: owner, STATUS: RUNNING})
+
+
+def complete(jobs):
+    """
+    Mark jobs done.
+    """
+    if jobs:
+        dbc.update_many(data.JOBS, {"_id": {"$in": [job["_id"]
+                                                    for job in jobs]}},
+                        {"$set": {STATUS: DONE, DONE_AT: now()},
+                         "$unset": {OWNER: "", LEASE_UNTIL: ""}})
+
+
+def fail(jobs, error):
+    """
+    Put failed jobs back in the queue, to retry later and later;
+    after MAX_ATTEMPTS tries a job is marked failed for good.
+    """
+    ops = []
+    for job in jobs:
+        if job[ATTEMPTS] >= MAX_ATTEMPTS:
+            update = {STATUS: FAILED, DONE_AT: now()}
+        else:
+            delay = RETRY_SECS * 2 ** (job[ATTEMPTS] - 1)
+            update = {STATUS: PENDING,
+                      RUN_AT: now() + datetime.timedelta(seconds=delay)}
+        ops.append(dbc.UpdateOne({"_id": job["_id"]},
+                                 {"$set": {**update, ERROR: str(error)},
+                                  "$unset": {OWNER: "", LEASE_UNTIL: ""}}))
+    if ops:
+        dbc.bulk_write(data.JOBS, ops)
+
+
+def counts():
+    """
+    How many jobs there are in each status.
+    """
+    return {status: dbc.count(data.JOBS, {STATUS: status})
+            for status in (PENDING, RUNNING, DONE, FAILED)}
@@ -0,0 +1,1034 @@
+"""
+This file contains an in-process stand-in for MongoDB, so tests,
+benchmarks and local load tests can run without a network or a server.
+Select it with MAYS_DB_BACKEND=memory (see db_connect.py).
+
+It implements the part of the pymongo client / database / collection
+API that our code uses, with the same results and errors
+(DuplicateKeyError, BulkWriteError, pymongo result objects).
+A collection is a dict of documents by `_id`, plus a secondary index
+(key -> set of `_id`s) per `create_index()`. Indexes answer equality and
+`$in` queries without a scan and enforce `unique`.
+Everything runs under one lock per client, so every operation is
+atomic, as if it were a single-document write on a real server.
+Data lives as long as the process (a forked worker gets a copy).
+"""
+import re
+import datetime
+import itertools
+import threading
+from bson import ObjectId
+from pymongo import (InsertOne, UpdateOne, UpdateMany, ReplaceOne,
+                     DeleteOne, DeleteMany)
+from pymongo.errors import (DuplicateKeyError, BulkWriteError,
+                            OperationFailure)
+from pymongo.results import (InsertOneResult, InsertManyResult,
+                             UpdateResult, DeleteResult, BulkWriteResult)
+
+DUPLICATE_KEY = 11000
+NO_CHANGE_STREAMS = 40573
+MISSING = object()
+
+
+def clone(val):
+    """
+    Copy a document, so callers never share our stored data.
+    Everything but dicts and lists is immutable.
+    """
+    if type(val) is dict:
+        return {key: clone(sub) for key, sub in val.items()}
+    if type(val) is list:
+        return [clone(sub) for sub in val]
+    return val
+
+
+def freeze(val):
+    """
+    A hashable stand-in for a value, for index keys.
+    """
+    if isinstance(val, dict):
+        return ("$doc",) + tuple((key, freeze(sub))
+                                 for key, sub in val.items())
+    if isinstance(val, list):
+        return ("$list",) + tuple(freeze(sub) for sub in val)
+    return val
+
+
+def lookup(doc, path):
+    """
+    The values at a dotted path. Arrays of documents along the way
+    are searched element by element, as Mongo does.
+    """
+    vals = [doc]
+    for part in path.split("."):
+        found = []
+        for val in vals:
+            if isinstance(val, dict):
+                if part in val:
+                    found.append(val[part])
+            elif isinstance(val, list):
+                if part.isdigit() and int(part) < len(val):
+                    found.append(val[int(part)])
+                found.extend(elem[part] for elem in val
+                             if isinstance(elem, dict) and part in elem)
+        vals = found
+    return vals
+
+
+def candidates(vals):
+    """
+    What a query compares against: each value, and each element of
+    the values that are arrays.
+    """
+    out = []
+    for val in vals:
+        out.append(val)
+        if isinstance(val, list):
+            out.extend(val)
+    return out
+
+
+def same(val, other):
+    return val == other and isinstance(val, bool) == isinstance(other, bool)
+
+
+def is_number(val):
+    return isinstance(val, (int, float)) and not isinstance(val, bool)
+
+
+def comparable(val, other):
+    if is_number(val) and is_number(other):
+        return True
+    for kind in (str, datetime.datetime, ObjectId, bool):
+        if isinstance(val, kind) and isinstance(other, kind):
+            return True
+    return False
+
+
+# the order Mongo sorts values of different types in:
+TYPE_ORDER = [(type(None), 1), (bool, 8), (int, 2), (float, 2), (str, 3),
+              (dict, 4), (list, 5), (ObjectId, 7), (datetime.datetime, 9)]
+
+
+def sort_key(val):
+    if val is MISSING:
+        return (0, 0)
+    for kind, rank in TYPE_ORDER:
+        if isinstance(val, kind):
+            if kind in (dict, list):
+                return (rank, repr(val))
+            return (rank, val)
+    return (10, repr(val))
+
+
+def is_operator_doc(cond):
+    return isinstance(cond, dict) and len(cond) > 0 \
+        and all(key.startswith("$") for key in cond)
+
+
+def equals(vals, wanted):
+    if not vals:
+        return wanted is None
+    if isinstance(wanted, re.Pattern):
+        return any(isinstance(val, str) and wanted.search(val)
+                   for val in candidates(vals))
+    return any(same(val, wanted) for val in candidates(vals))
+
+
+def compare(vals, wanted, test):
+    return any(comparable(val, wanted) and test(val, wanted)
+               for val in candidates(vals))
+
+
+def match_operators(vals, cond):
+    for oper, arg in cond.items():
+        if oper == "$eq":
+            ok = equals(vals, arg)
+        elif oper == "$ne":
+            ok = not equals(vals, arg)
+        elif oper == "$gt":
+            ok = compare(vals, arg, lambda val, arg: val > arg)
+        elif oper == "$gte":
+            ok = compare(vals, arg, lambda val, arg: val >= arg)
+        elif oper == "$lt":
+            ok = compare(vals, arg, lambda val, arg: val < arg)
+        elif oper == "$lte":
+            ok = compare(vals, arg, lambda val, arg: val <= arg)
+        elif oper == "$in":
+            ok = any(equals(vals, wanted) for wanted in arg)
+        elif oper == "$nin":
+            ok = not any(equals(vals, wanted) for wanted in arg)
+        elif oper == "$exists":
+            ok = bool(vals) == bool(arg)
+        elif oper == "$all":
+            ok = all(equals(vals, wanted) for wanted in arg)
+        elif oper == "$size":
+            ok = any(isinstance(val, list) and len(val) == arg
+                     for val in vals)
+        elif oper == "$elemMatch":
+            ok = any(match_element(elem, arg)
+                     for val in vals if isinstance(val, list)
+                     for elem in val)
+        elif oper == "$not":
+            ok = not match_operators(vals, arg)
+        elif oper == "$regex":
+            pattern = re.compile(arg, regex_flags(cond.get("$options", "")))
+            ok = equals(vals, pattern)
+        elif oper == "$options":
+            ok = True
+        else:
+            raise OperationFailure(f"unknown operator: {oper}", code=2)
+        if not ok:
+            return False
+    return True
+
+
+def regex_flags(options):
+    flags = 0
+    for opt, flag in (("i", re.I), ("m", re.M), ("s", re.S), ("x", re.X)):
+        if opt in options:
+            flags |= flag
+    return flags
+
+
+def match_element(elem, cond):
+    """
+    Does one array element meet an `$elemMatch` condition?
+    """
+    if is_operator_doc(cond):
+        return match_operators([elem], cond)
+    return isinstance(elem, dict) and matches(elem, cond)
+
+
+def matches(doc, filters):
+    """
+    Does doc meet a Mongo query?
+    """
+    for key, cond in filters.items():
+        if key == "$and":
+            ok = all(matches(doc, sub) for sub in cond)
+        elif key == "$or":
+            ok = any(matches(doc, sub) for sub in cond)
+        elif key == "$nor":
+            ok = not any(matches(doc, sub) for sub in cond)
+        elif is_operator_doc(cond):
+            ok = match_operators(lookup(doc, key), cond)
+        else:
+            ok = equals(lookup(doc, key), cond)
+        if not ok:
+            return False
+    return True
+
+
+def sort_docs(docs, sorting):
+    """
+    Sort docs in place on a list of (field, direction) pairs.
+    """
+    for key, direction in reversed(sorting):
+        docs.sort(key=lambda doc: sort_key(
+            min(lookup(doc, key), key=sort_key, default=MISSING)),
+            reverse=direction < 0)
+
+
+def project(doc, projection):
+    """
+    Apply an inclusion or exclusion projection to a (copied) document.
+    """
+    if not projection:
+        return clone(doc)
+    if not isinstance(projection, dict):
+        projection = {fld: 1 for fld in projection}
+    show_id = projection.get("_id", 1)
+    fields = {fld: spec for fld, spec in projection.items() if fld != "_id"}
+    if any(fields.values()):
+        out = {}
+        if show_id and "_id" in doc:
+            out["_id"] = doc["_id"]
+        for fld in fields:
+            copy_path(doc, out, fld.split("."))
+        return out
+    out = clone(doc)
+    if not show_id:
+        out.pop("_id", None)
+    for fld in fields:
+        unset_path(out, fld.split("."))
+    return out
+
+
+def copy_path(src, dest, parts):
+    if not isinstance(src, dict) or parts[0] not in src:
+        return
+    if len(parts) == 1:
+        dest[parts[0]] = clone(src[parts[0]])
+    elif isinstance(src[parts[0]], dict):
+        copy_path(src[parts[0]], dest.setdefault(parts[0], {}), parts[1:])
+
+
+def unset_path(doc, parts):
+    for part in parts[:-1]:
+        if not isinstance(doc, dict) or part not in doc:
+            return False
+        doc = doc[part]
+    if isinstance(doc, dict) and parts[-1] in doc:
+        del doc[parts[-1]]
+        return True
+    return False
+
+
+def set_path(doc, parts, val):
+    for part in parts[:-1]:
+        if isinstance(doc, list) and part.isdigit():
+            doc = doc[int(part)]
+        else:
+            doc = doc.setdefault(part, {})
+    if isinstance(doc, list) and parts[-1].isdigit():
+        doc[int(parts[-1])] = val
+    else:
+        doc[parts[-1]] = val
+
+
+def get_path(doc, parts, default=MISSING):
+    for part in parts:
+        if isinstance(doc, dict) and part in doc:
+            doc = doc[part]
+        elif isinstance(doc, list) and part.isdigit() \
+                and int(part) < len(doc):
+            doc = doc[int(part)]
+        else:
+            return default
+    return doc
+
+
+def expand_paths(doc, path, array_filters):
+    """
+    The concrete paths a `$set`-style path stands for: `$[]` means every
+    element of an array, `$[name]` the elements an arrayFilter picks.
+    """
+    parts = path.split(".")
+    paths = [[]]
+    for part in parts:
+        if part.startswith("$[") and part.endswith("]"):
+            name = part[2:-1]
+            expanded = []
+            for prefix in paths:
+                arr = get_path(doc, prefix)
+                if not isinstance(arr, list):
+                    continue
+                for index, elem in enumerate(arr):
+                    if name and not element_picked(elem, name,
+                                                   array_filters):
+                        continue
+                    expanded.append(prefix + [str(index)])
+            paths = expanded
+        else:
+            paths = [prefix + [part] for prefix in paths]
+    return paths
+
+
+def element_picked(elem, name, array_filters):
+    for array_filter in array_filters or []:
+        conds = {key: cond for key, cond in array_filter.items()
+                 if key == name or key.startswith(name + ".")}
+        if not conds:
+            continue
+        for key, cond in conds.items():
+            sub = elem if key == name else get_path(elem,
+                                                    key.split(".")[1:])
+            vals = [] if sub is MISSING else [sub]
+            if is_operator_doc(cond):
+                if not match_operators(vals, cond):
+                    return False
+            elif not equals(vals, cond):
+                return False
+        return True
+    raise OperationFailure(f"No array filter found for identifier '{name}'",
+                           code=2)
+
+
+def apply_update(doc, update, inserting=False, array_filters=None):
+    """
+    Apply an update document (or a replacement) to doc, in place.
+    """
+    if not any(key.startswith("$") for key in update):
+        doc_id = doc.get("_id")
+        doc.clear()
+        doc.update(clone(update))
+        if doc_id is not None:
+            doc["_id"] = doc_id
+        return
+    for oper, changes in update.items():
+        if oper == "$setOnInsert" and not inserting:
+            continue
+        for path, arg in changes.items():
+            for parts in expand_paths(doc, path, array_filters):
+                apply_operator(doc, oper, parts, arg)
+
+
+def apply_operator(doc, oper, parts, arg):
+    current = get_path(doc, parts)
+    if oper in ("$set", "$setOnInsert"):
+        set_path(doc, parts, clone(arg))
+    elif oper == "$unset":
+        unset_path(doc, parts)
+    elif oper == "$inc":
+        set_path(doc, parts, (0 if current is MISSING else current) + arg)
+    elif oper == "$min":
+        if current is MISSING or sort_key(arg) < sort_key(current):
+            set_path(doc, parts, clone(arg))
+    elif oper == "$max":
+        if current is MISSING or sort_key(arg) > sort_key(current):
+            set_path(doc, parts, clone(arg))
+    elif oper == "$rename":
+        if current is not MISSING:
+            unset_path(doc, parts)
+            set_path(doc, arg.split("."), current)
+    elif oper in ("$push", "$addToSet"):
+        arr = [] if current is MISSING else current
+        if not isinstance(arr, list):
+            raise OperationFailure(f"{oper} needs an array", code=2)
+        new = arg["$each"] if isinstance(arg, dict) and "$each" in arg \
+            else [arg]
+        for val in new:
+            if oper == "$push" or not any(same(val, old) for old in arr):
+                arr.append(clone(val))
+        set_path(doc, parts, arr)
+    elif oper == "$pull":
+        if isinstance(current, list):
+            set_path(doc, parts, [elem for elem in current
+                                  if not pulled(elem, arg)])
+    elif oper == "$currentDate":
+        set_path(doc, parts, datetime.datetime.utcnow())
+    else:
+        raise OperationFailure(f"unknown update operator: {oper}", code=2)
+
+
+def pulled(elem, cond):
+    if is_operator_doc(cond):
+        return match_operators([elem], cond)
+    if isinstance(cond, dict) and isinstance(elem, dict):
+        return matches(elem, cond)
+    return same(elem, cond)
+
+
+def upsert_seed(filters):
+    """
+    The document an upsert starts from: the equality parts of its query.
+    """
+    doc = {}
+    for key, cond in filters.items():
+        if key.startswith("$"):
+            continue
+        if is_operator_doc(cond):
+            if "$eq" in cond:
+                set_path(doc, key.split("."), clone(cond["$eq"]))
+        else:
+            set_path(doc, key.split("."), clone(cond))
+    return doc
+
+
+class Index:
+    """
+    A secondary index: index key -> set of `_id`s.
+    """
+
+    def __init__(self, name, fields, unique=False, sparse=False):
+        self.name = name
+        self.fields = fields
+        self.unique = unique
+        self.sparse = sparse
+        self.entries = {}
+
+    def keys(self, doc):
+        """
+        The index keys of doc: one per array element for arrays.
+        """
+        per_field = []
+        present = False
+        for fld in self.fields:
+            vals = lookup(doc, fld)
+            present = present or bool(vals)
+            vals = candidates(vals) if vals else [None]
+            per_field.append([freeze(val) for val in vals
+                              if not isinstance(val, list)] or [None])
+        if self.sparse and not present:
+            return set()
+        return set(itertools.product(*per_field))
+
+    def add(self, doc):
+        for key in self.keys(doc):
+            self.entries.setdefault(key, set()).add(doc["_id"])
+
+    def remove(self, doc):
+        for key in self.keys(doc):
+            ids = self.entries.get(key)
+            if ids is not None:
+                ids.discard(doc["_id"])
+                if not ids:
+                    del self.entries[key]
+
+    def clash(self, doc):
+        """
+        Return the key doc would duplicate, if this is a unique index.
+        """
+        if not self.unique:
+            return None
+        for key in self.keys(doc):
+            for other in self.entries.get(key, ()):
+                if other != doc["_id"]:
+                    return key
+        return None
+
+    def lookup(self, vals):
+        ids = set()
+        for val in vals:
+            ids |= self.entries.get((freeze(val),), set())
+        return ids
+
+
+class MemoryCursor:
+    """
+    The result of `find()`. Like a pymongo cursor, nothing is read
+    until it is iterated, and sort/skip/limit can be chained first.
+    """
+
+    def __init__(self, collection, filters, projection):
+        self.collection = collection
+        self.filters = filters or {}
+        self.projection = projection
+        self.sorting = []
+        self.skipping = 0
+        self.limiting = 0
+        self.results = None
+
+    def sort(self, key_or_list, direction=1):
+        if isinstance(key_or_list, str):
+            self.sorting = [(key_or_list, direction)]
+        else:
+            self.sorting = list(key_or_list)
+        return self
+
+    def skip(self, count):
+        self.skipping = count
+        return self
+
+    def limit(self, count):
+        self.limiting = count
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def close(self):
+        self.results = iter(())
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.results is None:
+            self.results = iter(self.collection.read(
+                self.filters, self.projection, self.sorting,
+                self.skipping, self.limiting))
+        return next(self.results)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MemoryCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.full_name = f"{database.name}.{name}"
+        self.lock = database.client.lock
+        self.docs = {}
+        self.seqs = {}
+        self.counter = itertools.count()
+        self.indexes = {"_id_": Index("_id_", ["_id"], unique=True)}
+
+    # ---- reads ----
+
+    def candidate_ids(self, filters):
+        """
+        Use an index to narrow down which documents to test, if we can.
+        """
+        for key, cond in filters.items():
+            if is_operator_doc(cond):
+                if "$in" in cond:
+                    wanted = cond["$in"]
+                elif "$eq" in cond:
+                    wanted = [cond["$eq"]]
+                else:
+                    continue
+            elif isinstance(cond, (dict, list, re.Pattern)) \
+                    or key.startswith("$"):
+                continue
+            else:
+                wanted = [cond]
+            if any(val is None or isinstance(val, (dict, list, re.Pattern))
+                   for val in wanted):
+                continue
+            for index in self.indexes.values():
+                if index.fields == [key]:
+                    return index.lookup(wanted)
+        return None
+
+    def matching(self, filters):
+        ids = self.candidate_ids(filters)
+        if ids is None:
+            docs = self.docs.values()
+        else:
+            # keep insertion order, as a scan would:
+            docs = sorted((self.docs[doc_id] for doc_id in ids),
+                          key=lambda doc: self.seqs[doc["_id"]])
+        return [doc for doc in docs if matches(doc, filters)]
+
+    def read(self, filters, projection=None, sorting=(), skip=0, limit=0):
+        with self.lock:
+            docs = self.matching(filters)
+            sort_docs(docs, sorting)
+            if skip:
+                docs = docs[skip:]
+            if limit:
+                docs = docs[:limit]
+            return [project(doc, projection) for doc in docs]
+
+    def find(self, filter=None, projection=None, **kwargs):
+        cursor = MemoryCursor(self, filter, projection)
+        if kwargs.get("sort"):
+            cursor.sort(kwargs["sort"])
+        if kwargs.get("limit"):
+            cursor.limit(kwargs["limit"])
+        return cursor
+
+    def find_one(self, filter=None, projection=None, **kwargs):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        for doc in self.find(filter, projection, **kwargs).limit(1):
+            return doc
+        return None
+
+    def count_documents(self, filter, **kwargs):
+        with self.lock:
+            return len(self.matching(filter))
+
+    def estimated_document_count(self, **kwargs):
+        return len(self.docs)
+
+    def distinct(self, key, filter=None, **kwargs):
+        out = []
+        for doc in self.read(filter or {}):
+            for val in candidates(lookup(doc, key)):
+                if not isinstance(val, list) \
+                        and not any(same(val, old) for old in out):
+                    out.append(val)
+        return out
+
+    def aggregate(self, pipeline, session=None, **kwargs):
+        """
+        Run an aggregation pipeline of $match, $project, $sort, $skip,
+        $limit and $lookup (on localField / foreignField, with an
+        optional sub-pipeline) stages.
+        """
+        with self.lock:
+            stages = list(pipeline)
+            if stages and "$match" in stages[0]:
+                # let the indexes find the first stage's documents:
+                docs = self.read(stages.pop(0)["$match"])
+            else:
+                docs = self.read({})
+            return iter(self.run_stages(docs, stages))
+
+    def run_stages(self, docs, stages):
+        for stage in stages:
+            (oper, spec), = stage.items()
+            if oper == "$match":
+                docs = [doc for doc in docs if matches(doc, spec)]
+            elif oper == "$project":
+                docs = [project(doc, spec) for doc in docs]
+            elif oper == "$sort":
+                sort_docs(docs, list(spec.items()))
+            elif oper == "$skip":
+                docs = docs[spec:]
+            elif oper == "$limit":
+                docs = docs[:spec]
+            elif oper == "$lookup":
+                for doc in docs:
+                    doc[spec["as"]] = self.joined(doc, spec)
+            else:
+                raise OperationFailure(f"Unrecognized pipeline stage "
+                                       f"name: '{oper}'", code=40324)
+        return docs
+
+    def joined(self, doc, spec):
+        """
+        The documents of another collection that a $lookup stage joins
+        to doc.
+        """
+        values = []
+        for val in lookup(doc, spec["localField"]):
+            values.extend(val if isinstance(val, list) else [val])
+        foreign = self.database[spec["from"]]
+        found = foreign.read({spec["foreignField"]: {"$in": values or [None]}})
+        return foreign.run_stages(found, spec.get("pipeline", []))
+
+    # ---- indexes ----
+
+    def create_index(self, keys, unique=False, sparse=False, name=None,
+                     **kwargs):
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        fields = [fld for fld, direction in keys]
+        name = name or "_".join(f"{fld}_{direction}"
+                                for fld, direction in keys)
+        with self.lock:
+            if name in self.indexes:
+                return name
+            index = Index(name, fields, unique, sparse)
+            for doc in self.docs.values():
+                if index.clash(doc) is not None:
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error building {name}",
+                        DUPLICATE_KEY)
+                index.add(doc)
+            self.indexes[name] = index
+        return name
+
+    def index_information(self):
+        return {name: {"key": [(fld, 1) for fld in index.fields],
+                       "unique": index.unique}
+                for name, index in self.indexes.items()}
+
+    # ---- writes ----
+
+    def check_unique(self, doc):
+        for index in self.indexes.values():
+            key = index.clash(doc)
+            if key is not None:
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: "
+                    f"{self.full_name} index: {index.name} dup key: {key}",
+                    DUPLICATE_KEY,
+                    {"keyPattern": {fld: 1 for fld in index.fields}})
+
+    def store(self, doc, old=None):
+        """
+        Put a new version of a document in place, keeping indexes right.
+        Raises DuplicateKeyError (and changes nothing) on a clash.
+        """
+        if old is not None:
+            for index in self.indexes.values():
+                index.remove(old)
+        try:
+            self.check_unique(doc)
+        except DuplicateKeyError:
+            if old is not None:
+                for index in self.indexes.values():
+                    index.add(old)
+            raise
+        for index in self.indexes.values():
+            index.add(doc)
+        if doc["_id"] not in self.docs:
+            self.seqs[doc["_id"]] = next(self.counter)
+        self.docs[doc["_id"]] = doc
+
+    def insert(self, doc):
+        if "_id" not in doc:
+            doc["_id"] = ObjectId()
+        self.store(clone(doc))
+        return doc["_id"]
+
+    def insert_one(self, document, bypass_document_validation=False,
+                   session=None, **kwargs):
+        with self.lock:
+            return InsertOneResult(self.insert(document), True)
+
+    def insert_many(self, documents, ordered=True, **kwargs):
+        result = self.bulk_write([InsertOne(doc) for doc in documents],
+                                 ordered=ordered)
+        return InsertManyResult([doc["_id"] for doc in documents
+                                 if "_id" in doc][:result.inserted_count],
+                                True)
+
+    def update(self, filters, update, upsert=False, multi=False,
+               array_filters=None):
+        """
+        Returns (matched, modified, upserted _id).
+        """
+        docs = self.matching(filters)
+        if not multi:
+            docs = docs[:1]
+        modified = 0
+        for old in docs:
+            new = clone(old)
+            apply_update(new, update, array_filters=array_filters)
+            if new != old:
+                self.store(new, old)
+                modified += 1
+        if docs or not upsert:
+            return len(docs), modified, None
+        new = upsert_seed(filters)
+        apply_update(new, update, inserting=True,
+                     array_filters=array_filters)
+        return 0, 0, self.insert(new)
+
+    def update_result(self, matched, modified, upserted):
+        raw = {"n": matched + (1 if upserted is not None else 0),
+               "nModified": modified}
+        if upserted is not None:
+            raw["upserted"] = upserted
+        return UpdateResult(raw, True)
+
+    def update_one(self, filter, update, upsert=False, array_filters=None,
+                   session=None, **kwargs):
+        with self.lock:
+            return self.update_result(*self.update(
+                filter, update, upsert, False, array_filters))
+
+    def update_many(self, filter, update, upsert=False, array_filters=None,
+                    session=None, **kwargs):
+        with self.lock:
+            return self.update_result(*self.update(
+                filter, update, upsert, True, array_filters))
+
+    def replace_one(self, filter, replacement, upsert=False, session=None,
+                    **kwargs):
+        return self.update_one(filter, replacement, upsert)
+
+    def delete(self, filters, multi=False):
+        docs = self.matching(filters)
+        if not multi:
+            docs = docs[:1]
+        for doc in docs:
+            for index in self.indexes.values():
+                index.remove(doc)
+            del self.docs[doc["_id"]]
+            del self.seqs[doc["_id"]]
+        return len(docs)
+
+    def delete_one(self, filter, session=None, **kwargs):
+        with self.lock:
+            return DeleteResult({"n": self.delete(filter)}, True)
+
+    def delete_many(self, filter, session=None, **kwargs):
+        with self.lock:
+            return DeleteResult({"n": self.delete(filter, True)}, True)
+
+    def bulk_write(self, requests, ordered=True, session=None, **kwargs):
+        """
+        Run InsertOne / UpdateOne / UpdateMany / ReplaceOne / DeleteOne /
+        DeleteMany requests, reporting failures as pymongo does.
+        """
+        totals = {"writeErrors": [], "writeConcernErrors": [],
+                  "nInserted": 0, "nUpserted": 0, "nMatched": 0,
+                  "nModified": 0, "nRemoved": 0, "upserted": []}
+        with self.lock:
+            for index, request in enumerate(requests):
+                try:
+                    self.apply_request(request, index, totals)
+                except DuplicateKeyError as err:
+                    totals["writeErrors"].append(
+                        {"index": index, "code": DUPLICATE_KEY,
+                         "errmsg": str(err), "op": request})
+                    if ordered:
+                        break
+        if totals["writeErrors"]:
+            raise BulkWriteError(totals)
+        return BulkWriteResult(totals, True)
+
+    def apply_request(self, request, index, totals):
+        # pymongo's request classes keep their arguments in these fields.
+        if isinstance(request, InsertOne):
+            self.insert(request._doc)
+            totals["nInserted"] += 1
+        elif isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+            matched, modified, upserted = self.update(
+                request._filter, request._doc, request._upsert,
+                isinstance(request, UpdateMany),
+                getattr(request, "_array_filters", None))
+            totals["nMatched"] += matched
+            totals["nModified"] += modified
+            if upserted is not None:
+                totals["nUpserted"] += 1
+                totals["upserted"].append({"index": index, "_id": upserted})
+        elif isinstance(request, (DeleteOne, DeleteMany)):
+            totals["nRemoved"] += self.delete(request._filter,
+                                              isinstance(request, DeleteMany))
+        else:
+            raise TypeError(f"{request!r} is not a write request")
+
+    def drop(self):
+        with self.lock:
+            self.docs = {}
+            self.seqs = {}
+            for index in self.indexes.values():
+                index.entries = {}
+
+    def watch(self, *args, **kwargs):
+        raise OperationFailure("The $changeStream stage is only supported "
+                               "on replica sets", NO_CHANGE_STREAMS)
+
+
+class MemoryDatabase:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.collections = {}
+
+    def __getitem__(self, name):
+        with self.client.lock:
+            if name not in self.collections:
+                self.collections[name] = MemoryCollection(self, name)
+            return self.collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def list_collection_names(self):
+        return list(self.collections)
+
+    def command(self, command, **kwargs):
+        name = command if isinstance(command, str) else next(iter(command))
+        if name == "ping":
+            return {"ok": 1.0}
+        if name == "hello":
+            # a standalone server: no transactions.
+            return {"isWritablePrimary": True, "ok": 1.0}
+        raise OperationFailure(f"no such command: '{name}'", code=59)
+
+    def watch(self, *args, **kwargs):
+        raise OperationFailure("The $changeStream stage is only supported "
+                               "on replica sets", NO_CHANGE_STREAMS)
+
+
+class MemoryClient:
+    """
+    Stands in for `pymongo.MongoClient`.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.databases = {}
+
+    def __getitem__(self, name):
+        with self.lock:
+            if name not in self.databases:
+                self.databases[name] = MemoryDatabase(self, name)
+            return self.databases[name]
+
+    @property
+    def admin(self):
+        return self["admin"]
+
+    def after_fork(self):
+        """
+        Another thread may have held our lock when we forked.
+        """
+        self.lock = threading.RLock()
+        for database in self.databases.values():
+            for collection in database.collections.values():
+                collection.lock = self.lock
+
+    def close(self):
+        pass
+
+
+class AsyncMemoryCursor:
+    """
+    Stands in for pymongo's async cursors, over a MemoryCursor or a
+    list of results.
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self.cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, limit):
+        self.cursor.limit(limit)
+        return self
+
+    def __aiter__(self):
+        self.results = iter(self.cursor)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.results)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length=None):
+        docs = list(self.cursor)
+        return docs if length is None else docs[:length]
+
+    async def close(self):
+        pass
+
+
+class AsyncMemoryCollection:
+    """
+    Stands in for `pymongo.asynchronous.collection.AsyncCollection`.
+    Our operations never wait on I/O, so each simply runs the
+    MemoryCollection one.
+    """
+    ASYNC_METHODS = {"find_one", "count_documents", "distinct",
+                     "insert_one", "insert_many", "update_one",
+                     "update_many", "replace_one", "delete_one",
+                     "delete_many", "bulk_write", "create_index"}
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        if name not in self.ASYNC_METHODS:
+            raise AttributeError(name)
+        method = getattr(self.collection, name)
+
+        async def run(*args, **kwargs):
+            return method(*args, **kwargs)
+        return run
+
+    def find(self, *args, **kwargs):
+        return AsyncMemoryCursor(self.collection.find(*args, **kwargs))
+
+    async def aggregate(self, pipeline, **kwargs):
+        return AsyncMemoryCursor(list(self.collection.aggregate(pipeline)))
+
+
+class AsyncMemoryDatabase:
+    def __init__(self, database):
+        self.database = database
+
+    def __getitem__(self, name):
+        return AsyncMemoryCollection(self.database[name])
+
+    async def command(self, command, **kwargs):
+        return self.database.command(command, **kwargs)
+
+
+class AsyncMemoryClient:
+    """
+    Stands in for `pymongo.AsyncMongoClient`, over the data of a
+    MemoryClient: the sync and async clients of a process share it.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getitem__(self, name):
+        return AsyncMemoryDatabase(self.client[name])
+
+    @property
+    def admin(self):
+        return self["admin"]
+
+    async def close(self):
+        pass
@@ -10,23 +10,119 @@ It assumes the JSON files have the structure:
         "some_fldN": { some more fields },
     }
 It assumes that cause that's what we've been using!
+Each entry becomes one document, with its key stored under `key_name`.
+
+The file is parsed incrementally, so memory use does not depend on its
+size. Documents are upserted on `key_name` in batches (optionally by
+several workers at once), so re-running an import never duplicates a
+document. Progress is checkpointed: an interrupted import picks up from
+the last batch written.
 """
-import sys
+import os
 import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from pymongo import ReplaceOne
+import bson.json_util as bsutil
+
+try:
+    import db.db_connect as dbc
+except ImportError:
+    # run as a script from within db/
+    import db_connect as dbc
+
+DEF_BATCH_SIZE = 1000
+DEF_WORKERS = 1
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = " \t\n\r"
+
+
+class JSONStreamError(ValueError):
+    pass
 
-import db_connect as dbc
 
+class CheckpointError(ValueError):
+    pass
 
-def read_collection(json_version):
+
+class EntityReader:
     """
-    A function to read a colleciton off of disk.
+    Reads the entries of a top-level JSON object one at a time,
+    holding only a chunk of the file (and the current entry) in memory.
     """
-    try:
-        with open(json_version) as file:
-            return json.loads(file.read())
-    except FileNotFoundError:
-        print(json_version, " not found.")
-        return None
+
+    def __init__(self, file, chunk_size=CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        # extended JSON ({"$date": ...} and the like, as mongo_view.py
+        # writes it) comes back as the BSON types it stood for:
+        self.decoder = json.JSONDecoder(object_hook=bsutil.object_hook)
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def read_more(self):
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+
+    def next_char(self):
+        """
+        Skip whitespace and return the next character ('' at the end).
+        """
+        while True:
+            buf = self.buf
+            while self.pos < len(buf) and buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos:self.pos + 1]
+            self.read_more()
+
+    def expect(self, chars):
+        char = self.next_char()
+        if char == "" or char not in chars:
+            raise JSONStreamError(f"Expected one of {chars!r}, got {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """
+        Decode the next JSON value, reading more of the file until it is
+        complete. A value that runs to the very end of what we have read
+        (a number, say) might go on, so we read more to be sure.
+        """
+        self.next_char()
+        while True:
+            try:
+                val, end = self.decoder.raw_decode(self.buf, self.pos)
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return val
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.read_more()
+
+    def __iter__(self):
+        """
+        Yield (key, value) for each entry of the object.
+        """
+        self.expect("{")
+        if self.next_char() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise JSONStreamError(f"Expected a key, got {key!r}")
+            self.expect(":")
+            yield key, self.value()
+            if self.expect(",}") == "}":
+                return
 
 
 def new_ent_from_json(key_name, ent_name, ent_data):
@@ -34,35 +130,154 @@ def new_ent_from_json(key_name, ent_name, ent_data):
     return {**dict1, **ent_data}
 
 
-client = dbc.get_client()
-print(client)
+def batches(entities, batch_size, skip=0):
+    """
+    Group entities into lists of batch_size, skipping the first `skip`.
+    """
+    batch = []
+    for index, entity in enumerate(entities):
+        if index < skip:
+            continue
+        batch.append(entity)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write_batch(collection, key_name, batch):
+    """
+    Upsert a batch in one round trip. Upserting on the key makes
+    re-writing a batch harmless, which is what makes resuming safe.
+    """
+    docs = [new_ent_from_json(key_name, ent_name, ent_data)
+            for ent_name, ent_data in batch]
+    # (a key that is not a string is kept in its entry, with its type:
+    # see mongo_view.py)
+    ops = [ReplaceOne({key_name: doc[key_name]}, doc, upsert=True)
+           for doc in docs]
+    collection.bulk_write(ops, ordered=False)
+    return len(batch)
 
-if len(sys.argv) < 4:
-    # the key in the JSON file will become an ordinary field
-    # in the Mongo DB, but we need to give it a name!
-    print(f"Usage: {sys.argv[0]} db_name collection_name key_name")
-    exit(1)
 
-db = client[sys.argv[1]]
-print(db)
+def read_checkpoint(checkpoint, json_file):
+    """
+    How many entities a previous run of this import wrote.
+    Raises CheckpointError if the checkpoint is for another file:
+    skipping that many entities of this one would lose them.
+    """
+    try:
+        with open(checkpoint) as file:
+            saved = json.load(file)
+    except FileNotFoundError:
+        return 0
+    if os.path.abspath(saved["file"]) != os.path.abspath(json_file):
+        raise CheckpointError(f"{checkpoint} is for {saved['file']}, "
+                              f"not {json_file}.")
+    return saved["done"]
 
-collect_nm = sys.argv[2]
-print("collect_nm")
-collection = db[collect_nm]
 
-json_file = collect_nm + ".json"
-print("json_file")
+def write_checkpoint(checkpoint, json_file, done):
+    tmp = checkpoint + ".tmp"
+    with open(tmp, "w") as file:
+        json.dump({"file": os.path.abspath(json_file), "done": done}, file)
+    os.replace(tmp, checkpoint)
+
+
+class Progress:
+    """
+    Tracks finished batches. Batches may finish out of order when
+    several workers run, so the checkpoint only moves past batches
+    that have finished along with all those before them.
+    """
+
+    def __init__(self, json_file, checkpoint, done):
+        self.json_file = json_file
+        self.checkpoint = checkpoint
+        self.done = done
+        self.written = 0
+        self.finished = {}
+        self.next_batch = 0
+        self.start = time.monotonic()
 
-key_name = sys.argv[3]
-print("key_name")
+    def batch_done(self, batch_no, count):
+        self.finished[batch_no] = count
+        self.written += count
+        while self.next_batch in self.finished:
+            self.done += self.finished.pop(self.next_batch)
+            self.next_batch += 1
+        write_checkpoint(self.checkpoint, self.json_file, self.done)
+        elapsed = time.monotonic() - self.start
+        rate = self.written / elapsed if elapsed > 0 else 0
+        print(f"{self.done} entities done ({rate:.0f}/s)")
 
-collect = read_collection(json_file)
 
-for entity_nm in collect:
-    new_entity = new_ent_from_json(key_name,
-                                   entity_nm,
-                                   collect[entity_nm])
-    print("new_entity")
-    collection.insert_one(new_entity)
+def port(collection, json_file, key_name, batch_size=DEF_BATCH_SIZE,
+         workers=DEF_WORKERS, checkpoint=None):
+    """
+    Import json_file into collection. Returns how many entities were
+    written by this run.
+    """
+    if checkpoint is None:
+        checkpoint = json_file + ".checkpoint"
+    done = read_checkpoint(checkpoint, json_file)
+    if done:
+        print(f"Resuming after {done} entities.")
+    progress = Progress(json_file, checkpoint, done)
+    with open(json_file) as file, ThreadPoolExecutor(workers) as pool:
+        pending = {}
+        for batch_no, batch in enumerate(batches(EntityReader(file),
+                                                 batch_size, skip=done)):
+            # keep a bounded number of batches in memory:
+            while len(pending) >= 2 * workers:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                # in order, so a failed batch does not keep the
+                # checkpoint from passing earlier ones:
+                for future in sorted(finished, key=pending.get):
+                    progress.batch_done(pending.pop(future), future.result())
+            future = pool.submit(write_batch, collection, key_name, batch)
+            pending[future] = batch_no
+        for future in list(pending):
+            progress.batch_done(pending.pop(future), future.result())
+    # a finished import leaves nothing to resume:
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return progress.written
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Import a keyed JSON file into a Mongo collection.")
+    # the key in the JSON file will become an ordinary field
+    # in the Mongo DB, but we need to give it a name!
+    parser.add_argument("db_name")
+    parser.add_argument("collection_name")
+    parser.add_argument("key_name")
+    parser.add_argument("--file", help="defaults to <collection_name>.json")
+    parser.add_argument("--batch-size", type=int, default=DEF_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=DEF_WORKERS,
+                        help="batches written at once")
+    parser.add_argument("--checkpoint",
+                        help="defaults to <file>.checkpoint")
+    args = parser.parse_args()
+
+    json_file = args.file or args.collection_name + ".json"
+    collection = dbc.get_client()[args.db_name][args.collection_name]
+    start = time.monotonic()
+    try:
+        written = port(collection, json_file, args.key_name,
+                       args.batch_size, args.workers, args.checkpoint)
+    except FileNotFoundError:
+        print(json_file, " not found.")
+        exit(1)
+    except CheckpointError as err:
+        print(f"{err} Remove it, or pass --checkpoint, to start afresh.")
+        exit(1)
+    elapsed = time.monotonic() - start
+    print(f"Wrote {written} entities to {collection.full_name} "
+          f"in {elapsed:.1f}s.")
+
 
-print(collection)
+if __name__ == "__main__":
+    main()
@@ -5,4 +5,4 @@ export db="maysDB"
 export collect="users"
 export key="userName"
 
-python3 mongo_port.py $db $collect $key $passwd
+python3 mongo_port.py $db $collect $key
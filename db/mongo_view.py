@@ -1,15 +1,142 @@
-import db_connect as dbc
+"""
+This program exports a Mongo collection, streaming it from the cursor
+so memory use stays constant however big the collection is.
+It writes either NDJSON (one document per line) or the keyed JSON
+layout that mongo_port.py imports:
+    {
+        "key1": { the other fields },
+        "key2": { the other fields },
+    }
+Usage examples:
+    python3 mongo_view.py users
+    python3 mongo_view.py users --format keyed --key netid \\
+        --gzip --output users.json.gz
+    python3 mongo_view.py users --filter '{"lastName": "Jain"}' \\
+        --fields netid,firstName
+"""
+import io
 import sys
+import gzip
+import json
+import time
+import argparse
+import bson.json_util as bsutil
 
+try:
+    import db.db_connect as dbc
+except ImportError:
+    # run as a script from within db/
+    import db_connect as dbc
 
-client = dbc.get_client()
+NDJSON = "ndjson"
+KEYED = "keyed"
+DEF_BATCH_SIZE = 1000
+
+
+def ndjson_lines(docs):
+    for doc in docs:
+        yield json.dumps(doc) + "\n"
+
+
+def keyed_lines(docs, key_name):
+    """
+    The keyed layout: each document under its key, without the key
+    field itself or the `_id` (mongo_port.py puts the key back).
+    JSON keys are strings, so a key of another type (a number, an
+    ObjectId) stays in its document too, and mongo_port.py imports it
+    with its type.
+    """
+    yield "{\n"
+    sep = ""
+    for doc in docs:
+        if key_name not in doc:
+            print(f"Skipping a document without {key_name}: {doc}",
+                  file=sys.stderr)
+            continue
+        doc.pop("_id", None)
+        if isinstance(doc[key_name], str):
+            key = doc.pop(key_name)
+        else:
+            key = json.dumps(doc[key_name])
+        yield f"{sep}  {json.dumps(key)}: {json.dumps(doc)}"
+        sep = ",\n"
+    yield "\n}\n"
+
+
+def open_output(path, compress):
+    """
+    Open the output as text: a file, or stdout if no path is given.
+    """
+    if path is None:
+        if compress:
+            return io.TextIOWrapper(gzip.GzipFile(fileobj=sys.stdout.buffer,
+                                                  mode="wb"),
+                                    encoding="utf-8")
+        return sys.stdout
+    if compress:
+        return gzip.open(path, "wt", encoding="utf-8")
+    return open(path, "w", encoding="utf-8")
+
+
+def export(collection, out, filters={}, fields=None, out_format=NDJSON,
+           key_name=None, batch_size=DEF_BATCH_SIZE):
+    """
+    Stream the documents of collection that meet filters to out.
+    Returns how many documents were read.
+    """
+    count = 0
+
+    def docs():
+        nonlocal count
+        cursor = collection.find(filters, dbc.projection_for(fields, key_name))
+        for doc in cursor.batch_size(batch_size):
+            count += 1
+            yield dbc.to_json(doc)
+
+    if out_format == KEYED:
+        lines = keyed_lines(docs(), key_name)
+    else:
+        lines = ndjson_lines(docs())
+    for line in lines:
+        out.write(line)
+    return count
 
 
 def main():
-    ret = dbc.all_docs(sys.argv[1])
-    for doc in ret:
-        print(doc)
+    parser = argparse.ArgumentParser(
+        description="Export a Mongo collection as NDJSON or keyed JSON.")
+    parser.add_argument("collection_name")
+    parser.add_argument("--db", default=dbc.db_nm,
+                        help=f"defaults to {dbc.db_nm}")
+    parser.add_argument("--filter", default="{}",
+                        help="a query, in (extended) JSON")
+    parser.add_argument("--fields", help="comma-separated fields to export")
+    parser.add_argument("--format", choices=[NDJSON, KEYED], default=NDJSON)
+    parser.add_argument("--key", help="the key field, for --format keyed")
+    parser.add_argument("--batch-size", type=int, default=DEF_BATCH_SIZE)
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--output", help="defaults to stdout")
+    args = parser.parse_args()
+    if args.format == KEYED and not args.key:
+        parser.error("--format keyed needs --key")
+
+    collection = dbc.get_client()[args.db][args.collection_name]
+    filters = bsutil.loads(args.filter)
+    fields = args.fields.split(",") if args.fields else None
+    start = time.monotonic()
+    out = open_output(args.output, args.gzip)
+    try:
+        count = export(collection, out, filters, fields, args.format,
+                       args.key, args.batch_size)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        else:
+            out.flush()
+    elapsed = time.monotonic() - start
+    print(f"Exported {count} documents from {collection.full_name} "
+          f"in {elapsed:.1f}s.", file=sys.stderr)
 
 
 if __name__ == "__main__":
-    main()  # noqa:W292
\ No newline at end of file
+    main()  # noqa:W292
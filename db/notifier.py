@@ -0,0 +1,167 @@
+"""
+This file is the worker that tells users about the badges they earn.
+Check-ins only queue a job when a badge is earned (see progress.py);
+this worker, run as its own process with
+    python3 -m db.notifier
+claims those jobs in batches, gathers each user's unannounced badges
+into one notification, and hands the batch to a sender.
+The sender is picked with MAYS_NOTIFY_SENDER: "log" (the default)
+prints notifications, "file:<path>" appends them to a file as JSON
+lines. Others can be added with `register_sender()`.
+A notification may be sent twice if the worker dies between sending
+it and recording it, but none is lost.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import datetime
+
+import db.db_connect as dbc
+import db.data as data
+import db.jobs as jobs
+import db.progress as progress
+
+SENDER_ENV = "MAYS_NOTIFY_SENDER"
+BATCH_SIZE = 100
+POLL_SECS = 5
+LEASE_SECS = 300
+# look for earned badges with no job every this many polls:
+SWEEP_EVERY = 60
+
+# fields of a notification:
+BADGES = "badges"
+
+
+class LogSender:
+    """
+    Prints notifications: a stand-in for a mail or push service.
+    """
+    def send(self, notifications):
+        for note in notifications:
+            print(f"notify {note[data.NETID]}: earned "
+                  + ", ".join(note[BADGES]))
+
+
+class FileSender:
+    """
+    Appends notifications to a file, one JSON object per line.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, notifications):
+        with open(self.path, "a") as out:
+            for note in notifications:
+                out.write(json.dumps(note) + "\n")
+
+
+senders = {"log": lambda arg: LogSender(),
+           "file": FileSender}
+
+
+def register_sender(name, factory):
+    """
+    Make a sender available as MAYS_NOTIFY_SENDER=name[:arg]:
+    factory(arg) must return an object with a `send(notifications)`
+    method, which raises if the batch was not sent.
+    """
+    senders[name] = factory
+
+
+def get_sender(spec=None):
+    spec = spec or os.environ.get(SENDER_ENV, "log")
+    name, _, arg = spec.partition(":")
+    if name not in senders:
+        raise ValueError(f"Unknown notification sender: {name}")
+    return senders[name](arg)
+
+
+def notifications(badges):
+    """
+    One notification per user, from their unannounced badges
+    ({netid: [badge, ...]}), with the user's name: one query in all.
+    """
+    users = dbc.fetch_all(data.USERS, data.NETID,
+                          filters={data.NETID: {"$in": list(badges)}},
+                          projection={"_id": 0, data.NETID: 1,
+                                      data.FIRST_NM: 1, data.LAST_NM: 1})
+    return [{data.NETID: netid,
+             data.FIRST_NM: users.get(netid, {}).get(data.FIRST_NM),
+             data.LAST_NM: users.get(netid, {}).get(data.LAST_NM),
+             BADGES: names,
+             "sentAt": datetime.datetime.utcnow().isoformat()}
+            for netid, names in badges.items()]
+
+
+def run_batch(sender, batch_size=BATCH_SIZE, lease_secs=LEASE_SECS):
+    """
+    Claim up to batch_size notification jobs and send them as one
+    batch. Returns how many jobs were claimed.
+    """
+    claimed = jobs.claim([progress.EARNED_JOB], batch_size, lease_secs)
+    if not claimed:
+        return 0
+    try:
+        badges = progress.unnotified([job[jobs.KEY] for job in claimed])
+        if badges:
+            sender.send(notifications(badges))
+            progress.mark_notified(badges)
+    except Exception as err:
+        print(f"Notification batch failed: {err}")
+        jobs.fail(claimed, err)
+    else:
+        jobs.complete(claimed)
+    return len(claimed)
+
+
+def sweep():
+    """
+    Queue jobs for earned badges that were never announced and have
+    no job (if queueing one failed, say).
+    """
+    return progress.queue_notifications()
+
+
+def run(sender, batch_size=BATCH_SIZE, poll_secs=POLL_SECS, once=False):
+    """
+    Send notifications until stopped (SIGTERM or SIGINT), sleeping
+    poll_secs whenever the queue is empty. With once, stop instead.
+    """
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *args: stopping.append(True))
+    polls = 0
+    sweep()
+    while not stopping:
+        if run_batch(sender, batch_size) == batch_size:
+            continue
+        if once:
+            break
+        polls += 1
+        if polls % SWEEP_EVERY == 0:
+            sweep()
+        try:
+            time.sleep(poll_secs)
+        except KeyboardInterrupt:
+            break
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Send badge-earned notifications.")
+    parser.add_argument("--sender", help=f"sender to use (default: "
+                        f"${SENDER_ENV}, else log)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--poll-secs", type=float, default=POLL_SECS)
+    parser.add_argument("--once", action="store_true",
+                        help="send what is due, then exit")
+    args = parser.parse_args(argv)
+    run(get_sender(args.sender), args.batch_size, args.poll_secs,
+        args.once)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
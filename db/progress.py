@@ -0,0 +1,364 @@
+"""
+This file keeps each user's progress towards each badge.
+There is one progress record per (user, badge), holding the trainings
+and workshops still to do and how many that is, so a user's badge
+dashboard is a single indexed read. Records are made and updated
+as attendance comes in (`record_completion()`), and can be recomputed
+from scratch (`rebuild()`).
+When a badge is earned, a job is queued (see jobs.py) for the
+notifier worker to tell the user, off the request path.
+"""
+import os
+import datetime
+
+import db.db_connect as dbc
+import db.data as data
+import db.cache as cache
+import db.jobs as jobs
+
+TRAINING = "training"
+WORKSHOP = "workshop"
+
+# fields of a progress record:
+TRAININGS_LEFT = "trainingsLeft"
+WORKSHOPS_LEFT = "workshopsLeft"
+REQUIRED = "required"
+REMAINING = "remaining"
+EARNED = "earned"
+EARNED_AT = "earnedAt"
+NOTIFIED = "notified"
+
+LEFT_FIELDS = {TRAINING: TRAININGS_LEFT, WORKSHOP: WORKSHOPS_LEFT}
+
+# where the requirements live in the badge cache:
+REQUIREMENTS_KEY = "requirements"
+REQUIREMENT_FIELDS = {"_id": 0, data.BADGES_NM: 1, data.BADGE_TRAININGS: 1,
+                      data.BADGE_WORKSHOPS: 1}
+
+# the job that tells a user about the badges they earned:
+EARNED_JOB = "badgeEarned"
+# wait this long before telling, so badges earned close together
+# go out in one notification:
+NOTIFY_DELAY_SECS = float(os.environ.get("MAYS_NOTIFY_DELAY_SECS", 60))
+# what a user's progress shows of a record:
+RECORD_FIELDS = {"_id": 0, data.NETID: 0}
+# what `queue_notifications()` reads of a progress record:
+NOTIFY_FIELDS = {"_id": 0, data.NETID: 1}
+
+dbc.add_index(data.PROGRESS, [(data.NETID, 1), (data.BADGES_NM, 1)],
+              unique=True)
+dbc.add_index(data.PROGRESS, [(EARNED, 1), (NOTIFIED, 1)])
+# for renames:
+dbc.add_index(data.PROGRESS, data.BADGES_NM)
+dbc.add_index(data.PROGRESS, TRAININGS_LEFT)
+dbc.add_index(data.PROGRESS, WORKSHOPS_LEFT)
+
+data.add_dependent(data.USERS, data.PROGRESS, data.NETID)
+data.add_dependent(data.BADGES, data.PROGRESS, data.BADGES_NM)
+data.add_reference(data.USERS, data.PROGRESS, data.NETID)
+data.add_reference(data.BADGES, data.PROGRESS, data.BADGES_NM)
+data.add_reference(data.TRAININGS, data.PROGRESS, TRAININGS_LEFT,
+                   is_list=True)
+data.add_reference(data.WORKSHOPS, data.PROGRESS, WORKSHOPS_LEFT,
+                   is_list=True)
+
+
+def as_names(val):
+    """
+    A badge's list of required names, without repeats.
+    Older records may hold a single name instead of a list.
+    """
+    if val is None:
+        return []
+    if isinstance(val, str):
+        return [val]
+    return list(dict.fromkeys(val))
+
+
+def requirements():
+    """
+    What each badge requires, and which badges each training and
+    workshop counts towards:
+        ({badge: (trainings, workshops)}, {(kind, name): [badge, ...]})
+    This is kept in the badge cache, so it is only re-read after
+    a badge changes. Do not modify it.
+    """
+    def load():
+        return requirements_of(dbc.fetch_all(data.BADGES, data.BADGES_NM,
+                                             projection=REQUIREMENT_FIELDS))
+
+    return cache.get_cache(data.BADGES).get(REQUIREMENTS_KEY, load)
+
+
+def requirements_of(badges):
+    """
+    `requirements()` from the badge records, keyed on badge name.
+    """
+    needs = {}
+    counts_for = {}
+    for badge, doc in badges.items():
+        trainings = as_names(doc.get(data.BADGE_TRAININGS))
+        workshops = as_names(doc.get(data.BADGE_WORKSHOPS))
+        if not trainings and not workshops:
+            continue
+        needs[badge] = (trainings, workshops)
+        for kind, names in ((TRAINING, trainings), (WORKSHOP, workshops)):
+            for name in names:
+                counts_for.setdefault((kind, name), []).append(badge)
+    return needs, counts_for
+
+
+def new_progress(trainings, workshops, completed=()):
+    """
+    The progress fields for a badge requiring trainings and workshops,
+    given the set of (kind, name) pairs already completed.
+    """
+    trainings_left = [name for name in trainings
+                      if (TRAINING, name) not in completed]
+    workshops_left = [name for name in workshops
+                      if (WORKSHOP, name) not in completed]
+    remaining = len(trainings_left) + len(workshops_left)
+    progress = {TRAININGS_LEFT: trainings_left,
+                WORKSHOPS_LEFT: workshops_left,
+                REQUIRED: len(trainings) + len(workshops),
+                REMAINING: remaining,
+                EARNED: remaining == 0,
+                NOTIFIED: False}
+    if remaining == 0:
+        progress[EARNED_AT] = datetime.datetime.utcnow()
+    return progress
+
+
+def record_completion(netid, kind, name):
+    """
+    Count a completed training or workshop towards every badge that
+    requires it. Completing the same one again changes nothing.
+    Returns the names of those badges.
+    """
+    return record_completions([netid], kind, name)
+
+
+def record_completions(netids, kind, name):
+    """
+    Count a training or workshop completed by several users (everyone
+    at one session, say) towards every badge that requires it.
+    It takes three writes, however many users and badges are involved
+    (see `completion_plan()`), and two more only if some badge was
+    earned.
+    Returns the names of those badges.
+    """
+    badges, writes = completion_plan(requirements(), netids, kind, name)
+    for ops in writes:
+        result, failures = dbc.bulk_write(data.PROGRESS, ops)
+    if writes and result.modified_count:
+        queue_notifications(users_filter(netids))
+    return badges
+
+
+def completion_plan(reqs, netids, kind, name):
+    """
+    What `record_completions()` writes, given `requirements()`: the
+    badges the training or workshop counts towards, and the bulk writes
+    to run one after another on the progress records. Those are the
+    starts and ticks of `completion_ops()`, then the update that marks
+    finished badges earned (whose result says if any was).
+    A start fails with a duplicate key error if someone made the same
+    record at the same time; the record is there all the same, and as
+    the starts run unordered, the others still run. So failures can
+    be ignored.
+    """
+    needs, counts_for = reqs
+    badges = counts_for.get((kind, name), [])
+    if not badges or not netids:
+        return [], []
+    starts, ticks = completion_ops(needs, badges, netids, kind, name)
+    return badges, [starts, ticks,
+                    [dbc.UpdateMany(*earned_update(netids, badges))]]
+
+
+def users_filter(netids):
+    return {data.NETID: {"$in": list(netids)}}
+
+
+def completion_ops(needs, badges, netids, kind, name):
+    """
+    The bulk writes that count a completed training or workshop towards
+    badges: upserts that make the records not made yet, and updates
+    that tick the item off where it is still to do.
+    """
+    left = LEFT_FIELDS[kind]
+    pairs = [(netid, badge) for netid in netids for badge in badges]
+    starts = [dbc.UpdateOne({data.NETID: netid, data.BADGES_NM: badge},
+                            {"$setOnInsert": new_progress(*needs[badge])},
+                            upsert=True)
+              for netid, badge in pairs]
+    ticks = [dbc.UpdateOne({data.NETID: netid, data.BADGES_NM: badge,
+                            left: name},
+                           {"$pull": {left: name}, "$inc": {REMAINING: -1}})
+             for netid, badge in pairs]
+    return starts, ticks
+
+
+def earned_update(netids, badges):
+    """
+    The filters and update that mark finished badges earned.
+    """
+    return ({**users_filter(netids),
+             data.BADGES_NM: {"$in": badges},
+             REMAINING: 0, EARNED: False},
+            {"$set": {EARNED: True, EARNED_AT: datetime.datetime.utcnow()}})
+
+
+def unnotified_filter(filters={}):
+    return {**filters, EARNED: True, NOTIFIED: False}
+
+
+def queue_notifications(filters={}):
+    """
+    Queue a notification job for each user (among those matching
+    filters) with an earned badge they have not been told about.
+    Returns their netids.
+    """
+    recs = dbc.fetch_docs(data.PROGRESS, unnotified_filter(filters),
+                          projection=NOTIFY_FIELDS)
+    netids, ops = notification_plan(recs)
+    if ops:
+        dbc.bulk_write(data.JOBS, ops)
+    return netids
+
+
+def notification_plan(recs):
+    """
+    The users to notify, given their unnotified progress records, and
+    the job writes (see `jobs.enqueue_ops()`) that do it.
+    """
+    netids = list(dict.fromkeys(rec[data.NETID] for rec in recs))
+    return netids, jobs.enqueue_ops(EARNED_JOB, netids, NOTIFY_DELAY_SECS)
+
+
+def rebuild(netid, completed):
+    """
+    Recompute the progress records of a user from everything they have
+    completed (a set of (kind, name) pairs): after badge requirements
+    change, say. Badges already earned stay earned.
+    """
+    needs, counts_for = requirements()
+    existing = dbc.fetch_all(data.PROGRESS, data.BADGES_NM,
+                             filters={data.NETID: netid},
+                             projection={"_id": 0, data.BADGES_NM: 1,
+                                         EARNED: 1})
+    badges = list(needs) + [badge for badge in existing
+                            if badge not in needs]
+    ops = [rebuild_op(needs, netid, badge, completed, existing.get(badge))
+           for badge in badges]
+    ops = [op for op in ops if op is not None]
+    if ops:
+        dbc.bulk_write(data.PROGRESS, ops)
+        queue_notifications({data.NETID: netid})
+
+
+def rebuild_badges(badgenames, completed):
+    """
+    Recompute every user's progress towards the given badges from what
+    each has completed ({netid: set of (kind, name) pairs}): after the
+    badges are added, say. Badges already earned stay earned.
+    It takes two DB calls, however many users and badges.
+    """
+    needs, counts_for = requirements()
+    existing = {(rec[data.NETID], rec[data.BADGES_NM]): rec
+                for rec in dbc.fetch_docs(
+                    data.PROGRESS, {data.BADGES_NM: {"$in": badgenames}},
+                    projection={"_id": 0, data.NETID: 1,
+                                data.BADGES_NM: 1, EARNED: 1})}
+    netids = list(completed) + [netid for netid, badge in existing
+                                if netid not in completed]
+    ops = []
+    for badge in badgenames:
+        for netid in dict.fromkeys(netids):
+            op = rebuild_op(needs, netid, badge, completed.get(netid, ()),
+                            existing.get((netid, badge)))
+            if op is not None:
+                ops.append(op)
+    if ops:
+        dbc.bulk_write(data.PROGRESS, ops)
+        queue_notifications({data.BADGES_NM: {"$in": badgenames}})
+
+
+def rebuild_op(needs, netid, badge, completed, old):
+    """
+    The write that brings a user's progress record for a badge (old, or
+    None if there is none) in line with what they have completed,
+    or None if it needs none.
+    """
+    if old is not None and old.get(EARNED):
+        return None
+    if badge not in needs:
+        if old is None:
+            return None
+        return dbc.DeleteOne({data.NETID: netid, data.BADGES_NM: badge})
+    progress = new_progress(*needs[badge], completed)
+    if old is None and progress[REMAINING] == progress[REQUIRED]:
+        # nothing done towards it: no record needed
+        return None
+    return dbc.ReplaceOne({data.NETID: netid, data.BADGES_NM: badge},
+                          {data.NETID: netid, data.BADGES_NM: badge,
+                           **progress},
+                          upsert=True)
+
+
+def unnotified(netids):
+    """
+    The earned badges each of the given users has not been told about:
+    {netid: [badge, ...]}, leaving out users with none.
+    """
+    recs = dbc.fetch_docs(data.PROGRESS,
+                          {data.NETID: {"$in": list(netids)},
+                           EARNED: True, NOTIFIED: False},
+                          projection={"_id": 0, data.NETID: 1,
+                                      data.BADGES_NM: 1},
+                          sort=[(EARNED_AT, 1)])
+    badges = {}
+    for rec in recs:
+        badges.setdefault(rec[data.NETID], []).append(rec[data.BADGES_NM])
+    return badges
+
+
+def mark_notified(badges):
+    """
+    Record that users have been told about their earned badges, given
+    as {netid: [badge, ...]}, in one write.
+    """
+    if badges:
+        dbc.bulk_write(data.PROGRESS,
+                       [dbc.UpdateMany({data.NETID: netid,
+                                        data.BADGES_NM: {"$in": names},
+                                        EARNED: True},
+                                       {"$set": {NOTIFIED: True}})
+                        for netid, names in badges.items()])
+
+
+def record_filter(netid, badgename):
+    return {data.NETID: netid, data.BADGES_NM: badgename}
+
+
+def get_progress(netid):
+    """
+    A user's progress towards every badge they have started,
+    keyed on badge name.
+    """
+    return dbc.fetch_all(data.PROGRESS, data.BADGES_NM,
+                         filters={data.NETID: netid},
+                         projection=RECORD_FIELDS)
+
+
+def badge_progress(needs, badgename, completed):
+    """
+    The progress towards a badge of a user with no record of it, given
+    what they have completed (a set of (kind, name) pairs), or None if
+    the badge requires nothing (or does not exist).
+    See `attendance.get_badge_progress()`.
+    """
+    if badgename not in needs:
+        return None
+    return dbc.to_json({data.BADGES_NM: badgename,
+                        **new_progress(*needs[badgename], completed)})
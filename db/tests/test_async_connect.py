@@ -0,0 +1,58 @@
+"""
+This file holds the tests for async_connect.py.
+"""
+import sys
+sys.path.insert(0, "../..")
+
+from unittest import TestCase
+import asyncio
+import db.async_connect as adbc
+
+
+class FakeClient:
+    def __init__(self):
+        self.closed_in = None
+
+    async def close(self):
+        self.closed_in = asyncio.get_running_loop()
+
+
+class AsyncConnectTestCase(TestCase):
+    def setUp(self):
+        new_client = adbc.new_client
+        adbc.new_client = FakeClient
+        self.addCleanup(setattr, adbc, "new_client", new_client)
+        self.addCleanup(setattr, adbc, "client", None)
+        self.loops = [asyncio.new_event_loop(), asyncio.new_event_loop()]
+        for loop in self.loops:
+            self.addCleanup(loop.close)
+
+    def get_client(self, loop):
+        async def get():
+            return adbc.get_client()
+
+        return loop.run_until_complete(get())
+
+    def test_new_loop_closes_old_client(self):
+        """
+        A client of another event loop is closed in that loop.
+        """
+        old = self.get_client(self.loops[0])
+        self.assertIs(self.get_client(self.loops[0]), old)
+        new = self.get_client(self.loops[1])
+        self.assertIsNot(new, old)
+        self.loops[0].run_until_complete(asyncio.sleep(0))
+        self.assertIs(old.closed_in, self.loops[0])
+        self.assertIsNone(new.closed_in)
+
+    def test_closed_loop(self):
+        """
+        A client left behind by a closed loop is an error until it is
+        dropped with close_client().
+        """
+        self.get_client(self.loops[0])
+        self.loops[0].close()
+        with self.assertRaises(RuntimeError):
+            self.get_client(self.loops[1])
+        self.loops[1].run_until_complete(adbc.close_client())
+        self.assertIsInstance(self.get_client(self.loops[1]), FakeClient)
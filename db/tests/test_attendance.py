@@ -0,0 +1,182 @@
+"""
+This file holds the tests for attendance.py.
+"""
+import sys
+sys.path.insert(0, "../..")
+
+from unittest import TestCase
+import random
+import datetime
+import db.data as db
+import db.db_connect as dbc
+import db.progress as progress
+import db.attendance as attendance
+
+HUGE_NUM = 1000000000000
+
+
+def new_entity_name(entity_type):
+    """
+    Randomly create entity name for test
+    """
+    int_name = random.randint(0, HUGE_NUM)
+    return f"new {entity_type}" + str(int_name)
+
+
+class AttendanceTestCase(TestCase):
+    def setUp(self):
+        self.netids = [new_entity_name('user'), new_entity_name('user')]
+        for netid in self.netids:
+            db.add_user(netid, "first", "last")
+        self.training = new_entity_name('training')
+        db.add_training(self.training)
+        self.workshop = new_entity_name('workshop')
+        db.add_workshop(self.workshop)
+        self.badge = new_entity_name('badge')
+        db.add_badge(self.badge, "a badge", [self.training], [self.workshop])
+
+    def tearDown(self):
+        for netid in self.netids:
+            db.del_user(netid)
+        db.del_training(self.training)
+        db.del_workshop(self.workshop)
+        db.del_badge(self.badge)
+
+    def test_record_attendance(self):
+        ret = attendance.record_attendance(self.netids[0], progress.TRAINING,
+                                           self.training)
+        self.assertEqual(ret, db.OK)
+        self.assertEqual(attendance.get_completed(self.netids[0]),
+                         {progress.TRAINING: [self.training],
+                          progress.WORKSHOP: []})
+        badge = attendance.get_badge_progress(self.netids[0], self.badge)
+        self.assertEqual(badge[progress.REMAINING], 1)
+
+    def test_attended_before_badge(self):
+        """
+        What a user attended before a badge was added counts towards it.
+        """
+        training = new_entity_name('training')
+        db.add_training(training)
+        self.addCleanup(db.del_training, training)
+        attendance.record_attendance(self.netids[0], progress.TRAINING,
+                                     self.training)
+        badge = new_entity_name('badge')
+        db.add_badge(badge, "a later badge", [self.training, training])
+        self.addCleanup(db.del_badge, badge)
+        rec = attendance.get_badge_progress(self.netids[0], badge)
+        self.assertEqual(rec[progress.TRAININGS_LEFT], [training])
+        self.assertNotIn(badge, progress.get_progress(self.netids[1]))
+        attendance.record_attendance(self.netids[0], progress.TRAINING,
+                                     training)
+        rec = attendance.get_badge_progress(self.netids[0], badge)
+        self.assertEqual(rec[progress.REMAINING], 0)
+        self.assertTrue(rec[progress.EARNED])
+
+    def test_bulk_added_badge(self):
+        attendance.record_attendance(self.netids[1], progress.WORKSHOP,
+                                     self.workshop)
+        badge = new_entity_name('badge')
+        self.assertEqual(db.bulk_add(db.BADGES, [db.new_badge_doc(
+            badge, "desc", workshops=[self.workshop])]), [db.OK])
+        self.addCleanup(db.del_badge, badge)
+        rec = progress.get_progress(self.netids[1])[badge]
+        self.assertTrue(rec[progress.EARNED])
+
+    def test_progress_without_record(self):
+        """
+        With no progress record, a user's progress is worked out from
+        their attendance.
+        """
+        attendance.record_attendance(self.netids[0], progress.WORKSHOP,
+                                     self.workshop)
+        dbc.del_many(db.PROGRESS, {db.NETID: self.netids[0]})
+        rec = attendance.get_badge_progress(self.netids[0], self.badge)
+        self.assertEqual(rec[progress.REMAINING], 1)
+        self.assertEqual(rec[progress.WORKSHOPS_LEFT], [])
+
+    def test_record_missing(self):
+        ret = attendance.record_attendance(new_entity_name('user'),
+                                           progress.TRAINING, self.training)
+        self.assertEqual(ret, db.NOT_FOUND)
+        ret = attendance.record_attendance(self.netids[0], progress.WORKSHOP,
+                                           new_entity_name('workshop'))
+        self.assertEqual(ret, db.NOT_FOUND)
+
+    def test_check_in(self):
+        stranger = new_entity_name('user')
+        ret, statuses = attendance.check_in(progress.WORKSHOP, self.workshop,
+                                            self.netids + [stranger])
+        self.assertEqual(ret, db.OK)
+        self.assertEqual(statuses, [db.OK, db.OK, db.NOT_FOUND])
+        attendees = attendance.get_attendees(progress.WORKSHOP, self.workshop)
+        self.assertEqual([att[db.NETID] for att in attendees], self.netids)
+        for netid in self.netids:
+            badge = attendance.get_badge_progress(netid, self.badge)
+            self.assertEqual(badge[progress.WORKSHOPS_LEFT], [])
+
+    def test_check_in_missing_session(self):
+        ret, statuses = attendance.check_in(progress.TRAINING,
+                                            new_entity_name('training'),
+                                            self.netids)
+        self.assertEqual(ret, db.NOT_FOUND)
+
+    def test_attendance_order(self):
+        earlier = datetime.datetime(2022, 1, 1)
+        attendance.record_attendance(self.netids[0], progress.WORKSHOP,
+                                     self.workshop, earlier)
+        attendance.record_attendance(self.netids[0], progress.TRAINING,
+                                     self.training)
+        events = attendance.get_attendance(self.netids[0])
+        self.assertEqual([event[attendance.SESSION] for event in events],
+                         [self.training, self.workshop])
+        badge = attendance.get_badge_progress(self.netids[0], self.badge)
+        self.assertTrue(badge[progress.EARNED])
+
+    def test_rename_cascades(self):
+        """
+        Renaming a training renames it in badges, progress and the
+        attendance log; renaming a user moves their records.
+        """
+        attendance.record_attendance(self.netids[0], progress.TRAINING,
+                                     self.training)
+        attendance.record_attendance(self.netids[1], progress.WORKSHOP,
+                                     self.workshop)
+        new_training = new_entity_name('training')
+        ret, touched = db.rename(db.TRAININGS, self.training, new_training)
+        self.assertEqual(ret, db.OK)
+        self.assertEqual(touched, {db.TRAININGS: 1, db.BADGES: 1,
+                                   db.PROGRESS: 1, db.ATTENDANCE: 1})
+        self.training = new_training
+        self.assertEqual(db.get_badge_by_id(self.badge)[db.BADGE_TRAININGS],
+                         [new_training])
+        self.assertEqual(attendance.get_completed(self.netids[0]),
+                         {progress.TRAINING: [new_training],
+                          progress.WORKSHOP: []})
+        badge = attendance.get_badge_progress(self.netids[1], self.badge)
+        self.assertEqual(badge[progress.TRAININGS_LEFT], [new_training])
+        new_netid = new_entity_name('user')
+        self.assertEqual(db.update_user(self.netids[0], new_netid), db.OK)
+        self.netids[0] = new_netid
+        self.assertEqual(len(attendance.get_attendance(new_netid)), 1)
+        self.assertIn(self.badge, progress.get_progress(new_netid))
+
+    def test_bulk_rename_cascades(self):
+        new_workshop = new_entity_name('workshop')
+        statuses = db.bulk_rename(db.WORKSHOPS,
+                                  [(self.workshop, new_workshop)])
+        self.assertEqual(statuses, [db.OK])
+        self.workshop = new_workshop
+        self.assertEqual(db.get_badge_by_id(self.badge)[db.BADGE_WORKSHOPS],
+                         [new_workshop])
+
+    def test_rename_duplicate(self):
+        ret, touched = db.rename(db.WORKSHOPS, self.workshop, self.workshop)
+        self.assertEqual(ret, db.DUPLICATE)
+        other = new_entity_name('workshop')
+        db.add_workshop(other)
+        ret, touched = db.rename(db.WORKSHOPS, self.workshop, other)
+        self.assertEqual(ret, db.DUPLICATE)
+        db.del_workshop(other)
+        self.assertEqual(db.get_badge_by_id(self.badge)[db.BADGE_WORKSHOPS],
+                         [self.workshop])
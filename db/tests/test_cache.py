@@ -0,0 +1,74 @@
+"""
+This file holds the tests for cache.py.
+"""
+import sys
+sys.path.insert(0, "../..")
+
+from unittest import TestCase
+import time
+import db.cache as cache
+
+
+class CacheTestCase(TestCase):
+    def setUp(self):
+        self.loads = 0
+
+    def loader(self):
+        self.loads += 1
+        return self.loads
+
+    def test_read_through(self):
+        ttl_cache = cache.TTLCache("test", ttl=60)
+        self.assertEqual(ttl_cache.get("key", self.loader), 1)
+        self.assertEqual(ttl_cache.get("key", self.loader), 1)
+        self.assertEqual(ttl_cache.stats()["hits"], 1)
+        self.assertEqual(ttl_cache.stats()["misses"], 1)
+
+    def test_invalidate(self):
+        ttl_cache = cache.TTLCache("test", ttl=60)
+        ttl_cache.get("key", self.loader)
+        ttl_cache.invalidate()
+        self.assertEqual(ttl_cache.get("key", self.loader), 2)
+
+    def test_expiry(self):
+        ttl_cache = cache.TTLCache("test", ttl=0.01)
+        ttl_cache.get("key", self.loader)
+        time.sleep(0.02)
+        self.assertEqual(ttl_cache.get("key", self.loader), 2)
+
+    def test_racing_write(self):
+        """
+        A value loaded while a write invalidated the cache is not kept.
+        """
+        ttl_cache = cache.TTLCache("test", ttl=60)
+
+        def racing_loader():
+            ttl_cache.invalidate()
+            return self.loader()
+
+        ttl_cache.get("key", racing_loader)
+        self.assertEqual(ttl_cache.get("key", self.loader), 2)
+
+    def test_expired_entry_dropped(self):
+        ttl_cache = cache.TTLCache("test", ttl=0.01)
+        ttl_cache.get("key", self.loader)
+        time.sleep(0.02)
+        ttl_cache.get("other", self.loader)
+        self.assertEqual(ttl_cache.stats()["evictions"], 1)
+        self.assertEqual(ttl_cache.stats()["entries"], 1)
+
+    def test_bounded(self):
+        """
+        However many keys clients send, the cache keeps at most
+        max_entries, dropping the least recently used.
+        """
+        ttl_cache = cache.TTLCache("test", ttl=60, max_entries=3)
+        for key in range(3):
+            ttl_cache.get(key, self.loader)
+        ttl_cache.get(0, self.loader)
+        for key in range(3, 100):
+            ttl_cache.get(key, self.loader)
+        self.assertEqual(ttl_cache.stats()["entries"], 3)
+        self.assertNotIn(1, ttl_cache.entries)
+        ttl_cache.get(99, self.loader)
+        self.assertEqual(ttl_cache.stats()["hits"], 2)
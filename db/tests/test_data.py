@@ -6,6 +6,7 @@ sys.path.insert(0, "../..")
 
 from unittest import TestCase, skip
 import db.data as db
+import db.db_connect as dbc
 import random
 
 HUGE_NUM = 1000000000000
@@ -23,7 +24,8 @@ class DataTestCase(TestCase):
     def setUp(self):
         #user
         self.test_user_id = new_entity_name('user')
-        db.add_user(self.test_user_id, "first", "last", "9999999")
+        self.test_barcode = new_entity_name('barcode')
+        db.add_user(self.test_user_id, "first", "last", self.test_barcode)
         #badge
         self.test_badge_id = new_entity_name('badge')
         db.add_badge(self.test_badge_id, "test_description")
@@ -59,3 +61,218 @@ class DataTestCase(TestCase):
         trainings = db.get_trainings()
         self.assertIsInstance(trainings, dict)
         self.assertIn(self.test_training_id, trainings) 
+
+    def test_db_ready(self):
+        self.assertTrue(db.db_ready())
+
+    def test_add_duplicate_user(self):
+        ret = db.add_user(self.test_user_id, "first", "last",
+                          new_entity_name('barcode'))
+        self.assertEqual(ret, db.DUPLICATE)
+
+    def test_del_missing_training(self):
+        ret = db.del_training(new_entity_name('training'))
+        self.assertEqual(ret, db.NOT_FOUND)
+
+    def test_update_workshop_duplicate(self):
+        other = new_entity_name('workshop')
+        db.add_workshop(other)
+        ret = db.update_workshop(other, self.test_workshop_id)
+        self.assertEqual(ret, db.DUPLICATE)
+        db.del_workshop(other)
+
+    def test_update_badge_missing(self):
+        ret = db.update_badge(new_entity_name('badge'),
+                              new_entity_name('badge'))
+        self.assertEqual(ret, db.NOT_FOUND)
+
+    def test_update_badge_desc(self):
+        ret = db.update_badge_desc(self.test_badge_id, "new description")
+        self.assertEqual(ret, db.OK)
+        badge = db.get_badge_by_id(self.test_badge_id)
+        self.assertEqual(badge[db.DESC], "new description")
+
+    def test_add_duplicate_barcode(self):
+        ret = db.add_user(new_entity_name('user'), "first", "last",
+                          self.test_barcode)
+        self.assertEqual(ret, db.DUPLICATE)
+
+    def test_get_user_by_barcode(self):
+        user = db.get_user_by_barcode(self.test_barcode)
+        self.assertEqual(user, {db.NETID: self.test_user_id,
+                                db.FIRST_NM: "first",
+                                db.LAST_NM: "last",
+                                db.BARCODE: self.test_barcode})
+
+    def test_placeholder_barcode_dropped(self):
+        """
+        A placeholder barcode is not stored: it would clash with
+        every other user given one.
+        """
+        doc = db.new_user_doc("nobarcode", "first", "last", "999999")
+        self.assertNotIn(db.BARCODE, doc)
+
+    def test_clear_placeholder_barcodes(self):
+        netids = [new_entity_name("user"), new_entity_name("user")]
+        dbc.insert_doc(db.USERS, {db.NETID: netids[0],
+                                  db.BARCODE: db.PLACEHOLDER_BARCODES[0]})
+        dbc.insert_doc(db.USERS, {db.NETID: netids[1], db.BARCODE: None})
+        self.assertGreaterEqual(db.clear_placeholder_barcodes(), 2)
+        for netid in netids:
+            user = dbc.fetch_one(db.USERS, {db.NETID: netid})
+            self.assertNotIn(db.BARCODE, user)
+            db.del_user(netid)
+        self.assertEqual(db.get_user_by_barcode(self.test_barcode)
+                         [db.NETID], self.test_user_id)
+
+    def race_fetch_keys(self, lost):
+        """
+        Make the next pre-check of a bulk write see `lost` just before
+        someone else deletes it.
+        """
+        fetch_keys = dbc.fetch_keys
+
+        def racing(*args, **kwargs):
+            dbc.fetch_keys = fetch_keys
+            found = fetch_keys(*args, **kwargs)
+            db.del_training(lost)
+            return found
+
+        dbc.fetch_keys = racing
+        self.addCleanup(setattr, dbc, "fetch_keys", fetch_keys)
+
+    def test_bulk_rename_race(self):
+        """
+        A rename whose record went after the pre-check is NOT_FOUND.
+        """
+        lost, kept = new_entity_name("training"), new_entity_name("training")
+        db.add_training(lost)
+        db.add_training(kept)
+        self.race_fetch_keys(lost)
+        statuses = db.bulk_rename(db.TRAININGS, [(lost, lost + "x"),
+                                                 (kept, kept + "x")])
+        self.assertEqual(statuses, [db.NOT_FOUND, db.OK])
+        db.del_training(kept + "x")
+
+    def test_bulk_rename_transaction(self):
+        """
+        The renames and their references are written in one
+        transaction.
+        """
+        name = new_entity_name("training")
+        db.add_training(name)
+        run_transaction = dbc.run_transaction
+        calls = []
+
+        def recording(func):
+            calls.append(func)
+            return run_transaction(func)
+
+        dbc.run_transaction = recording
+        self.addCleanup(setattr, dbc, "run_transaction", run_transaction)
+        self.assertEqual(db.bulk_rename(db.TRAININGS, [(name, name + "x")]),
+                         [db.OK])
+        self.assertEqual(len(calls), 1)
+        db.del_training(name + "x")
+
+    def test_bulk_delete_race(self):
+        lost = new_entity_name("training")
+        db.add_training(lost)
+        self.race_fetch_keys(lost)
+        self.assertEqual(db.bulk_delete(db.TRAININGS, [lost]),
+                         [db.NOT_FOUND])
+
+    def test_bulk_repeated_keys(self):
+        """
+        A key given twice in one bulk request is a DUPLICATE the second
+        time, whether renamed or deleted.
+        """
+        name = new_entity_name("training")
+        db.add_training(name)
+        statuses = db.bulk_rename(db.TRAININGS, [(name, name + "x"),
+                                                 (name, name + "y")])
+        self.assertEqual(statuses, [db.OK, db.DUPLICATE])
+        self.assertEqual(db.bulk_delete(db.TRAININGS,
+                                        [name + "x", name + "x"]),
+                         [db.OK, db.DUPLICATE])
+        self.assertFalse(db.training_exists(name + "y"))
+
+    def test_bulk_delete_failed_write(self):
+        """
+        A bulk write that fails reports what it can rather than raise.
+        """
+        name = new_entity_name("training")
+        db.add_training(name)
+        self.addCleanup(db.del_training, name)
+        bulk_write = dbc.bulk_write
+
+        def failing(collect_nm, ops, ordered=False, session=None):
+            return None, {index: dbc.DUPLICATE_KEY
+                          for index in range(len(ops))}
+
+        dbc.bulk_write = failing
+        self.addCleanup(setattr, dbc, "bulk_write", bulk_write)
+        self.assertEqual(db.bulk_delete(db.TRAININGS, [name]),
+                         [db.DUPLICATE])
+        dbc.bulk_write = bulk_write
+        self.assertTrue(db.training_exists(name))
+
+    def test_get_workshops_page(self):
+        workshops = db.get_workshops(limit=1)
+        self.assertEqual(len(workshops), 1)
+        after = next(iter(workshops))
+        for name in db.get_workshops(limit=5, after=after):
+            self.assertGreater(name, after)
+
+    def test_catalog_cache_hit(self):
+        db.get_trainings()
+        hits = db.cache_stats()[db.TRAININGS]["hits"]
+        db.get_trainings()
+        self.assertEqual(db.cache_stats()[db.TRAININGS]["hits"], hits + 1)
+
+    def test_catalog_cache_invalidated(self):
+        """
+        A write drops the cached listing, so it is seen at once.
+        """
+        new_name = new_entity_name('badge')
+        self.assertIn(self.test_badge_id, db.get_badges())
+        db.update_badge(self.test_badge_id, new_name)
+        badges = db.get_badges()
+        self.assertIn(new_name, badges)
+        self.assertNotIn(self.test_badge_id, badges)
+        db.update_badge(new_name, self.test_badge_id)
+
+    def test_create_badge(self):
+        badge = new_entity_name('badge')
+        new_training = new_entity_name('training')
+        ret = db.create_badge(badge, "desc",
+                              f"{self.test_training_id},{new_training}",
+                              "-")
+        self.assertEqual(ret, db.OK)
+        self.assertTrue(db.training_exists(new_training))
+        rec = db.get_badge_by_id(badge)
+        self.assertEqual(rec[db.BADGE_TRAININGS],
+                         [self.test_training_id, new_training])
+        self.assertNotIn(db.BADGE_WORKSHOPS, rec)
+        self.assertEqual(db.create_badge(badge, "desc", [new_training]),
+                         db.DUPLICATE)
+        db.del_badge(badge)
+        db.del_training(new_training)
+
+    def test_as_name_list(self):
+        self.assertEqual(db.as_name_list("a, b,,a"), ["a", "b"])
+        self.assertEqual(db.as_name_list("-"), [])
+        self.assertEqual(db.as_name_list(["a", "a"]), ["a"])
+
+    def test_get_badge_details(self):
+        badge = new_entity_name('badge')
+        db.create_badge(badge, "desc", [self.test_training_id],
+                        [self.test_workshop_id])
+        details = db.get_badge_details(badge)
+        self.assertEqual(details[db.DESC], "desc")
+        self.assertEqual(details[db.TRAININGS],
+                         [{db.TRAININGS_NM: self.test_training_id}])
+        self.assertEqual(details[db.WORKSHOPS],
+                         [{db.WORKSHOPS_NM: self.test_workshop_id}])
+        self.assertIsNone(db.get_badge_details(new_entity_name('badge')))
+        db.del_badge(badge)
@@ -0,0 +1,120 @@
+"""
+This file holds the tests for db_connect.py.
+"""
+import sys
+sys.path.insert(0, "../..")
+
+from unittest import TestCase
+import json
+import time
+import datetime
+import threading
+from bson import ObjectId, Decimal128
+import bson.json_util as bsutil
+import pymongo as pm
+import db.db_connect as dbc
+
+
+class SlowCollection:
+    """
+    A collection whose index builds wait, then fail, like those on
+    a server that is down.
+    """
+
+    def __init__(self, started):
+        self.started = started
+
+    def create_index(self, keys, **kwargs):
+        self.started.set()
+        time.sleep(0.2)
+        raise pm.errors.ServerSelectionTimeoutError("no server")
+
+
+class SlowClient:
+    def __init__(self):
+        self.started = threading.Event()
+
+    def __getitem__(self, db_nm):
+        return {"coll": SlowCollection(self.started)}
+
+
+class DBConnectTestCase(TestCase):
+    def test_get_client_shared(self):
+        """
+        Every caller in a process gets the same pooled client.
+        """
+        self.assertIs(dbc.get_client(), dbc.get_client())
+
+    def test_forget_client(self):
+        """
+        After a fork the inherited client is dropped and a new one is made.
+        An in-memory client is kept: it holds the data.
+        """
+        old = dbc.get_client()
+        dbc.forget_client()
+        if dbc.BACKEND == dbc.MEMORY:
+            self.assertIs(dbc.get_client(), old)
+        else:
+            self.assertIsNot(dbc.get_client(), old)
+
+    def test_pool_stats(self):
+        dbc.get_client()
+        stats = dbc.pool_stats()
+        self.assertIsInstance(stats, dict)
+        self.assertTrue(stats["connected"])
+        self.assertEqual(stats["max_pool_size"],
+                         dbc.POOL_SETTINGS["maxPoolSize"])
+
+    def test_to_json(self):
+        """
+        The single-pass conversion matches the old string round trip.
+        """
+        doc = {"_id": ObjectId(),
+               "netid": "ab123",
+               "created": datetime.datetime(2022, 1, 2, 3, 4, 5, 6000),
+               "old": datetime.datetime(1960, 1, 1),
+               "price": Decimal128("1.50"),
+               "nan": float("nan"),
+               "attended": [{"session": "w1", "ref": ObjectId()}]}
+        self.assertEqual(dbc.to_json(doc), json.loads(bsutil.dumps(doc)))
+        json.dumps(dbc.to_json(doc))
+
+    def test_ensure_indexes_failure(self):
+        """
+        A failed build is reported and remembered, and does not raise.
+        """
+        failures = dbc.ensure_indexes(SlowClient(), [("coll", "fld", {})])
+        name = dbc.index_name("coll", "fld")
+        self.assertIn(name, failures)
+        self.assertIn(name, dbc.index_failures)
+        dbc.index_failures.pop(name)
+
+    def test_build_indexes_later(self):
+        """
+        Index builds run in the background: connecting never waits
+        for them.
+        """
+        old_build, old_backend = dbc.INDEX_BUILD, dbc.BACKEND
+        dbc.INDEX_BUILD, dbc.BACKEND = dbc.INDEX_BUILD_LATER, dbc.MONGO
+        try:
+            mongo_client = SlowClient()
+            start = time.monotonic()
+            dbc.build_indexes_later(mongo_client, [("coll", "a", {}),
+                                                   ("coll", "b", {})])
+            self.assertLess(time.monotonic() - start, 0.1)
+            self.assertTrue(mongo_client.started.wait(5))
+        finally:
+            dbc.INDEX_BUILD, dbc.BACKEND = old_build, old_backend
+        time.sleep(0.5)
+        for keys in ("a", "b"):
+            dbc.index_failures.pop(dbc.index_name("coll", keys), None)
+
+    def test_build_indexes_off(self):
+        old_build = dbc.INDEX_BUILD
+        dbc.INDEX_BUILD = dbc.INDEX_BUILD_OFF
+        try:
+            mongo_client = SlowClient()
+            dbc.build_indexes_later(mongo_client, [("coll", "a", {})])
+            self.assertFalse(mongo_client.started.is_set())
+        finally:
+            dbc.INDEX_BUILD = old_build
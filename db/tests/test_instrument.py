@@ -0,0 +1,49 @@
+"""
+This file holds the tests for instrument.py.
+"""
+import sys
+sys.path.insert(0, "../..")
+
+from unittest import TestCase
+import db.instrument as instrument
+
+
+@instrument.timed
+def an_op():
+    return "done"
+
+
+@instrument.timed
+def a_stream():
+    yield 1
+    yield 2
+
+
+class InstrumentTestCase(TestCase):
+    def tearDown(self):
+        instrument.end_request()
+
+    def test_request_stats(self):
+        instrument.start_request()
+        self.assertEqual(an_op(), "done")
+        self.assertEqual(list(a_stream()), [1, 2])
+        stats = instrument.end_request("GET /test")
+        self.assertEqual(stats.queries, 2)
+        self.assertIn(stats.slowest_op, ("an_op", "a_stream"))
+        self.assertEqual(instrument.route_stats()["GET /test"]["queries"], 2)
+        self.assertIsNone(instrument.current())
+
+    def test_outside_request(self):
+        """
+        Operations outside a request only count towards the totals.
+        """
+        count = instrument.op_stats().get("an_op", {}).get("count", 0)
+        an_op()
+        self.assertEqual(instrument.op_stats()["an_op"]["count"], count + 1)
+
+    def test_server_timing(self):
+        instrument.start_request()
+        an_op()
+        timing = instrument.server_timing(instrument.end_request())
+        self.assertIn('desc="1 queries"', timing)
+        self.assertIn('db-slowest;dur=', timing)
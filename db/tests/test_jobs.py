@@ -0,0 +1,85 @@
+"""
+This file holds the tests for jobs.py.
+"""
+import sys
+sys.path.insert(0, "../..")
+
+from unittest import TestCase
+import random
+import datetime
+import db.db_connect as dbc
+import db.data as db
+import db.jobs as jobs
+
+HUGE_NUM = 1000000000000
+
+
+def new_entity_name(entity_type):
+    """
+    Randomly create entity name for test
+    """
+    int_name = random.randint(0, HUGE_NUM)
+    return f"new {entity_type}" + str(int_name)
+
+
+class JobsTestCase(TestCase):
+    def setUp(self):
+        self.job_type = new_entity_name('job')
+
+    def tearDown(self):
+        dbc.del_many(db.JOBS, {jobs.TYPE: self.job_type})
+
+    def test_enqueue_coalesces(self):
+        jobs.enqueue(self.job_type, ["a", "b", "a"])
+        jobs.enqueue(self.job_type, ["b"])
+        self.assertEqual(dbc.count(db.JOBS, {jobs.TYPE: self.job_type}), 2)
+
+    def test_claim(self):
+        jobs.enqueue(self.job_type, ["a", "b", "c"])
+        claimed = jobs.claim([self.job_type], 2, 60)
+        self.assertEqual(len(claimed), 2)
+        for job in claimed:
+            self.assertEqual(job[jobs.STATUS], jobs.RUNNING)
+            self.assertEqual(job[jobs.ATTEMPTS], 1)
+        rest = jobs.claim([self.job_type], 2, 60)
+        self.assertEqual(len(rest), 1)
+        self.assertEqual(jobs.claim([self.job_type], 2, 60), [])
+
+    def test_not_due(self):
+        jobs.enqueue(self.job_type, ["a"], delay_secs=60)
+        self.assertEqual(jobs.claim([self.job_type], 10, 60), [])
+
+    def test_lease_expires(self):
+        jobs.enqueue(self.job_type, ["a"])
+        jobs.claim([self.job_type], 10, -1)
+        reclaimed = jobs.claim([self.job_type], 10, 60)
+        self.assertEqual(len(reclaimed), 1)
+        self.assertEqual(reclaimed[0][jobs.ATTEMPTS], 2)
+
+    def test_complete(self):
+        jobs.enqueue(self.job_type, ["a"])
+        jobs.complete(jobs.claim([self.job_type], 10, 60))
+        job = dbc.fetch_one(db.JOBS, {jobs.TYPE: self.job_type})
+        self.assertEqual(job[jobs.STATUS], jobs.DONE)
+        self.assertNotIn(jobs.OWNER, job)
+        # a new event makes a new job:
+        jobs.enqueue(self.job_type, ["a"])
+        self.assertEqual(len(jobs.claim([self.job_type], 10, 60)), 1)
+
+    def test_fail(self):
+        jobs.enqueue(self.job_type, ["a"])
+        before = datetime.datetime.utcnow()
+        jobs.fail(jobs.claim([self.job_type], 10, 60), "boom")
+        job = dbc.fetch_one(db.JOBS, {jobs.TYPE: self.job_type})
+        self.assertEqual(job[jobs.STATUS], jobs.PENDING)
+        self.assertEqual(job[jobs.ERROR], "boom")
+        self.assertGreater(job[jobs.RUN_AT], before)
+        self.assertEqual(jobs.claim([self.job_type], 10, 60), [])
+
+    def test_fail_for_good(self):
+        jobs.enqueue(self.job_type, ["a"])
+        claimed = jobs.claim([self.job_type], 10, 60)
+        claimed[0][jobs.ATTEMPTS] = jobs.MAX_ATTEMPTS
+        jobs.fail(claimed, "boom")
+        job = dbc.fetch_one(db.JOBS, {jobs.TYPE: self.job_type})
+        self.assertEqual(job[jobs.STATUS], jobs.FAILED)
@@ -0,0 +1,123 @@
+"""
+This file holds the tests for memory_db.py.
+"""
+import sys
+sys.path.insert(0, "../..")
+
+from unittest import TestCase
+from pymongo import InsertOne, UpdateOne, DeleteOne
+from pymongo.errors import DuplicateKeyError, BulkWriteError, \
+    OperationFailure
+import db.memory_db as mdb
+
+
+class MemoryDBTestCase(TestCase):
+    def setUp(self):
+        self.coll = mdb.MemoryClient()["testDB"]["users"]
+        self.coll.create_index("netid", unique=True, sparse=True)
+        for netid, year in (("ab1", 2020), ("cd2", 2021), ("ef3", 2022)):
+            self.coll.insert_one({"netid": netid, "year": year,
+                                  "badges": ["mill"], "dept": {"nm": "CS"}})
+
+    def test_find_filters(self):
+        self.assertEqual(self.coll.find_one({"netid": "cd2"})["year"], 2021)
+        self.assertEqual(self.coll.count_documents({"year": {"$gte": 2021}}),
+                         2)
+        self.assertEqual(self.coll.count_documents(
+            {"netid": {"$in": ["ab1", "zz9"]}}), 1)
+        self.assertEqual(self.coll.count_documents({"badges": "mill"}), 3)
+        self.assertEqual(self.coll.count_documents({"dept.nm": "CS"}), 3)
+        self.assertEqual(self.coll.count_documents(
+            {"$or": [{"netid": "ab1"}, {"year": 2022}]}), 2)
+        self.assertIsNone(self.coll.find_one({"netid": "zz9"}))
+
+    def test_sort_limit_project(self):
+        docs = list(self.coll.find({}, {"netid": 1, "_id": 0})
+                    .sort("year", -1).limit(2))
+        self.assertEqual(docs, [{"netid": "ef3"}, {"netid": "cd2"}])
+
+    def test_aggregate(self):
+        tools = self.coll.database["tools"]
+        tools.insert_many([{"tool": "mill", "room": 1},
+                           {"tool": "lathe", "room": 2}])
+        self.coll.update_one({"netid": "ab1"},
+                             {"$push": {"badges": "lathe"}})
+        docs = list(self.coll.aggregate([
+            {"$match": {"year": {"$lte": 2021}}},
+            {"$sort": {"year": -1}},
+            {"$project": {"_id": 0, "netid": 1, "badges": 1}},
+            {"$lookup": {"from": "tools", "localField": "badges",
+                         "foreignField": "tool", "as": "tools",
+                         "pipeline": [{"$project": {"_id": 0}}]}}]))
+        self.assertEqual([doc["netid"] for doc in docs], ["cd2", "ab1"])
+        self.assertEqual(docs[0]["tools"], [{"tool": "mill", "room": 1}])
+        self.assertEqual(len(docs[1]["tools"]), 2)
+        self.assertRaises(OperationFailure, self.coll.aggregate,
+                          [{"$bogus": {}}])
+
+    def test_returns_copies(self):
+        doc = self.coll.find_one({"netid": "ab1"})
+        doc["badges"].append("laser")
+        self.assertEqual(self.coll.find_one({"netid": "ab1"})["badges"],
+                         ["mill"])
+
+    def test_unique_index(self):
+        with self.assertRaises(DuplicateKeyError):
+            self.coll.insert_one({"netid": "ab1"})
+        with self.assertRaises(DuplicateKeyError):
+            self.coll.update_one({"netid": "cd2"}, {"$set": {"netid": "ab1"}})
+        # the failed update changed nothing:
+        self.assertIsNotNone(self.coll.find_one({"netid": "cd2"}))
+        # sparse: any number of documents may lack the field
+        self.coll.insert_one({"year": 1})
+        self.coll.insert_one({"year": 2})
+
+    def test_updates(self):
+        ret = self.coll.update_one({"netid": "ab1"},
+                                   {"$set": {"year": 2030},
+                                    "$addToSet": {"badges": "mill"},
+                                    "$inc": {"visits": 1}})
+        self.assertEqual((ret.matched_count, ret.modified_count), (1, 1))
+        doc = self.coll.find_one({"netid": "ab1"})
+        self.assertEqual((doc["year"], doc["badges"], doc["visits"]),
+                         (2030, ["mill"], 1))
+        ret = self.coll.update_many({}, {"$pull": {"badges": "mill"}})
+        self.assertEqual(ret.modified_count, 3)
+        ret = self.coll.update_one({"netid": "gh4"}, {"$set": {"year": 1}},
+                                   upsert=True)
+        self.assertIsNotNone(ret.upserted_id)
+        self.assertEqual(self.coll.find_one({"netid": "gh4"})["year"], 1)
+
+    def test_delete(self):
+        self.assertEqual(self.coll.delete_one({"netid": "ab1"})
+                         .deleted_count, 1)
+        self.assertEqual(self.coll.delete_many({}).deleted_count, 2)
+        # the index forgot the deleted key:
+        self.coll.insert_one({"netid": "ab1"})
+
+    def test_bulk_write(self):
+        with self.assertRaises(BulkWriteError) as ctx:
+            self.coll.bulk_write([InsertOne({"netid": "ab1"}),
+                                  InsertOne({"netid": "gh4"}),
+                                  UpdateOne({"netid": "gh4"},
+                                            {"$set": {"year": 1}}),
+                                  DeleteOne({"netid": "ef3"})],
+                                 ordered=False)
+        errors = ctx.exception.details["writeErrors"]
+        self.assertEqual([(err["index"], err["code"]) for err in errors],
+                         [(0, mdb.DUPLICATE_KEY)])
+        self.assertEqual(ctx.exception.details["nInserted"], 1)
+        self.assertEqual(ctx.exception.details["nRemoved"], 1)
+        with self.assertRaises(BulkWriteError):
+            self.coll.bulk_write([InsertOne({"netid": "ab1"}),
+                                  InsertOne({"netid": "ij5"})])
+        # ordered: nothing after the failure ran
+        self.assertIsNone(self.coll.find_one({"netid": "ij5"}))
+
+    def test_commands(self):
+        db = self.coll.database
+        self.assertEqual(db.client.admin.command("ping")["ok"], 1.0)
+        self.assertIn("isWritablePrimary", db.command("hello"))
+        with self.assertRaises(OperationFailure) as ctx:
+            db.watch()
+        self.assertEqual(ctx.exception.code, mdb.NO_CHANGE_STREAMS)
@@ -0,0 +1,144 @@
+"""
+This file holds the tests for mongo_port.py.
+"""
+import sys
+sys.path.insert(0, "../..")
+
+from unittest import TestCase
+import io
+import os
+import json
+import random
+import tempfile
+import datetime
+import db.db_connect as dbc
+import db.mongo_port as mongo_port
+
+HUGE_NUM = 1000000000000
+
+ENTITIES = {
+    "user1": {"firstname": "Test", "lastname": "User", "barcode": 999999},
+    "user, \"2\"": {"firstname": "{not: an object}", "tags": ["a", "}"]},
+    "ünïcode": {"nested": {"deep": [1, 2.5, {"x": None}]}, "ok": True},
+    "dated": {"when": {"$date": "2022-01-02T03:04:05Z"}},
+    "empty": {},
+    "big": {"number": 12345678901234567890},
+}
+
+
+def new_entity_name(entity_type):
+    """
+    Randomly create entity name for test
+    """
+    int_name = random.randint(0, HUGE_NUM)
+    return f"new{entity_type}" + str(int_name)
+
+
+class FailingCollection:
+    """
+    A collection that fails after writing `batches` batches, as an
+    import interrupted part way would.
+    """
+
+    def __init__(self, collection, batches):
+        self.collection = collection
+        self.batches = batches
+
+    def bulk_write(self, ops, ordered=True):
+        if self.batches == 0:
+            raise RuntimeError("interrupted")
+        self.batches -= 1
+        return self.collection.bulk_write(ops, ordered=ordered)
+
+
+class EntityReaderTestCase(TestCase):
+    def test_tiny_chunks(self):
+        """
+        Whatever the chunk size, values that straddle chunk boundaries
+        (keys, strings with braces and quotes, numbers, extended JSON)
+        parse as the whole file would.
+        """
+        text = json.dumps(ENTITIES, indent=4, ensure_ascii=False)
+        expected = list(ENTITIES.items())
+        expected[3] = ("dated", {"when": datetime.datetime(
+            2022, 1, 2, 3, 4, 5)})
+        for chunk_size in range(1, 20):
+            reader = mongo_port.EntityReader(io.StringIO(text), chunk_size)
+            self.assertEqual(list(reader), expected, chunk_size)
+
+    def test_number_at_chunk_end(self):
+        """
+        A number cut by the end of a chunk is read whole.
+        """
+        reader = mongo_port.EntityReader(io.StringIO('{"a": 123456}'), 9)
+        self.assertEqual(list(reader), [("a", 123456)])
+
+    def test_empty_object(self):
+        reader = mongo_port.EntityReader(io.StringIO(" { } "), 1)
+        self.assertEqual(list(reader), [])
+
+    def test_bad_json(self):
+        for text in ('[1, 2]', '{"a": 1 "b": 2}', '{1: 2}', '{"a": '):
+            with self.assertRaises(ValueError):
+                list(mongo_port.EntityReader(io.StringIO(text), 2))
+
+
+class PortTestCase(TestCase):
+    def setUp(self):
+        self.collect_nm = new_entity_name("port")
+        self.collection = dbc.get_client()[dbc.db_nm][self.collect_nm]
+        self.dir = tempfile.TemporaryDirectory()
+        self.json_file = os.path.join(self.dir.name, "users.json")
+        self.entities = {f"user{i:03d}": {"num": i} for i in range(25)}
+        with open(self.json_file, "w") as file:
+            json.dump(self.entities, file)
+
+    def tearDown(self):
+        self.collection.drop()
+        self.dir.cleanup()
+
+    def imported(self):
+        return {doc["netid"]: doc["num"]
+                for doc in self.collection.find({}, {"_id": 0})}
+
+    def test_port(self):
+        written = mongo_port.port(self.collection, self.json_file, "netid",
+                                  batch_size=4, workers=3)
+        self.assertEqual(written, 25)
+        self.assertEqual(self.imported(),
+                         {key: val["num"]
+                          for key, val in self.entities.items()})
+        self.assertFalse(os.path.exists(self.json_file + ".checkpoint"))
+        # re-running never duplicates a record:
+        mongo_port.port(self.collection, self.json_file, "netid",
+                        batch_size=7)
+        self.assertEqual(self.collection.count_documents({}), 25)
+
+    def test_resume(self):
+        """
+        An interrupted import picks up after its last checkpoint and
+        ends with every record written once.
+        """
+        failing = FailingCollection(self.collection, 2)
+        with self.assertRaises(RuntimeError):
+            mongo_port.port(failing, self.json_file, "netid", batch_size=5)
+        checkpoint = self.json_file + ".checkpoint"
+        with open(checkpoint) as file:
+            self.assertEqual(json.load(file)["done"], 10)
+        written = mongo_port.port(self.collection, self.json_file, "netid",
+                                  batch_size=5)
+        self.assertEqual(written, 15)
+        self.assertEqual(len(self.imported()), 25)
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_checkpoint_of_other_file(self):
+        """
+        A checkpoint written for another file is refused, not used to
+        skip records of this one.
+        """
+        checkpoint = os.path.join(self.dir.name, "import.checkpoint")
+        mongo_port.write_checkpoint(checkpoint, "other.json", 10)
+        with self.assertRaises(mongo_port.CheckpointError):
+            mongo_port.port(self.collection, self.json_file, "netid",
+                            checkpoint=checkpoint)
+        self.assertEqual(self.collection.count_documents({}), 0)
@@ -0,0 +1,76 @@
+"""
+This file holds the tests for mongo_view.py.
+"""
+import sys
+sys.path.insert(0, "../..")
+
+from unittest import TestCase
+import io
+import os
+import random
+import tempfile
+import datetime
+from bson import ObjectId
+import bson.json_util as bsutil
+import db.db_connect as dbc
+import db.mongo_port as mongo_port
+import db.mongo_view as mongo_view
+
+HUGE_NUM = 1000000000000
+
+
+def new_entity_name(entity_type):
+    """
+    Randomly create entity name for test
+    """
+    int_name = random.randint(0, HUGE_NUM)
+    return f"new{entity_type}" + str(int_name)
+
+
+class MongoViewTestCase(TestCase):
+    def setUp(self):
+        client = dbc.get_client()
+        self.source = client[dbc.db_nm][new_entity_name("view")]
+        self.target = client[dbc.db_nm][new_entity_name("view")]
+        self.docs = [
+            {"netid": "ab123", "name": "Str key",
+             "joined": datetime.datetime(2022, 1, 2, 3, 4, 5)},
+            {"netid": 123, "name": "Int key", "tags": ["a", "b"]},
+            {"netid": ObjectId(), "name": "ObjectId key"},
+            {"netid": "123", "name": "Looks like the int key"},
+        ]
+        self.source.insert_many([dict(doc) for doc in self.docs])
+
+    def tearDown(self):
+        self.source.drop()
+        self.target.drop()
+
+    def stored(self, collection):
+        return sorted((doc for doc in collection.find({}, {"_id": 0})),
+                      key=lambda doc: doc["name"])
+
+    def test_keyed_round_trip(self):
+        """
+        A keyed export imports back as it was, key types and all.
+        """
+        out = io.StringIO()
+        count = mongo_view.export(self.source, out, out_format=mongo_view.KEYED,
+                                  key_name="netid", batch_size=2)
+        self.assertEqual(count, len(self.docs))
+        with tempfile.TemporaryDirectory() as tmp:
+            json_file = os.path.join(tmp, "export.json")
+            with open(json_file, "w") as file:
+                file.write(out.getvalue())
+            mongo_port.port(self.target, json_file, "netid", batch_size=3)
+            # importing again replaces each record in place:
+            mongo_port.port(self.target, json_file, "netid")
+        self.assertEqual(self.stored(self.target), self.stored(self.source))
+
+    def test_ndjson(self):
+        out = io.StringIO()
+        mongo_view.export(self.source, out, filters={"name": "Int key"},
+                          fields=["netid", "tags"])
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(bsutil.loads(lines[0]),
+                         {"netid": 123, "tags": ["a", "b"]})
@@ -0,0 +1,126 @@
+"""
+This file holds the tests for notifier.py.
+"""
+import sys
+sys.path.insert(0, "../..")
+
+from unittest import TestCase
+import os
+import json
+import random
+import tempfile
+import db.db_connect as dbc
+import db.data as db
+import db.jobs as jobs
+import db.progress as progress
+import db.attendance as attendance
+import db.notifier as notifier
+
+HUGE_NUM = 1000000000000
+
+
+def new_entity_name(entity_type):
+    """
+    Randomly create entity name for test
+    """
+    int_name = random.randint(0, HUGE_NUM)
+    return f"new {entity_type}" + str(int_name)
+
+
+class ListSender:
+    def __init__(self, fail=False):
+        self.sent = []
+        self.fail = fail
+
+    def send(self, notifications):
+        if self.fail:
+            raise RuntimeError("cannot send")
+        self.sent.extend(notifications)
+
+
+class NotifierTestCase(TestCase):
+    def setUp(self):
+        self.delay = progress.NOTIFY_DELAY_SECS
+        progress.NOTIFY_DELAY_SECS = 0
+        self.netid = new_entity_name('user')
+        db.add_user(self.netid, "first", "last")
+        self.training = new_entity_name('training')
+        db.add_training(self.training)
+        self.badges = [new_entity_name('badge'), new_entity_name('badge')]
+        for badge in self.badges:
+            db.add_badge(badge, "a badge", [self.training])
+
+    def tearDown(self):
+        progress.NOTIFY_DELAY_SECS = self.delay
+        db.del_user(self.netid)
+        db.del_training(self.training)
+        for badge in self.badges:
+            db.del_badge(badge)
+        dbc.del_many(db.JOBS, {jobs.KEY: self.netid})
+
+    def sent_to_us(self, sender):
+        return [note for note in sender.sent
+                if note[db.NETID] == self.netid]
+
+    def earn(self):
+        attendance.record_attendance(self.netid, progress.TRAINING,
+                                     self.training)
+
+    def test_earning_queues_one_job(self):
+        self.earn()
+        self.assertEqual(dbc.count(db.JOBS, {jobs.KEY: self.netid}), 1)
+
+    def test_no_job_until_earned(self):
+        other = new_entity_name('training')
+        db.add_training(other)
+        try:
+            attendance.record_attendance(self.netid, progress.TRAINING,
+                                         other)
+        finally:
+            db.del_training(other)
+        self.assertEqual(dbc.count(db.JOBS, {jobs.KEY: self.netid}), 0)
+
+    def test_run_batch(self):
+        self.earn()
+        sender = ListSender()
+        while notifier.run_batch(sender):
+            pass
+        notes = self.sent_to_us(sender)
+        self.assertEqual(len(notes), 1)
+        self.assertEqual(sorted(notes[0][notifier.BADGES]),
+                         sorted(self.badges))
+        self.assertEqual(notes[0][db.FIRST_NM], "first")
+        for badge in self.badges:
+            rec = attendance.get_badge_progress(self.netid, badge)
+            self.assertTrue(rec[progress.NOTIFIED])
+        # nothing is sent twice:
+        self.earn()
+        notifier.run_batch(sender)
+        self.assertEqual(len(self.sent_to_us(sender)), 1)
+
+    def test_send_fails(self):
+        self.earn()
+        while notifier.run_batch(ListSender(fail=True)):
+            pass
+        rec = attendance.get_badge_progress(self.netid, self.badges[0])
+        self.assertFalse(rec[progress.NOTIFIED])
+        job = dbc.fetch_one(db.JOBS, {jobs.KEY: self.netid})
+        self.assertEqual(job[jobs.STATUS], jobs.PENDING)
+
+    def test_sweep(self):
+        self.earn()
+        dbc.del_many(db.JOBS, {jobs.KEY: self.netid})
+        self.assertIn(self.netid, notifier.sweep())
+        self.assertEqual(dbc.count(db.JOBS, {jobs.KEY: self.netid}), 1)
+
+    def test_file_sender(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "notes.jsonl")
+            sender = notifier.get_sender(f"file:{path}")
+            sender.send([{db.NETID: self.netid, notifier.BADGES: ["b"]}])
+            with open(path) as notes:
+                self.assertEqual(json.loads(notes.readline())[db.NETID],
+                                 self.netid)
+
+    def test_unknown_sender(self):
+        self.assertRaises(ValueError, notifier.get_sender, "pigeon")
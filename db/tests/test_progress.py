@@ -0,0 +1,166 @@
+"""
+This file holds the tests for progress.py.
+"""
+import sys
+sys.path.insert(0, "../..")
+
+from unittest import TestCase
+import random
+import db.data as db
+import db.db_connect as dbc
+import db.progress as progress
+import db.attendance as attendance
+
+HUGE_NUM = 1000000000000
+
+
+def new_entity_name(entity_type):
+    """
+    Randomly create entity name for test
+    """
+    int_name = random.randint(0, HUGE_NUM)
+    return f"new {entity_type}" + str(int_name)
+
+
+class ProgressTestCase(TestCase):
+    def setUp(self):
+        self.netid = new_entity_name('user')
+        db.add_user(self.netid, "first", "last")
+        self.trainings = [new_entity_name('training'),
+                          new_entity_name('training')]
+        self.workshop = new_entity_name('workshop')
+        self.badge = new_entity_name('badge')
+        db.add_badge(self.badge, "a badge", self.trainings, [self.workshop])
+
+    def tearDown(self):
+        db.del_user(self.netid)
+        db.del_badge(self.badge)
+
+    def test_not_started(self):
+        """
+        A badge not started yet needs everything it requires.
+        """
+        self.assertEqual(progress.get_progress(self.netid), {})
+        badge = attendance.get_badge_progress(self.netid, self.badge)
+        self.assertEqual(badge[progress.REMAINING], 3)
+        self.assertFalse(badge[progress.EARNED])
+
+    def test_record_completion(self):
+        badges = progress.record_completion(self.netid, progress.TRAINING,
+                                            self.trainings[0])
+        self.assertEqual(badges, [self.badge])
+        # completing the same training again changes nothing:
+        progress.record_completion(self.netid, progress.TRAINING,
+                                   self.trainings[0])
+        badge = progress.get_progress(self.netid)[self.badge]
+        self.assertEqual(badge[progress.REMAINING], 2)
+        self.assertEqual(badge[progress.TRAININGS_LEFT], self.trainings[1:])
+        self.assertEqual(badge[progress.WORKSHOPS_LEFT], [self.workshop])
+
+    def test_earned(self):
+        for training in self.trainings:
+            progress.record_completion(self.netid, progress.TRAINING,
+                                       training)
+        progress.record_completion(self.netid, progress.WORKSHOP,
+                                   self.workshop)
+        badge = attendance.get_badge_progress(self.netid, self.badge)
+        self.assertEqual(badge[progress.REMAINING], 0)
+        self.assertTrue(badge[progress.EARNED])
+        self.assertIn(progress.EARNED_AT, badge)
+
+    def test_racing_start(self):
+        """
+        When someone makes a user's progress record as we do, the
+        clash does not cost the other users their completion.
+        """
+        netids = [self.netid, new_entity_name('user'),
+                  new_entity_name('user')]
+        bulk_write = dbc.bulk_write
+
+        def racing(collect_nm, ops, ordered=False, session=None):
+            # the server as another writer wins the first upsert:
+            dbc.bulk_write = bulk_write
+            progress.record_completion(self.netid, progress.WORKSHOP,
+                                       self.workshop)
+            failures = {0: dbc.DUPLICATE_KEY}
+            if ordered:
+                failures.update({index: None
+                                 for index in range(1, len(ops))})
+                return None, failures
+            bulk_write(collect_nm, ops[1:], ordered, session)
+            return None, failures
+
+        dbc.bulk_write = racing
+        self.addCleanup(setattr, dbc, "bulk_write", bulk_write)
+        progress.record_completions(netids, progress.TRAINING,
+                                    self.trainings[0])
+        for netid in netids:
+            badge = progress.get_progress(netid)[self.badge]
+            self.assertEqual(badge[progress.TRAININGS_LEFT],
+                             self.trainings[1:], netid)
+        for netid in netids[1:]:
+            dbc.del_many(db.PROGRESS, {db.NETID: netid})
+
+    def test_not_required(self):
+        self.assertEqual(progress.record_completion(
+            self.netid, progress.WORKSHOP, new_entity_name('workshop')), [])
+
+    def test_rebuild(self):
+        progress.rebuild(self.netid, {(progress.WORKSHOP, self.workshop)})
+        badge = attendance.get_badge_progress(self.netid, self.badge)
+        self.assertEqual(badge[progress.REMAINING], 2)
+        self.assertEqual(badge[progress.WORKSHOPS_LEFT], [])
+
+    def test_deleted_with_user(self):
+        progress.record_completion(self.netid, progress.WORKSHOP,
+                                   self.workshop)
+        db.del_user(self.netid)
+        self.assertEqual(progress.get_progress(self.netid), {})
+
+    def test_rename_clash_undone(self):
+        """
+        A rename whose references clash changes nothing, even where
+        there are no transactions to undo it.
+        """
+        badge = new_entity_name('badge')
+        db.add_badge(badge, "another badge", [], [self.workshop])
+        self.addCleanup(db.del_badge, badge)
+        progress.record_completion(self.netid, progress.WORKSHOP,
+                                   self.workshop)
+        netid = new_entity_name('user')
+        # a record left by an earlier user of that netid:
+        dbc.insert_doc(db.PROGRESS, {db.NETID: netid, db.BADGES_NM: badge})
+        self.addCleanup(dbc.del_many, db.PROGRESS, {db.NETID: netid})
+        self.assertEqual(db.update_user(self.netid, netid), db.DUPLICATE)
+        self.assertEqual(db.bulk_rename(db.USERS, [(self.netid, netid)]),
+                         [db.DUPLICATE])
+        self.assertTrue(db.netid_exists(self.netid))
+        self.assertFalse(db.netid_exists(netid))
+        self.assertEqual(set(progress.get_progress(self.netid)),
+                         {self.badge, badge})
+        self.assertEqual(set(progress.get_progress(netid)), {badge})
+
+    def test_bulk_deleted_with_users(self):
+        netids = [self.netid, new_entity_name('user')]
+        db.add_user(netids[1], "first", "last")
+        progress.record_completions(netids, progress.WORKSHOP,
+                                    self.workshop)
+        self.assertEqual(db.bulk_delete(db.USERS, netids), [db.OK, db.OK])
+        self.assertEqual(dbc.count(db.PROGRESS,
+                                   {db.NETID: {"$in": netids}}), 0)
+
+    def test_deleted_with_badge(self):
+        progress.record_completion(self.netid, progress.WORKSHOP,
+                                   self.workshop)
+        db.del_badge(self.badge)
+        self.assertEqual(progress.get_progress(self.netid), {})
+
+    def test_bulk_deleted_with_badges(self):
+        badge = new_entity_name('badge')
+        db.add_badge(badge, "another badge", [], [self.workshop])
+        progress.record_completion(self.netid, progress.WORKSHOP,
+                                   self.workshop)
+        self.assertEqual(len(progress.get_progress(self.netid)), 2)
+        self.assertEqual(db.bulk_delete(db.BADGES, [self.badge, badge]),
+                         [db.OK, db.OK])
+        self.assertEqual(progress.get_progress(self.netid), {})
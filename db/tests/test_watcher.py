@@ -0,0 +1,68 @@
+"""
+This file holds the tests for watcher.py.
+"""
+import sys
+sys.path.insert(0, "../..")
+
+from unittest import TestCase
+import db.cache as cache
+import db.data as db
+import db.watcher as watcher
+import random
+
+HUGE_NUM = 10000000000000
+
+
+def new_entity_name(entity_type):
+    """
+    Randomly create entity name for test
+    """
+    int_name = random.randint(0, HUGE_NUM)
+    return f"new{entity_type}" + str(int_name)
+
+
+class WatcherTestCase(TestCase):
+    def test_apply_change(self):
+        """
+        A change to a collection invalidates that collection's cache only.
+        """
+        badges = cache.get_cache(db.BADGES).stats()["invalidations"]
+        trainings = cache.get_cache(db.TRAININGS).stats()["invalidations"]
+        watcher.apply_change({"operationType": "update",
+                              "ns": {"db": "test_maysDB", "coll": db.BADGES}})
+        self.assertEqual(cache.get_cache(db.BADGES).stats()["invalidations"],
+                         badges + 1)
+        self.assertEqual(
+            cache.get_cache(db.TRAININGS).stats()["invalidations"], trainings)
+
+    def test_apply_drop_database(self):
+        trainings = cache.get_cache(db.TRAININGS).stats()["invalidations"]
+        watcher.apply_change({"operationType": "dropDatabase",
+                              "ns": {"db": "test_maysDB"}})
+        self.assertEqual(
+            cache.get_cache(db.TRAININGS).stats()["invalidations"],
+            trainings + 1)
+
+    def test_poll(self):
+        """
+        A polling process sees a write counted by another, and drops
+        the cache of that collection only.
+        """
+        poller = watcher.CacheWatcher()
+        db.on_change(watcher.count_write)
+        try:
+            versions = poller.poll(None)
+            trainings = cache.get_cache(db.TRAININGS).stats()
+            badges = cache.get_cache(db.BADGES).stats()
+            name = new_entity_name("training")
+            db.add_training(name)
+            poller.poll(versions)
+        finally:
+            db.change_hooks.remove(watcher.count_write)
+        # once by our own write, once by the poll:
+        self.assertEqual(
+            cache.get_cache(db.TRAININGS).stats()["invalidations"],
+            trainings["invalidations"] + 2)
+        self.assertEqual(cache.get_cache(db.BADGES).stats()["invalidations"],
+                         badges["invalidations"])
+        db.del_training(name)
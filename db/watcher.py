@@ -0,0 +1,149 @@
+"""
+This file keeps the caches of this process fresh when another process
+(say, another gunicorn worker) writes to a cached collection.
+A background thread follows a Mongo change stream and invalidates the
+cache of each collection that changes. Servers without change streams
+(a standalone local mongod, with LOCAL_MONGO=1) are polled instead: a
+polling process counts its writes to each cached collection
+(`db_connect.bump_version()`), and polls those counts.
+Only writes made through data.py are counted; others show up when
+the cache entries expire.
+The watcher is off unless MAYS_CACHE_WATCH=1.
+"""
+import os
+import threading
+from pymongo.errors import OperationFailure, PyMongoError
+
+import db.db_connect as dbc
+import db.cache as cache
+import db.data as data
+
+WATCH_ON = os.environ.get("MAYS_CACHE_WATCH", "0") == "1"
+POLL_SECS = float(os.environ.get("MAYS_WATCH_POLL_SECS", 5))
+RETRY_SECS = 5
+
+# server error code: "The $changeStream stage is only supported on
+# replica sets"
+NO_CHANGE_STREAMS = 40573
+
+# the collections we cache:
+WATCHED = data.CATALOGS
+
+watcher = None
+
+
+def apply_change(change):
+    """
+    Invalidate the cache a change event touches. Events without a
+    collection (the database was dropped, say) invalidate everything.
+    """
+    collect_nm = change.get("ns", {}).get("coll")
+    if collect_nm is None:
+        cache.invalidate_all()
+    else:
+        cache.invalidate(collect_nm)
+
+
+class CacheWatcher(threading.Thread):
+    """
+    The thread that follows changes to the watched collections.
+    """
+
+    def __init__(self):
+        super().__init__(name="mays-cache-watcher", daemon=True)
+        self.stopping = threading.Event()
+        self.resume_token = None
+        self.polling = False
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                self.follow_changes()
+            except OperationFailure as err:
+                if err.code == NO_CHANGE_STREAMS:
+                    print("No change streams on this server: polling.")
+                    self.poll_changes()
+                    return
+                # our resume point may be gone: start afresh.
+                self.retry(err)
+                self.resume_token = None
+            except PyMongoError as err:
+                self.retry(err)
+
+    def retry(self, err):
+        """
+        We may have missed changes while the stream was down,
+        so drop everything before trying again.
+        """
+        print(f"Cache watcher lost its change stream: {err}")
+        cache.invalidate_all()
+        self.stopping.wait(RETRY_SECS)
+
+    def follow_changes(self):
+        with dbc.watch(WATCHED, self.resume_token) as stream:
+            while stream.alive and not self.stopping.is_set():
+                change = stream.try_next()
+                if change is not None:
+                    apply_change(change)
+                self.resume_token = stream.resume_token
+
+    def poll_changes(self):
+        """
+        Compare the write counts of the watched collections every
+        POLL_SECS. If we cannot get them, drop every cache.
+        """
+        self.polling = True
+        data.on_change(count_write)
+        versions = None
+        while not self.stopping.wait(POLL_SECS):
+            versions = self.poll(versions)
+
+    def poll(self, versions):
+        """
+        Invalidate the caches of the collections whose write counts
+        differ from `versions` (None: we have nothing to compare yet).
+        Returns the new counts.
+        """
+        try:
+            new_versions = dbc.collection_versions(WATCHED)
+        except PyMongoError as err:
+            print(f"Cache watcher could not poll: {err}")
+            cache.invalidate_all()
+            return None
+        if versions is not None:
+            for collect_nm in WATCHED:
+                if new_versions.get(collect_nm) != versions.get(collect_nm):
+                    cache.invalidate(collect_nm)
+        return new_versions
+
+    def stop(self):
+        self.stopping.set()
+
+
+def count_write(collect_nm):
+    """
+    Count a write of ours to a watched collection, so that polling
+    processes see it.
+    """
+    if collect_nm in WATCHED:
+        try:
+            dbc.bump_version(collect_nm)
+        except PyMongoError as err:
+            print(f"Could not count a write to {collect_nm}: {err}")
+
+
+def start():
+    """
+    Start the watcher of this process, if it is not running already.
+    Threads do not survive a fork, so a forked worker starts its own.
+    """
+    global watcher
+    if watcher is None or not watcher.is_alive():
+        watcher = CacheWatcher()
+        watcher.start()
+    return watcher
+
+
+def stop():
+    if watcher is not None:
+        watcher.stop()
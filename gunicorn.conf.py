@@ -0,0 +1,150 @@
+"""
+Gunicorn settings: gunicorn reads this file from the directory it is
+started in (see the Procfile).
+The worker model is set by MAYS_WORKER_CLASS:
+    sync     one request at a time per worker process
+    gthread  MAYS_THREADS requests at a time per worker (the default)
+    gevent   up to MAYS_WORKER_CONNECTIONS requests per worker, on
+             greenlets (needs `pip install gevent`)
+MAYS_WORKERS (or WEB_CONCURRENCY) sets the number of workers; by
+default it follows the CPUs we may run on.
+`python3 -m bench.worker_models` compares the models on this machine.
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+WORKER_CLASSES = ("sync", "gthread", "gevent")
+DEF_WORKER_CLASS = "gthread"
+DEF_THREADS = 4
+DEF_WORKER_CONNECTIONS = 100
+
+
+def env_int(name, default):
+    return int(os.environ.get(name) or default)
+
+
+def cpu_count():
+    """
+    The CPUs this process may run on, which can be fewer than the
+    machine has (a container, a dyno).
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def default_workers(model, cpus):
+    """
+    A blocking sync worker needs spares to keep the CPUs busy while
+    others wait on Mongo; a threaded or gevent worker waits on Mongo
+    without blocking, so one per CPU (and a spare) will do.
+    """
+    if model == "sync":
+        return 2 * cpus + 1
+    return cpus + 1
+
+
+worker_class = os.environ.get("MAYS_WORKER_CLASS") or DEF_WORKER_CLASS
+if worker_class not in WORKER_CLASSES:
+    raise ValueError(f"MAYS_WORKER_CLASS must be one of {WORKER_CLASSES}, "
+                     f"not {worker_class}.")
+workers = env_int("MAYS_WORKERS", os.environ.get("WEB_CONCURRENCY")
+                  or default_workers(worker_class, cpu_count()))
+threads = env_int("MAYS_THREADS",
+                  DEF_THREADS if worker_class == "gthread" else 1)
+worker_connections = env_int("MAYS_WORKER_CONNECTIONS",
+                             DEF_WORKER_CONNECTIONS)
+
+# requests one worker serves at once, each of which may hold a Mongo
+# connection: size the pool to match, unless told otherwise.
+concurrency = {"sync": 1, "gthread": threads,
+               "gevent": worker_connections}[worker_class]
+os.environ.setdefault("MONGO_MAX_POOL_SIZE", str(max(10, concurrency)))
+
+# Load the app once in the master, so workers fork with it ready (and
+# share its memory). gevent must patch the standard library before
+# the app (and pymongo) is imported, so it loads the app per worker.
+preload_app = os.environ.get("MAYS_PRELOAD",
+                             str(worker_class != "gevent")).lower() \
+    in ("1", "true", "yes")
+
+# A worker silent this long is killed and replaced. It must outlast a
+# Mongo call that gives up on its own (MONGO_SERVER_SELECTION_TIMEOUT_MS
+# and MONGO_WAIT_QUEUE_TIMEOUT_MS), so that call can answer with an
+# error instead.
+timeout = env_int("MAYS_TIMEOUT", 30)
+# How long workers may finish their requests after a restart or
+# SIGTERM. Heroku kills a dyno 30 seconds after SIGTERM.
+graceful_timeout = env_int("MAYS_GRACEFUL_TIMEOUT", 25)
+# Seconds to hold an idle connection from the router open for its next
+# request (the sync worker does not keep connections alive).
+keepalive = env_int("MAYS_KEEPALIVE", 5)
+
+# each worker keeps its metrics in files here, so /metrics can add up
+# all workers (see API/metrics.py):
+metrics_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR",
+    os.path.join(tempfile.gettempdir(), "mays-metrics"))
+# Clear out the files of an earlier run now, before the app (whose
+# metrics open files here) is loaded. A reload (SIGHUP) reads this file
+# again in the same master, whose preloaded app keeps its files.
+if os.environ.get("MAYS_METRICS_OWNER") != str(os.getpid()):
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.environ["MAYS_METRICS_OWNER"] = str(os.getpid())
+os.makedirs(metrics_dir, exist_ok=True)
+
+
+def when_ready(server):
+    """
+    With preload_app, importing the app may have started the cache
+    watcher and connected to Mongo in the master. Neither is any use
+    to it, and the sockets must not be shared with the workers: stop
+    the watcher and close the client before the workers fork.
+    The in-memory backend keeps its client, which holds the data.
+    """
+    if "db.watcher" in sys.modules:
+        sys.modules["db.watcher"].stop()
+    dbc = sys.modules.get("db.db_connect")
+    if dbc is not None and dbc.BACKEND != dbc.MEMORY:
+        dbc.close_client()
+
+
+def after_fork():
+    """
+    Make this worker open its own Mongo client (and so its own pool),
+    lazily on its first query, and start its own cache watcher if the
+    app is loaded and wants one.
+    Nothing here waits on Mongo, so a worker boots (and /health answers)
+    even when Mongo is down; the indexes are built out of band (see
+    db/build_indexes.py).
+    """
+    dbc = sys.modules.get("db.db_connect")
+    if dbc is not None:
+        # drops an inherited client, where os.register_at_fork did not:
+        dbc.forget_client()
+    if "db.watcher" in sys.modules:
+        watcher = sys.modules["db.watcher"]
+        if watcher.WATCH_ON:
+            watcher.start()
+
+
+def post_fork(server, worker):
+    # a gevent worker has not patched the standard library yet:
+    # it starts in post_worker_init instead.
+    if worker_class != "gevent":
+        after_fork()
+
+
+def post_worker_init(worker):
+    if worker_class == "gevent":
+        after_fork()
+
+
+def child_exit(server, worker):
+    """
+    Drop the live gauges (requests in flight...) of a dead worker.
+    """
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)